@@ -1,4 +1,7 @@
+import email.utils
+import gzip
 import os
+import zlib
 
 class HTTPHandler:
     """
@@ -16,26 +19,261 @@ class HTTPHandler:
         ".json": "application/json",
     }
 
+    # Persistent connections: how many seconds an idle connection is kept open while
+    # waiting for the next request, and how many requests one connection may carry.
+    KEEP_ALIVE_TIMEOUT = 5
+    MAX_KEEP_ALIVE_REQUESTS = 100
+
+    # A Range header asking for more ranges than this is ignored, and the whole file is sent
+    MAX_RANGES = 16
+
+    # Compression: the encodings the server can produce, in order of preference, and the
+    # smallest body worth compressing. Only text and JSON are compressed, since images
+    # and the like are usually compressed already.
+    SUPPORTED_ENCODINGS = ("gzip", "deflate")
+    COMPRESSION_MIN_SIZE = 1024
+    COMPRESSION_LEVEL = 6
+    COMPRESSIBLE_TYPES = ("text/", "application/json")
+
     @staticmethod
-    def create_response_header(response, content_type, content_length):
+    def create_response_header(response, content_type, content_length, keep_alive=False, extra_headers=None):
         """
         Create an HTTP response header.
 
         Args:
             response (str): The HTTP response status (e.g., '200 OK', '404 Not Found').
-            content_type (str): The content type of the response (e.g., 'application/json').
-            content_length (int): The length of the response content.
+            content_type (str): The content type of the response (e.g., 'application/json'),
+                or None to leave out the Content-Type header.
+            content_length (int): The length of the response content, or None to leave out
+                the Content-Length header.
+            keep_alive (bool): Whether the connection stays open after this response.
+            extra_headers (dict): Further header names and values (e.g., {'ETag': '"abc"'}).
 
         Returns:
             bytes: The HTTP response header as bytes.
         """
-        response_header = (
-            f'HTTP/1.1 {response}\r\n'.encode() +
-            f'Content-Length: {content_length}\r\n'.encode() +
-            f'Content-Type: {content_type}\r\n\r\n'.encode()
+        # The status line, Content-Type line and connection lines are built once and reused
+        status_line = STATUS_LINES.get(response)
+        if status_line is None:
+            status_line = f'HTTP/1.1 {response}\r\n'.encode()
+        response_header = [status_line]
+
+        if content_length is not None:
+            response_header.append(b'Content-Length: %d\r\n' % content_length)
+        if content_type is not None:
+            content_type_line = CONTENT_TYPE_LINES.get(content_type)
+            if content_type_line is None:
+                content_type_line = f'Content-Type: {content_type}\r\n'.encode()
+            response_header.append(content_type_line)
+        if extra_headers:
+            response_header.append(''.join(f'{name}: {value}\r\n' for name, value in extra_headers.items()).encode())
+        response_header.append(HEADER_ENDINGS[keep_alive])
+
+        return b''.join(response_header)
+
+    @staticmethod
+    def connection_header(keep_alive):
+        """
+        Create the Connection (and Keep-Alive) header lines for a response.
+
+        Args:
+            keep_alive (bool): Whether the connection stays open after the response.
+
+        Returns:
+            str: The header lines, each terminated by CRLF.
+        """
+        if not keep_alive:
+            return 'Connection: close\r\n'
+
+        return (
+            'Connection: keep-alive\r\n'
+            f'Keep-Alive: timeout={HTTPHandler.KEEP_ALIVE_TIMEOUT}, max={HTTPHandler.MAX_KEEP_ALIVE_REQUESTS}\r\n'
         )
 
-        return response_header
+    @staticmethod
+    def etag_matches(if_none_match, etag):
+        """
+        Check whether an If-None-Match request header matches the current ETag of a resource.
+
+        Args:
+            if_none_match (str): The value of the If-None-Match header, or None if it was not sent.
+            etag (str): The current ETag, including its quotes (e.g., '"abc"').
+
+        Returns:
+            bool: True if the client already has the current version (so 304 can be sent).
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+
+        # Weak validators (W/"abc") are compared by their opaque part, as a GET allows
+        candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+        return any(candidate.removeprefix('W/') == etag for candidate in candidates)
+
+    @staticmethod
+    def not_modified_since(if_modified_since, mtime):
+        """
+        Check whether a resource has not been modified since the date in an If-Modified-Since header.
+
+        Args:
+            if_modified_since (str): The value of the If-Modified-Since header, or None if it was not sent.
+            mtime (float): The modification time of the resource, as a Unix timestamp.
+
+        Returns:
+            bool: True if the client already has the current version (so 304 can be sent).
+        """
+        if not if_modified_since:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            # An invalid date is ignored, as if the header was not sent
+            return False
+        if since.tzinfo is None:
+            return False
+
+        # HTTP dates have a resolution of one second
+        return int(mtime) <= since.timestamp()
+
+    @staticmethod
+    def http_date(timestamp):
+        """
+        Format a Unix timestamp as an HTTP date (e.g., 'Sun, 06 Nov 1994 08:49:37 GMT').
+        """
+        return email.utils.formatdate(timestamp, usegmt=True)
+
+    @staticmethod
+    def parse_range(range_header, size):
+        """
+        Parse a Range request header (e.g., 'bytes=0-499,1000-') for a resource of a given size.
+
+        Args:
+            range_header (str): The value of the Range header.
+            size (int): The size of the resource in bytes.
+
+        Returns:
+            list: The satisfiable ranges as (first byte, last byte) pairs, which is empty if
+            none of the ranges can be satisfied (so 416 should be sent). None if the header
+            is invalid or asks for too many ranges, in which case it is ignored.
+        """
+        unit, _, range_set = range_header.partition('=')
+        if unit.strip().lower() != 'bytes':
+            return None
+
+        specs = [spec.strip() for spec in range_set.split(',') if spec.strip()]
+        if not specs or len(specs) > HTTPHandler.MAX_RANGES:
+            return None
+
+        ranges = []
+        for spec in specs:
+            first, dash, last = spec.partition('-')
+            first, last = first.strip(), last.strip()
+            if not dash or not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+                return None
+
+            if first == '':
+                # A suffix range, e.g. 'bytes=-500' is the last 500 bytes
+                if last == '':
+                    return None
+                suffix_length = int(last)
+                if suffix_length == 0 or size == 0:
+                    continue
+                ranges.append((max(size - suffix_length, 0), size - 1))
+            else:
+                start = int(first)
+                if last and int(last) < start:
+                    return None
+                if start >= size:
+                    continue
+                end = min(int(last), size - 1) if last else size - 1
+                ranges.append((start, end))
+
+        return ranges
+
+    @staticmethod
+    def is_compressible(content_type, content_length):
+        """
+        Check whether a body is worth compressing.
+
+        Args:
+            content_type (str): The content type of the body, or None if it is not known.
+            content_length (int): The length of the body.
+
+        Returns:
+            bool: True if the body should be compressed for clients that accept it.
+        """
+        if content_type is None or content_length < HTTPHandler.COMPRESSION_MIN_SIZE:
+            return False
+        return content_type.startswith(HTTPHandler.COMPRESSIBLE_TYPES)
+
+    @staticmethod
+    def negotiate_encoding(accept_encoding):
+        """
+        Choose the content encoding for a response from an Accept-Encoding request header.
+
+        Args:
+            accept_encoding (str): The value of the Accept-Encoding header, or None if it was not sent.
+
+        Returns:
+            str: 'gzip' or 'deflate', or None if the body should be sent as it is.
+        """
+        if not accept_encoding:
+            return None
+
+        # Map each coding to its quality value, e.g. 'gzip;q=0.8, *;q=0' -> {'gzip': 0.8, '*': 0.0}
+        qualities = {}
+        for item in accept_encoding.split(','):
+            coding, *parameters = item.split(';')
+            quality = 1.0
+            for parameter in parameters:
+                name, _, value = parameter.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[coding.strip().lower()] = quality
+
+        best, best_quality = None, 0.0
+        for encoding in HTTPHandler.SUPPORTED_ENCODINGS:
+            quality = qualities.get(encoding, qualities.get('*', 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    @staticmethod
+    def compress(body, encoding):
+        """
+        Compress a body with a content encoding from negotiate_encoding().
+
+        Args:
+            body (bytes): The body.
+            encoding (str): 'gzip' or 'deflate'.
+
+        Returns:
+            bytes: The compressed body.
+        """
+        if encoding == "gzip":
+            # A fixed mtime keeps the output the same for the same body
+            return gzip.compress(body, compresslevel=HTTPHandler.COMPRESSION_LEVEL, mtime=0)
+        return zlib.compress(body, HTTPHandler.COMPRESSION_LEVEL)
+
+    @staticmethod
+    def encoded_etag(etag, encoding):
+        """
+        Derive the ETag of a compressed representation, since it differs from the uncompressed one.
+
+        Args:
+            etag (str): The ETag of the uncompressed body, including its quotes.
+            encoding (str): The content encoding, or None.
+
+        Returns:
+            str: The ETag of the representation.
+        """
+        if encoding is None:
+            return etag
+        return f'{etag[:-1]}-{encoding}"'
 
     @staticmethod
     def find_content_type(filename):
@@ -55,3 +293,61 @@ class HTTPHandler:
         return HTTPHandler.CONTENT_TYPE.get(extension)
 
 
+class ChunkedWriter:
+    """
+    Writes a response body whose length is not known when the header is sent.
+
+    With chunked transfer encoding (HTTP/1.1), every write() is sent as one chunk and
+    close() sends the last, empty chunk that marks the end of the body. Without it
+    (HTTP/1.0), the data is written as it is, and the end of the body is marked by
+    closing the connection.
+    """
+
+    def __init__(self, wfile, chunked=True):
+        """
+        Args:
+            wfile: The file-like object the response is written to.
+            chunked (bool): Whether to use chunked transfer encoding.
+        """
+        self.wfile = wfile
+        self.chunked = chunked
+
+    def write(self, data):
+        """Write a piece of the body. Empty pieces are skipped, since an empty chunk ends the body."""
+        if not data:
+            return
+        if self.chunked:
+            self.wfile.write(f'{len(data):X}\r\n'.encode() + data + b'\r\n')
+        else:
+            self.wfile.write(data)
+
+    def flush(self):
+        """Make sure what has been written is sent now, e.g. for events that the client waits for."""
+        self.wfile.flush()
+
+    def close(self):
+        """Mark the end of the body."""
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+
+# The status lines of the responses the server sends, built once as bytes
+STATUS_LINES = {
+    response: f'HTTP/1.1 {response}\r\n'.encode()
+    for response in (
+        '200 OK', '201 Created', '206 Partial Content', '304 Not Modified',
+        '404 Not Found', '416 Range Not Satisfiable',
+    )
+}
+
+# The Content-Type lines of the known content types
+CONTENT_TYPE_LINES = {
+    content_type: f'Content-Type: {content_type}\r\n'.encode()
+    for content_type in (*HTTPHandler.CONTENT_TYPE.values(), "application/json")
+}
+
+# The connection lines and the empty line that ends a header, for keep_alive False and True
+HEADER_ENDINGS = {
+    keep_alive: (HTTPHandler.connection_header(keep_alive) + '\r\n').encode()
+    for keep_alive in (True, False)
+}
@@ -0,0 +1,106 @@
+import threading
+import time
+
+
+class AdmissionControl:
+    """
+    Decides which connections and requests the server takes on, so that a flood of
+    clients, or a single abusive one, cannot use up its threads and slow everybody down.
+
+    Three limits are checked, each of them off when it is 0:
+
+        max_connections         connections open at the same time, in total (over it: 503)
+        max_connections_per_ip  connections open at the same time from one address (over it: 429)
+        rate, burst             requests per second from one address, as a token bucket that
+                                holds at most 'burst' requests (over it: 429)
+
+    A client that is turned away gets its answer right away instead of waiting, so the
+    latency of the clients that are let in stays predictable. All methods are thread-safe.
+    """
+
+    def __init__(self, max_connections=0, max_connections_per_ip=0, rate=0, burst=None, max_tracked_clients=10000):
+        """
+        Args:
+            max_connections (int): The most open connections, or 0 for no limit.
+            max_connections_per_ip (int): The most open connections from one address, or 0 for no limit.
+            rate (float): The requests per second one address may make on average, or 0 for no limit.
+            burst (int): The most requests one address may make at once. Defaults to 'rate', and at least 1.
+            max_tracked_clients (int): The number of addresses whose tokens are remembered.
+                Beyond it, the addresses that have been quiet the longest are forgotten.
+        """
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.rate = rate
+        self.burst = max(1, burst if burst is not None else rate)
+        self.max_tracked_clients = max_tracked_clients
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._connections_by_ip = {}
+        self._buckets = {}      # Address -> [tokens, time of the last update]
+
+    def admit_connection(self, ip):
+        """
+        Take on a new connection, unless it is over the limits. A connection that is
+        taken on must be given back with release_connection() when it is closed.
+
+        Args:
+            ip (str): The address of the client.
+
+        Returns:
+            int: None if the connection is taken on, otherwise the status code to turn it away with.
+        """
+        with self._lock:
+            if self.max_connections and self._connections >= self.max_connections:
+                return 503
+            count = self._connections_by_ip.get(ip, 0)
+            if self.max_connections_per_ip and count >= self.max_connections_per_ip:
+                return 429
+            self._connections += 1
+            self._connections_by_ip[ip] = count + 1
+        return None
+
+    def release_connection(self, ip):
+        """Give back a connection that admit_connection() took on."""
+        with self._lock:
+            self._connections -= 1
+            count = self._connections_by_ip[ip] - 1
+            if count:
+                self._connections_by_ip[ip] = count
+            else:
+                del self._connections_by_ip[ip]
+
+    def allow_request(self, ip):
+        """
+        Take a token for a request from the bucket of the address.
+
+        Args:
+            ip (str): The address of the client.
+
+        Returns:
+            bool: False if the address has made too many requests, and should get 429.
+        """
+        if not self.rate:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                if len(self._buckets) >= self.max_tracked_clients:
+                    self._forget_quiet_clients()
+                bucket = self._buckets[ip] = [self.burst, now]
+            else:
+                # The bucket fills up at 'rate' tokens per second, up to 'burst'
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    def _forget_quiet_clients(self):
+        """Forget the half of the addresses that have been quiet the longest. The caller must hold '_lock'."""
+        by_last_request = sorted(self._buckets, key=lambda ip: self._buckets[ip][1])
+        for ip in by_last_request[:len(by_last_request) // 2 + 1]:
+            del self._buckets[ip]
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from file_cache import stat_identity
+from HTTP_handler import HTTPHandler
+
+
+class Asset:
+    """
+    A static file held in memory, with its responses already built.
+
+    Text files that are large enough are also kept compressed with each encoding in
+    HTTPHandler.SUPPORTED_ENCODINGS, so they are compressed once per version of the file
+    instead of once per request. Every encoding has one body, and a header for connections
+    that are kept alive and one for those that are closed.
+
+    Attributes:
+        path (str): The path of the file.
+        mtime (float): The modification time of the file.
+        etag (str): The ETag of the content, including its quotes.
+        last_modified (str): The modification time as an HTTP date, for Last-Modified.
+        compressible (bool): Whether there are compressed responses.
+        size (int): The number of bytes the entry takes up in the cache.
+    """
+
+    def __init__(self, path, content, file_stat):
+        self.path = path
+        self.mtime = file_stat.st_mtime
+        self.identity = stat_identity(file_stat)
+        self.etag = '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+        self.last_modified = HTTPHandler.http_date(file_stat.st_mtime)
+        self.checked = time.monotonic()     # When the file was last compared with the disk
+
+        content_type = HTTPHandler.find_content_type(path)
+        self.compressible = HTTPHandler.is_compressible(content_type, len(content))
+        encodings = (None,) + (HTTPHandler.SUPPORTED_ENCODINGS if self.compressible else ())
+
+        # One body for each encoding, and its headers for connections that are kept alive and for those that are closed
+        self._etags = {}
+        self._bodies = {}
+        self._headers = {}
+        self._not_modified = {}
+        for encoding in encodings:
+            body = content if encoding is None else HTTPHandler.compress(content, encoding)
+            self._bodies[encoding] = body
+            self._etags[encoding] = HTTPHandler.encoded_etag(self.etag, encoding)
+
+            validators = {"ETag": self._etags[encoding], "Last-Modified": self.last_modified}
+            if self.compressible:
+                validators["Vary"] = "Accept-Encoding"
+            headers = {"Accept-Ranges": "bytes", **validators}
+            if encoding is not None:
+                headers["Content-Encoding"] = encoding
+
+            for keep_alive in (True, False):
+                self._headers[encoding, keep_alive] = HTTPHandler.create_response_header(
+                    '200 OK', content_type, len(body), keep_alive, headers)
+                self._not_modified[encoding, keep_alive] = HTTPHandler.create_response_header(
+                    '304 Not Modified', None, None, keep_alive, validators)
+
+        self.size = (sum(len(body) for body in self._bodies.values())
+                     + sum(len(header) for header in self._headers.values())
+                     + sum(len(header) for header in self._not_modified.values()))
+
+    def negotiate(self, accept_encoding):
+        """
+        Choose the encoding to send the file with.
+
+        Args:
+            accept_encoding (str): The Accept-Encoding header of the request, or None.
+
+        Returns:
+            str: The encoding, or None to send the file as it is.
+        """
+        if not self.compressible:
+            return None
+        return HTTPHandler.negotiate_encoding(accept_encoding)
+
+    def etag_for(self, encoding):
+        """
+        Returns:
+            str: The ETag of the file sent with the given encoding.
+        """
+        return self._etags[encoding]
+
+    def response(self, keep_alive, encoding=None):
+        """
+        Returns:
+            bytes: The whole 200 response, header and content. They are joined here, so
+            the response goes out in one write, and the body is only kept once.
+        """
+        return self._headers[encoding, keep_alive] + self._bodies[encoding]
+
+    def not_modified_response(self, keep_alive, encoding=None):
+        """
+        Returns:
+            bytes: The 304 response, for a client that already has this version.
+        """
+        return self._not_modified[encoding, keep_alive]
+
+
+class AssetCache:
+    """
+    A byte-bounded LRU cache of small static files, with their responses already built.
+
+    Serving such a file from the cache costs a dictionary lookup instead of opening and
+    reading the file and building the header. At most every 'revalidate_interval'
+    seconds, a request compares the file with the disk (one os.stat()) and loads it
+    again if it has changed, so an edited file is served within that interval.
+
+    A file whose responses would not fit in 'max_bytes' is remembered as too large, and
+    get() returns None for it without reading or compressing it again, until it changes.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, revalidate_interval=1.0):
+        """
+        Args:
+            max_bytes (int): The most bytes of responses to keep. Files whose responses
+                would not fit are not cached.
+            revalidate_interval (float): How many seconds an entry is trusted before
+                it is compared with the file on disk again.
+        """
+        self.max_bytes = max_bytes
+        self.revalidate_interval = revalidate_interval
+        self._assets = OrderedDict()
+        self._too_large = {}        # Path -> (identity of the file, when it was last compared with the disk)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Get a file from the cache, loading it if it is not there or has changed.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            Asset: The file, or None if it does not exist or is too large to cache.
+        """
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None:
+                self._assets.move_to_end(path)
+                if time.monotonic() - asset.checked < self.revalidate_interval:
+                    return asset
+            too_large = self._too_large.get(path)
+            if too_large is not None and time.monotonic() - too_large[1] < self.revalidate_interval:
+                return None
+
+        # The entry is missing or due to be compared with the disk
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            self._remove(path)
+            return None
+
+        identity = stat_identity(file_stat)
+        if asset is not None and asset.identity == identity:
+            asset.checked = time.monotonic()
+            return asset
+        if (too_large is not None and too_large[0] == identity) or file_stat.st_size > self.max_bytes:
+            # The file is served from the disk, without reading all of it here
+            with self._lock:
+                self._remove_locked(path)
+                self._too_large[path] = (identity, time.monotonic())
+            return None
+
+        asset = self._load(path)
+        if asset is not None and asset.size > self.max_bytes:
+            # Its responses (e.g. with the compressed copies) are larger than the file itself
+            with self._lock:
+                self._remove_locked(path)
+                self._too_large[path] = (asset.identity, time.monotonic())
+            return None
+
+        with self._lock:
+            self._remove_locked(path)
+            if asset is not None:
+                self._assets[path] = asset
+                self._size += asset.size
+                while self._size > self.max_bytes:
+                    self._remove_locked(next(iter(self._assets)))
+        return asset
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                # Take the metadata from the open file, in case the file is replaced in between
+                file_stat = os.fstat(f.fileno())
+                if file_stat.st_size > self.max_bytes:
+                    return None
+                content = f.read()
+        except OSError:
+            return None
+        return Asset(path, content, file_stat)
+
+    def _remove(self, path):
+        with self._lock:
+            self._remove_locked(path)
+
+    def _remove_locked(self, path):
+        self._too_large.pop(path, None)
+        asset = self._assets.pop(path, None)
+        if asset is not None:
+            self._size -= asset.size
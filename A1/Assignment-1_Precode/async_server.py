@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import io
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+from error_handling import ERROR_RESPONSES
+from HTTP_handler import HTTPHandler
+from metrics import MeteredWriter
+from request_parser import ParseError, RequestParser
+from server import MyTCPHandler, metrics
+
+"""
+An asyncio engine for the HTTP server.
+
+Connections are read and written through asyncio streams, so idle and slow clients
+only cost a coroutine instead of a thread. Once a whole request has been read, it is
+handed to the same routing as the socketserver engine: the Router in server.py picks
+the route handler of MyTCPHandler (e.g. handle_messages for GET /message), which runs
+in a thread pool since it reads files and waits for 'messages_lock'. Changes to the messages go to the message log,
+whose syncs to disk are batched (see message_log.py).
+"""
+
+
+class AsyncRequestHandler(MyTCPHandler):
+    """
+    Runs the MyTCPHandler routing for one request that the asyncio engine has read.
+
+    The engine parses the request, and the response is collected in an in-memory
+    wfile, which the engine then writes to the client. Files are not copied
+    into the wfile: send_file() records them, and the engine sends them with
+    loop.sendfile() when it gets to them (see take_response_parts()).
+
+    A long response, e.g. a streamed one, does not have to fit in memory: once FLUSH_SIZE
+    bytes have been written, the handler hands them to the engine and waits until they
+    have been sent, which also slows the handler down to the pace of the client.
+    """
+
+    FLUSH_SIZE = 256 * 1024
+
+    # The engine writes the response, and records the time that takes as the write phase
+    writes_to_socket = False
+
+    # Every connection is a coroutine, so an idle keep-alive connection holds up nobody
+    serves_concurrently = True
+
+    def __init__(self, client_address, requests_handled, send_parts=None):
+        """
+        Args:
+            client_address (tuple): The address of the client.
+            requests_handled (int): The number of requests answered on the connection before this one.
+            send_parts (callable): Sends a list of parts and returns once they have been
+                sent. It is called from the handler thread. Without it the whole response
+                is kept until the engine takes it.
+        """
+        # BaseRequestHandler.__init__() is not called, since it would handle a socket
+        self.wfile = _ResponseBuffer(self)
+        if metrics.enabled:
+            self.wfile = MeteredWriter(self.wfile, metrics)
+        self.client_address = client_address
+        self.requests_handled = requests_handled
+        self.keep_alive = True
+        self.parts = []
+        self.send_parts = send_parts
+
+    def send_file(self, fd, offset, count):
+        """
+        Record part of a file to be sent after what has been written so far.
+
+        The descriptor is duplicated, since the handler gives the original back to the
+        cache of open files before the engine sends it. The engine closes the duplicate.
+        """
+        self.parts.append(self.wfile.take())
+        self.parts.append(FilePart(os.dup(fd), offset, count))
+        if metrics.enabled:
+            metrics.add_bytes_out(count)
+
+    def flush_response(self):
+        """Send what has been written so far, if the engine allows it, and wait until it has been sent."""
+        if self.send_parts is not None:
+            self.send_parts(self.take_response_parts())
+
+    def take_response_parts(self):
+        """
+        Returns:
+            list: The response in order, as bytes and FileParts, from where the last call left off.
+        """
+        parts = self.parts + [self.wfile.take()]
+        self.parts = []
+        return parts
+
+
+class _ResponseBuffer(io.BytesIO):
+    """The wfile of an AsyncRequestHandler, which flushes the response once enough of it has been written."""
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def write(self, data):
+        written = super().write(data)
+        if self.tell() >= AsyncRequestHandler.FLUSH_SIZE:
+            self.handler.flush_response()
+        return written
+
+    def flush(self):
+        if self.tell():
+            self.handler.flush_response()
+
+    def take(self):
+        """Return what has been written and empty the buffer."""
+        data = self.getvalue()
+        self.seek(0)
+        self.truncate()
+        return data
+
+
+class FilePart:
+    """
+    A part of a file that belongs in a response.
+
+    Attributes:
+        fd (int): A file descriptor that the engine owns and closes.
+        offset (int): Where in the file the part starts.
+        count (int): The length of the part.
+    """
+
+    def __init__(self, fd, offset, count):
+        self.fd = fd
+        self.offset = offset
+        self.count = count
+
+
+class AsyncHTTPServer:
+    """
+    HTTP server that handles connections with asyncio.
+
+    Like socketserver.TCPServer, it binds when it is created, serve_forever() serves
+    until shutdown() is called from another thread, and it can be used as a context
+    manager that closes the listening socket.
+    """
+
+    def __init__(self, host, port, workers=16):
+        """
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on.
+            workers (int): The number of threads that run request handlers and file I/O.
+        """
+        self.socket = socket.create_server((host, port))
+        self.server_address = self.socket.getsockname()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        # Subscribers of the change feed wait in the pool, next to the handlers that make the changes
+        server.change_feed.enable(workers)
+        self._loop = None
+        self._stop = None
+        self._stopped = threading.Event()
+        self._connections = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self):
+        """Serve connections until shutdown() is called."""
+        self._stopped.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stop serve_forever() and wait until it has returned. Call it from another thread."""
+        if self._loop is not None and not self._stopped.is_set():
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._stopped.wait()
+
+    def server_close(self):
+        """Close the listening socket and the thread pool."""
+        self.socket.close()
+        self.executor.shutdown()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop.set_default_executor(self.executor)
+        self._stop = asyncio.Event()
+
+        async with await asyncio.start_server(self.handle_connection, sock=self.socket):
+            await self._stop.wait()
+
+            # Subscribers of the change feed hold a worker thread, which must finish before the pool can be shut down
+            server.change_feed.close()
+
+            # Close the connections that are still open, most of them are idle keep-alive connections
+            for connection in list(self._connections):
+                connection.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve the requests of one connection until it is closed, goes idle for too long
+        or asks to be closed. Requests are answered in the order they arrive.
+        """
+        client_address = writer.get_extra_info("peername")
+        requests_handled = 0
+        parser = RequestParser()
+
+        # Turn the connection away right away if the server, or the client, has too many of them
+        status = server.admission.admit_connection(client_address[0])
+        if status is not None:
+            writer.write(ERROR_RESPONSES[status, False])
+            writer.close()
+            return
+        self._connections.add(asyncio.current_task())
+
+        def send_parts(parts):
+            # Called by a handler thread while this coroutine waits for the handler, so writes never overlap
+            asyncio.run_coroutine_threadsafe(self.write_response(writer, parts), self._loop).result()
+
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader, parser)
+                except asyncio.TimeoutError:
+                    # The client went idle, or is sending its request too slowly
+                    if parser.has_partial_request():
+                        writer.write(ERROR_RESPONSES[408, False])
+                        if metrics.enabled:
+                            metrics.count_response("timeout", 408)
+                    break
+                except ParseError as error:
+                    # We cannot trust where the next request starts, so the connection is closed
+                    handler = AsyncRequestHandler(client_address, requests_handled)
+                    handler.keep_alive = False
+                    handler.send_error(error.status)
+                    if metrics.enabled:
+                        metrics.count_response("parse_error", error.status)
+                    await self.write_response(writer, handler.take_response_parts())
+                    break
+                if request is None:
+                    break
+
+                handler = AsyncRequestHandler(client_address, requests_handled, send_parts)
+                await self._loop.run_in_executor(None, handler.handle_one_request, request)
+                requests_handled = handler.requests_handled
+
+                started = time.perf_counter()
+                await self.write_response(writer, handler.take_response_parts())
+                if metrics.enabled:
+                    metrics.observe_phase("write", time.perf_counter() - started)
+
+                if not handler.keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            # The client went idle or disappeared
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down
+            pass
+        finally:
+            self._connections.discard(asyncio.current_task())
+            server.admission.release_connection(client_address[0])
+            writer.close()
+
+    async def write_response(self, writer, parts):
+        """
+        Write a response that may contain parts of files. The files are sent with
+        loop.sendfile(), which uses os.sendfile() where it can and copies the file in
+        chunks otherwise, so they are never read into memory as a whole.
+
+        A client that does not read what has been written within RESPONSE_WRITE_TIMEOUT
+        seconds gets its connection closed. A file that is being sent only holds on to this
+        coroutine, not to a thread, so loop.sendfile() is left to finish at the client's pace.
+
+        Args:
+            writer (asyncio.StreamWriter): The connection.
+            parts (list): The response, as bytes and FileParts.
+        """
+        try:
+            for i, part in enumerate(parts):
+                if isinstance(part, bytes):
+                    writer.write(part)
+                    continue
+
+                # What has been written so far must be sent before the file
+                await asyncio.wait_for(writer.drain(), server.RESPONSE_WRITE_TIMEOUT)
+                with os.fdopen(part.fd, "rb") as file:
+                    parts[i] = None     # The file is closed by the 'with', even if sending fails
+                    sent = await self._loop.sendfile(writer.transport, file, part.offset, part.count)
+                if sent < part.count:
+                    # The file shrank after the header was written, so the response cannot be completed
+                    raise ConnectionError("file ended before the response was complete")
+            await asyncio.wait_for(writer.drain(), server.RESPONSE_WRITE_TIMEOUT)
+        finally:
+            # Close the files that were not sent, e.g. because the client disconnected
+            for part in parts:
+                if isinstance(part, FilePart):
+                    os.close(part.fd)
+
+    async def read_request(self, reader, parser):
+        """
+        Read the next request from the stream. Whatever has arrived is given to the
+        request parser of the connection, until it has a complete request.
+
+        The connection waits up to KEEP_ALIVE_TIMEOUT seconds for a request to start, and
+        then up to REQUEST_READ_TIMEOUT seconds for all of it.
+
+        Returns:
+            Request: The request, or None if the client closed the connection.
+
+        Raises:
+            ParseError: If the request is malformed or too large.
+            asyncio.TimeoutError: If the request does not arrive in time.
+        """
+        deadline = None
+        parse_time = 0.0
+        while True:
+            started = time.perf_counter()
+            request = parser.next_request()
+            parse_time += time.perf_counter() - started
+            if request is not None:
+                if metrics.enabled:
+                    metrics.observe_phase("parse", parse_time)
+                return request
+
+            timeout = HTTPHandler.KEEP_ALIVE_TIMEOUT
+            if deadline is None and parser.has_partial_request():
+                deadline = self._loop.time() + server.REQUEST_READ_TIMEOUT
+            if deadline is not None:
+                timeout = min(timeout, deadline - self._loop.time())
+                if timeout <= 0:
+                    raise asyncio.TimeoutError("the request did not arrive in time")
+
+            data = await asyncio.wait_for(reader.read(65536), timeout)
+            if not data:
+                return None
+            if metrics.enabled:
+                metrics.add_bytes_in(len(data))
+            parser.feed(data)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="INF-2300 HTTP server (asyncio engine)")
+    parser.add_argument("--host", default="localhost", help="address to listen on (default: localhost)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--workers", type=int, default=16,
+                        help="threads that run the request handlers (default: 16)")
+    parser.add_argument("--metrics", action="store_true", help="record request metrics and serve them at /metrics")
+    server.add_profile_arguments(parser)
+    server.add_admission_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    metrics.enabled = args.metrics
+    if args.profile_rate > 0:
+        server.start_profiler(args.profile_mode, args.profile_rate, args.profile_window)
+    server.set_admission_limits(args.max_connections, args.max_connections_per_ip, args.rate_limit, args.rate_burst)
+    with AsyncHTTPServer(args.host, args.port, args.workers) as http_server:
+        print("Serving at: http://{}:{} (asyncio engine)".format(args.host, args.port))
+        server.load_messages_from_file()
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.close_message_log()
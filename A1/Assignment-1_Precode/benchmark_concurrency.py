@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+
+"""
+Compare the throughput of the concurrency modes of server.py.
+
+Every mode is started as its own server process. A number of client threads then
+send GET requests for a while, each on a new connection, and the completed
+requests per second are reported. Run it from this directory:
+
+    python3 benchmark_concurrency.py --clients 32 --seconds 5
+"""
+
+HOST = "localhost"
+MODES = ["single", "threaded", "prefork"]
+
+
+def wait_for_server(port, timeout=10):
+    """Wait until the server accepts connections on the port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"The server on port {port} did not start")
+
+
+def client_loop(port, paths, stop_at, results):
+    """Send requests until stop_at, and record the number of completed and failed ones."""
+    completed = failed = 0
+    i = 0
+    while time.monotonic() < stop_at:
+        client = HTTPConnection(HOST, port, timeout=10)
+        try:
+            client.request("GET", paths[i % len(paths)], headers={"Connection": "close"})
+            client.getresponse().read()
+            completed += 1
+        except OSError:
+            failed += 1
+        finally:
+            client.close()
+        i += 1
+    results.append((completed, failed))
+
+
+def run_mode(mode, port, clients, seconds, workers):
+    """Start the server in the given mode and measure its throughput."""
+    command = [sys.executable, "server.py", "--mode", mode, "--port", str(port)]
+    if workers is not None and mode != "single":
+        command += ["--workers", str(workers)]
+
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_server(port)
+        results = []
+        stop_at = time.monotonic() + seconds
+        threads = [
+            threading.Thread(target=client_loop, args=(port, ["/", "/message"], stop_at, results))
+            for _ in range(clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    completed = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    return completed / seconds, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the concurrency modes of server.py")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent client threads (default: 32)")
+    parser.add_argument("--seconds", type=float, default=5, help="duration of each run (default: 5)")
+    parser.add_argument("--workers", type=int, default=None, help="threads/processes for the server")
+    parser.add_argument("--port", type=int, default=8090, help="first port to use (default: 8090)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    # The server reads index.html and message.json relative to its working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    print(f"{'mode':<10}{'requests/s':>12}{'failed':>8}")
+    for i, mode in enumerate(args.modes):
+        throughput, failed = run_mode(mode, args.port + i, args.clients, args.seconds, args.workers)
+        print(f"{mode:<10}{throughput:>12.1f}{failed:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.client import HTTPConnection, HTTPException
+
+"""
+Load-generation benchmark for the whole server: throughput and latency under a mix of requests.
+
+The server (MyTCPHandler in the single or threaded mode, or the asyncio engine) is started
+in this process, on a free local port and in a temporary directory, so message.json is not
+touched. The prefork mode forks its workers, so it is started as its own server.py process,
+in the same directory. The clients run in separate processes, so they do not compete with the server
+for the GIL. Each scenario runs with keep-alive (one connection per client for many
+requests) and without it (a new connection for every request), and reports the requests
+per second and the 50th, 95th and 99th percentile of the latency, in total and for every
+kind of request. The results can be saved as JSON, and compared with an earlier run:
+
+    python3 benchmark_load.py --engine threaded --connections 32 --seconds 5 --output after.json
+    python3 benchmark_load.py --engine threaded --compare before.json
+
+The mix is given as weights, e.g. --mix static=40,list=20,get=10,post=15,put=10,delete=5:
+
+    static      GET / or /index.html
+    list        GET /message
+    get         GET /message/<ID>
+    post        POST /message
+    put         PUT /message
+    delete      DELETE /message
+
+IDs are picked at random among the --messages messages the store starts with, so some
+gets, puts and deletes name a message that has been deleted. Their 404 is an expected
+answer, only failed connections and 5xx responses count as errors.
+"""
+
+HOST = "localhost"
+ENGINES = ["single", "threaded", "prefork", "asyncio"]
+OPERATIONS = ["static", "list", "get", "post", "put", "delete"]
+DEFAULT_MIX = "static=40,list=20,get=10,post=15,put=10,delete=5"
+
+# The files the server needs in its working directory
+SERVER_FILES = ["index.html", "favicon.ico"]
+
+
+def parse_mix(mix):
+    """
+    Parse a request mix such as 'static=40,post=10'.
+
+    Returns:
+        dict: The weight of each operation.
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{name}', choose from {', '.join(OPERATIONS)}")
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"the weight of '{name}' must be a number")
+    if sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return weights
+
+
+def make_request(operation, rng, message_count):
+    """
+    Returns:
+        tuple: The method, URI and body of a request for the operation.
+    """
+    message_id = rng.randint(1, message_count)
+    if operation == "static":
+        return "GET", rng.choice(["/", "/index.html"]), None
+    if operation == "list":
+        return "GET", "/message", None
+    if operation == "get":
+        return "GET", f"/message/{message_id}", None
+    if operation == "post":
+        return "POST", "/message", json.dumps({"text": f"benchmark message {rng.random()}"})
+    if operation == "put":
+        return "PUT", "/message", json.dumps({"ID": message_id, "Text": f"updated {rng.random()}"})
+    return "DELETE", "/message", json.dumps({"ID": message_id})
+
+
+def client_loop(port, keep_alive, weights, message_count, start_at, stop_at, seed, results):
+    """Send requests from start_at until stop_at, and record the latency of each one by operation."""
+    rng = random.Random(seed)
+    operations, operation_weights = list(weights), list(weights.values())
+    latencies = {operation: [] for operation in operations}
+    errors = {operation: 0 for operation in operations}
+    headers = {} if keep_alive else {"Connection": "close"}
+
+    time.sleep(max(0, start_at - time.time()))
+    client = None
+    while time.time() < stop_at:
+        operation = rng.choices(operations, operation_weights)[0]
+        method, uri, body = make_request(operation, rng, message_count)
+        started = time.perf_counter()
+        try:
+            if client is None:
+                client = HTTPConnection(HOST, port, timeout=10)
+            client.request(method, uri, body, headers)
+            response = client.getresponse()
+            response.read()
+            failed = response.status >= 500
+            if not keep_alive or response.will_close:
+                client.close()
+                client = None
+        except (OSError, HTTPException):
+            failed = True
+            if client is not None:
+                client.close()
+            client = None
+        if failed:
+            errors[operation] += 1
+        else:
+            latencies[operation].append(time.perf_counter() - started)
+
+    if client is not None:
+        client.close()
+    results.append((latencies, errors))
+
+
+def client_process(port, connections, keep_alive, weights, message_count, start_at, stop_at, seed):
+    """
+    Run 'connections' clients in threads of a client process.
+
+    Returns:
+        tuple: The latencies (in seconds) and the number of errors of each operation.
+    """
+    results = []
+    threads = [
+        threading.Thread(target=client_loop, args=(port, keep_alive, weights, message_count,
+                                                   start_at, stop_at, seed * 1000 + i, results))
+        for i in range(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = {operation: [] for operation in weights}
+    errors = {operation: 0 for operation in weights}
+    for thread_latencies, thread_errors in results:
+        for operation in weights:
+            latencies[operation].extend(thread_latencies[operation])
+            errors[operation] += thread_errors[operation]
+    return latencies, errors
+
+
+def percentile(sorted_values, fraction):
+    """The nearest-rank percentile of a sorted list, or None for an empty one."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, seconds):
+    """
+    Returns:
+        dict: The throughput, the errors and the latency percentiles (in milliseconds) of a list of latencies.
+    """
+    latencies = sorted(latencies)
+
+    def milliseconds(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / seconds, 1),
+        "latency_ms": {
+            "p50": milliseconds(percentile(latencies, 0.50)),
+            "p95": milliseconds(percentile(latencies, 0.95)),
+            "p99": milliseconds(percentile(latencies, 0.99)),
+            "max": milliseconds(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def start_engine(engine, workers):
+    """
+    Start a server engine in this process, on a free port.
+
+    Returns:
+        tuple: The server and the thread that runs it (None for the prefork mode).
+    """
+    if engine == "prefork":
+        return PreforkServer(workers), None
+
+    import server
+    if engine == "asyncio":
+        import async_server
+        http_server = async_server.AsyncHTTPServer(HOST, 0, workers or 16)
+    else:
+        http_server = server.create_server(HOST, 0, engine, workers)
+
+    server.load_messages_from_file()
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    return http_server, thread
+
+
+class PreforkServer:
+    """
+    The prefork mode of server.py, run as its own process in the working directory.
+
+    It has the server_address, shutdown() and server_close() that main() uses to
+    stop the engines that run in this process.
+    """
+
+    def __init__(self, workers):
+        # The port is picked by binding to port 0, and handed to the server once it is free again
+        with socket.create_server((HOST, 0)) as probe:
+            port = probe.getsockname()[1]
+        self.server_address = (HOST, port)
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+        command = [sys.executable, script, "--mode", "prefork", "--port", str(port)]
+        if workers is not None:
+            command += ["--workers", str(workers)]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        self.wait_until_listening()
+
+    def wait_until_listening(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("The prefork server stopped before it started listening")
+            try:
+                socket.create_connection(self.server_address, timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError(f"The prefork server on port {self.server_address[1]} did not start")
+
+    def shutdown(self):
+        """Stop the workers; the server compacts its message log on SIGTERM."""
+        self.process.terminate()
+        self.process.wait()
+
+    def server_close(self):
+        pass
+
+
+def seed_messages(port, count):
+    """Create the messages the benchmark starts with, 500 per bulk request."""
+    client = HTTPConnection(HOST, port, timeout=30)
+    for first in range(0, count, 500):
+        operations = [{"op": "create", "text": f"message {i}"} for i in range(first, min(first + 500, count))]
+        client.request("POST", "/message/_bulk", json.dumps(operations))
+        response = client.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Could not create the messages: {response.status} {response.reason}")
+    client.close()
+
+
+def run_scenario(pool, port, args, weights, keep_alive):
+    """Run the clients against the server for --seconds, and summarize the results."""
+    start_at = time.time() + 1.0      # Lets every client process start before the clock runs
+    stop_at = start_at + args.seconds
+    per_process = [args.connections // args.processes + (i < args.connections % args.processes)
+                   for i in range(args.processes)]
+    jobs = [(port, connections, keep_alive, weights, args.messages, start_at, stop_at, args.seed + i)
+            for i, connections in enumerate(per_process) if connections]
+    results = pool.starmap(client_process, jobs)
+
+    operations = {}
+    all_latencies, all_errors = [], 0
+    for operation in weights:
+        latencies = [value for process_latencies, _ in results for value in process_latencies[operation]]
+        errors = sum(process_errors[operation] for _, process_errors in results)
+        operations[operation] = summarize(latencies, errors, args.seconds)
+        all_latencies.extend(latencies)
+        all_errors += errors
+
+    summary = summarize(all_latencies, all_errors, args.seconds)
+    summary["operations"] = operations
+    return summary
+
+
+def print_summary(name, summary):
+    print(name)
+    print(f"  {'':<8}{'req/s':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = [("total", summary)] + list(summary["operations"].items())
+    for row_name, row in rows:
+        latency = row["latency_ms"]
+        cells = [f"{latency[key]:>10.2f}" if latency[key] is not None else f"{'-':>10}" for key in ("p50", "p95", "p99")]
+        print(f"  {row_name:<8}{row['throughput']:>10.1f}{row['errors']:>8}" + "".join(cells))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results with those of an earlier run, and report the scenarios that got
+    worse by more than 'tolerance': lower throughput, or a higher 99th percentile.
+
+    Returns:
+        list: A description of every regression.
+    """
+    regressions = []
+    for name, summary in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        if summary["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']:.1f} -> {summary['throughput']:.1f} req/s")
+        p99, p99_before = summary["latency_ms"]["p99"], before["latency_ms"]["p99"]
+        if p99 is not None and p99_before is not None and p99 > p99_before * (1 + tolerance):
+            regressions.append(f"{name}: p99 latency {p99_before:.2f} -> {p99:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the throughput and latency of the server under load")
+    parser.add_argument("--engine", choices=ENGINES, default="threaded", help="server engine (default: threaded)")
+    parser.add_argument("--workers", type=int, default=None, help="threads of the server")
+    parser.add_argument("--connections", type=int, default=32, help="concurrent client connections (default: 32)")
+    parser.add_argument("--processes", type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help="client processes the connections are spread over")
+    parser.add_argument("--seconds", type=float, default=5, help="duration of each scenario (default: 5)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"weights of the kinds of requests (default: {DEFAULT_MIX})")
+    parser.add_argument("--keep-alive", choices=["on", "off", "both"], default="both",
+                        help="scenarios to run (default: both)")
+    parser.add_argument("--messages", type=int, default=1000, help="messages in the store at the start (default: 1000)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random request mix (default: 1)")
+    parser.add_argument("--output", help="save the results as JSON in this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare with the JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="change that counts as a regression in --compare (default: 0.10)")
+    args = parser.parse_args()
+    args.messages = max(1, args.messages)
+    args.processes = max(1, min(args.processes, args.connections))
+
+    # Paths are resolved before the server moves to its own working directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # The client processes are spawned, so they do not inherit the threads of the server. They are
+    # started before the server moves to its own working directory, since they import this script.
+    pool = multiprocessing.get_context("spawn").Pool(args.processes)
+
+    source_directory = os.path.dirname(os.path.abspath(__file__))
+    work_directory = tempfile.mkdtemp(prefix="benchmark_load_")
+    for name in SERVER_FILES:
+        shutil.copy(os.path.join(source_directory, name), work_directory)
+    os.chdir(work_directory)
+    http_server, thread = start_engine(args.engine, args.workers)
+    port = http_server.server_address[1]
+    try:
+        seed_messages(port, args.messages)
+        scenarios = {"on": ["keep-alive"], "off": ["close"], "both": ["keep-alive", "close"]}[args.keep_alive]
+        results = {
+            "engine": args.engine,
+            "workers": args.workers,
+            "connections": args.connections,
+            "seconds": args.seconds,
+            "mix": args.mix,
+            "messages": args.messages,
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "scenarios": {},
+        }
+        for name in scenarios:
+            summary = run_scenario(pool, port, args, args.mix, keep_alive=(name == "keep-alive"))
+            results["scenarios"][name] = summary
+            print_summary(f"{args.engine}, {name}, {args.connections} connections", summary)
+    finally:
+        pool.close()
+        pool.join()
+        http_server.shutdown()
+        http_server.server_close()
+        if args.engine != "prefork":
+            import server
+            server.close_message_log()
+        os.chdir(source_directory)
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+        print(f"Saved the results in {output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions compared with {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+
+from message_store import MessageStore
+
+"""
+Benchmark the MessageStore against the list of messages it replaced.
+
+The store creates, updates and deletes a million messages, and then creates them
+again so that every ID comes from the heap of freed IDs. The old list is far too slow
+for a million messages, so it is measured with a smaller number for comparison:
+
+    python3 benchmark_message_store.py --messages 1000000 --list-messages 500
+"""
+
+
+class MessageList:
+    """The messages as they were stored before: a list searched from the start."""
+
+    def __init__(self):
+        self.messages = []
+
+    def create(self, text):
+        new_ID = 1
+        while any(message["ID"] == new_ID for message in self.messages):
+            new_ID += 1
+        new_message = {"ID": new_ID, "Text": text}
+        self.messages.append(new_message)
+        return new_message
+
+    def update(self, message_id, text):
+        for message in self.messages:
+            if message["ID"] == message_id:
+                message["Text"] = text
+                return message
+        return None
+
+    def delete(self, message_id):
+        for message in self.messages:
+            if message["ID"] == message_id:
+                self.messages.remove(message)
+                return message
+        return None
+
+
+def timed(name, count, operation):
+    """Run operation(i) for i in range(count) and print the operations per second."""
+    start = time.perf_counter()
+    for i in range(count):
+        operation(i)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<10}{count:>10} ops {elapsed:>9.3f} s {count / elapsed:>14,.0f} ops/s")
+
+
+def run(store, count):
+    # Updates and deletes visit the IDs in random order, so no access pattern is favoured
+    ids = list(range(1, count + 1))
+    random.shuffle(ids)
+
+    timed("create", count, lambda i: store.create(f"Message {i}"))
+    timed("update", count, lambda i: store.update(ids[i], f"Updated {i}"))
+    timed("delete", count, lambda i: store.delete(ids[i]))
+    timed("recreate", count, lambda i: store.create(f"Message {i}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the message store")
+    parser.add_argument("--messages", type=int, default=1_000_000,
+                        help="messages for the MessageStore (default: 1000000)")
+    parser.add_argument("--list-messages", type=int, default=500,
+                        help="messages for the old list, 0 to skip it (default: 500)")
+    parser.add_argument("--seed", type=int, default=2300)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print(f"MessageStore ({args.messages} messages)")
+    run(MessageStore(), args.messages)
+
+    if args.list_messages:
+        print(f"Old message list ({args.list_messages} messages)")
+        run(MessageList(), args.list_messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import json
+import time
+
+from request_parser import RequestParser
+
+"""
+Benchmark the RequestParser against the readline-based parsing it replaced.
+
+Each kind of request is parsed many times, from one stream of pipelined requests.
+The parser is also given the stream in small pieces, as a slow client would send it,
+to show that splitting up the input does not make parsing much slower:
+
+    python3 benchmark_request_parser.py --requests 100000 --piece-size 16
+"""
+
+
+def legacy_parse(rfile):
+    """Parse one request the way MyTCPHandler did before, with readline() per line."""
+    request_line = rfile.readline().decode('utf-8').strip()
+    if not request_line:
+        return None
+    requested_part = request_line.split()
+
+    headers = {}
+    while True:
+        header_line = rfile.readline().decode().strip()
+        if not header_line:
+            break
+        if ':' not in header_line:
+            continue
+        header_name, header_value = header_line.split(":", 1)
+        headers[header_name.strip().lower()] = header_value.strip()
+
+    try:
+        content_length = max(int(headers.get("content-length", 0)), 0)
+    except ValueError:
+        content_length = 0
+    body = rfile.read(content_length)
+    return requested_part, headers, body
+
+
+def make_requests():
+    """The kinds of requests to parse, as raw bytes."""
+    browser_headers = (
+        b"Host: localhost:8080\r\n"
+        b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0\r\n"
+        b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+        b"Accept-Language: en-US,en;q=0.5\r\n"
+        b"Accept-Encoding: gzip, deflate\r\n"
+        b"Connection: keep-alive\r\n"
+    )
+    body = json.dumps({"text": "A message for the benchmark " * 4}).encode()
+    chunked_body = b"".join(b"%x\r\n%s\r\n" % (len(body[i:i + 32]), body[i:i + 32]) for i in range(0, len(body), 32)) + b"0\r\n\r\n"
+
+    return {
+        "small GET": b"GET /message HTTP/1.1\r\nHost: localhost\r\n\r\n",
+        "browser GET": b"GET /index.html HTTP/1.1\r\n" + browser_headers + b"\r\n",
+        "POST": b"POST /message HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                + b"Content-Length: %d\r\n\r\n" % len(body) + body,
+        "chunked POST": b"POST /message HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n" + chunked_body,
+    }
+
+
+def timed(name, count, parse):
+    """Run parse(), which parses 'count' requests, and print the requests per second."""
+    start = time.perf_counter()
+    parsed = parse()
+    elapsed = time.perf_counter() - start
+    assert parsed == count, f"{name}: parsed {parsed} of {count} requests"
+    print(f"  {name:<28}{count:>9} req {elapsed:>8.3f} s {count / elapsed:>12,.0f} req/s")
+
+
+def parse_with_parser(stream, piece_size):
+    parser = RequestParser()
+    parsed = 0
+    for start in range(0, len(stream), piece_size):
+        parser.feed(stream[start:start + piece_size])
+        while parser.next_request() is not None:
+            parsed += 1
+    return parsed
+
+
+def parse_with_readline(stream):
+    rfile = io.BytesIO(stream)
+    parsed = 0
+    while legacy_parse(rfile) is not None:
+        parsed += 1
+    return parsed
+
+
+def main():
+    arguments = argparse.ArgumentParser(description="Benchmark the request parser")
+    arguments.add_argument("--requests", type=int, default=100_000,
+                           help="requests of each kind to parse (default: 100000)")
+    arguments.add_argument("--piece-size", type=int, default=16,
+                           help="bytes per feed() when the input is split up (default: 16)")
+    args = arguments.parse_args()
+
+    for kind, request in make_requests().items():
+        stream = request * args.requests
+        print(f"{kind} ({len(request)} bytes per request)")
+        timed("RequestParser, one feed", args.requests, lambda: parse_with_parser(stream, len(stream)))
+        timed("RequestParser, 64 KiB feeds", args.requests, lambda: parse_with_parser(stream, 65536))
+        # Splitting into tiny pieces is slow in any parser, so fewer requests are used for it
+        split_count = max(args.requests // 10, 1)
+        timed(f"RequestParser, {args.piece_size} B feeds", split_count,
+              lambda: parse_with_parser(request * split_count, args.piece_size))
+        if kind != "chunked POST":
+            # The old parsing did not understand chunked bodies
+            timed("readline (old)", args.requests, lambda: parse_with_readline(stream))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import server
+from error_handling import Error
+from HTTP_handler import HTTPHandler
+
+"""
+Benchmark routing and the building of error responses and headers, before and after
+the routing table and the responses built at import time.
+
+The old versions are copied below. Each path is run for a mix of URIs, and the number
+of requests per second counts the routing plus building the response, which is the
+work the server does for a request before it writes to the socket. "Routing only"
+times the routing on its own: a match in the Router is still about half as fast as the
+old if/elif chain, which is faster for the few routes it knew, but the responses built
+at import time more than make up for it:
+
+    python3 benchmark_routing.py --requests 200000
+"""
+
+
+def legacy_route(method, URI):
+    """Route a request with the if/elif chain per method that came before the Router, returning the handler."""
+    if method == "GET":
+        if URI == "/" or URI == "/index.html" or URI == "/favicon.ico":
+            return "handle_page"
+        elif URI == "/test.txt":
+            return "handle_test_file"
+        elif URI.startswith('/message/'):
+            return "handle_message"
+        elif URI.startswith('/message'):
+            return "handle_messages"
+        return 404
+    elif method == "POST":
+        if URI == "/test.txt":
+            return "handle_post_test_file"
+        elif URI.startswith('/message'):
+            return "handle_post_message"
+        return 403
+    elif method == "PUT":
+        return "handle_put_message" if URI.startswith('/message') else 404
+    elif method == "DELETE":
+        return "handle_delete_message" if URI.startswith('/message') else 404
+    return 405
+
+
+def new_route(method, URI):
+    """Route a request the way handle_one_request does now."""
+    route = server.router.match(method, URI)
+    if route is not None:
+        return route[0]
+    return server.ROUTE_NOT_FOUND.get(method, 405)
+
+
+def legacy_error_handling(error_code, keep_alive=False):
+    """Build an error response the way Error.error_handling did, on every call."""
+    messages = {400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed"}
+    message = messages[error_code]
+    content = f"HTTP/1.1 {error_code} {message} \r\n"
+    content += HTTPHandler.connection_header(keep_alive)
+    error_body = Error.generate_error_html_body(error_code, message)
+    content += (
+        "Content-Type: text/html \r\n" +
+        "Content-Length: " + str(len(error_body)) + "\r\n\r\n"
+        + error_body)
+    return content.encode()
+
+
+def legacy_response_header(response, content_type, content_length, keep_alive=False, extra_headers=None):
+    """Build a response header the way HTTPHandler.create_response_header did."""
+    response_header = f'HTTP/1.1 {response}\r\n'
+    if content_length is not None:
+        response_header += f'Content-Length: {content_length}\r\n'
+    if content_type is not None:
+        response_header += f'Content-Type: {content_type}\r\n'
+    if extra_headers:
+        response_header += ''.join(f'{name}: {value}\r\n' for name, value in extra_headers.items())
+    response_header += HTTPHandler.connection_header(keep_alive) + '\r\n'
+    return response_header.encode()
+
+
+# A mix of requests that are routed to a handler, and of requests that end in an error
+ROUTED = [("GET", "/"), ("GET", "/index.html"), ("GET", "/message"), ("GET", "/message/12"),
+          ("GET", "/message?limit=10&after_id=20"), ("POST", "/message"), ("PUT", "/message"),
+          ("DELETE", "/message"), ("POST", "/test.txt")]
+ERRORS = [("GET", "/missing.html"), ("POST", "/upload"), ("PATCH", "/message"), ("DELETE", "/index.html")]
+
+
+def timed(name, count, run):
+    start = time.perf_counter()
+    run(count)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<10}{count:>10} req {elapsed:>8.3f} s {count / elapsed:>14,.0f} req/s")
+    return count / elapsed
+
+
+def route_only_path(route):
+    def run(count):
+        for i in range(count):
+            method, URI = ROUTED[i % len(ROUTED)]
+            route(method, URI)
+    return run
+
+
+def routing_path(route, header):
+    def run(count):
+        for i in range(count):
+            method, URI = ROUTED[i % len(ROUTED)]
+            route(method, URI)
+            header('200 OK', "application/json", 1234, i % 2 == 0)
+    return run
+
+
+def error_path(route, error_response):
+    def run(count):
+        for i in range(count):
+            method, URI = ERRORS[i % len(ERRORS)]
+            error_response(route(method, URI), i % 2 == 0)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark routing and error responses")
+    parser.add_argument("--requests", type=int, default=200_000,
+                        help="requests for each path (default: 200000)")
+    args = parser.parse_args()
+
+    handle_error = Error()
+    paths = [
+        ("Routing only",
+         route_only_path(legacy_route),
+         route_only_path(new_route)),
+        ("Routed requests (route + 200 header)",
+         routing_path(legacy_route, legacy_response_header),
+         routing_path(new_route, HTTPHandler.create_response_header)),
+        ("Error requests (route + error response)",
+         error_path(legacy_route, legacy_error_handling),
+         error_path(new_route, handle_error.error_handling)),
+    ]
+    for name, before, after in paths:
+        print(name)
+        before_rate = timed("before", args.requests, before)
+        after_rate = timed("after", args.requests, after)
+        print(f"  speedup {after_rate / before_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
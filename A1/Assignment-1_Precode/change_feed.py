@@ -0,0 +1,183 @@
+import collections
+import contextlib
+import itertools
+import json
+import threading
+
+
+class ChangeEvent:
+    """
+    A change to the messages, as it is sent to the subscribers of the change feed.
+
+    Attributes:
+        sequence (int): The number of the change. Every change gets the next number.
+        operation (str): "create", "update" or "delete".
+        data (str): The message as compact JSON: its ID and Text, or only its ID for a delete.
+    """
+
+    __slots__ = ("sequence", "operation", "data")
+
+    def __init__(self, sequence, operation, message):
+        self.sequence = sequence
+        self.operation = operation
+        record = {"ID": message["ID"]}
+        if operation != "delete":
+            record["Text"] = message["Text"]
+        # The event is encoded once, however many subscribers it is sent to
+        self.data = json.dumps(record)
+
+    def to_json(self):
+        """
+        Returns:
+            str: The event as a JSON object, e.g. {"sequence": 7, "op": "create", "message": {"ID": 3, "Text": "Hi"}}.
+        """
+        return '{"sequence": %d, "op": "%s", "message": %s}' % (self.sequence, self.operation, self.data)
+
+    def to_server_sent_event(self):
+        """
+        Returns:
+            bytes: The event in the text/event-stream format. Its id is the sequence
+            number, so a reconnecting EventSource sends it back as Last-Event-ID.
+        """
+        return b"id: %d\nevent: %s\ndata: %s\n\n" % (self.sequence, self.operation.encode(), self.data.encode())
+
+
+class FeedBusy(Exception):
+    """Raised when a change feed already has as many subscribers as it allows."""
+
+
+class ChangeFeed:
+    """
+    The recent changes to the messages, for clients that follow them instead of
+    downloading every message again and again.
+
+    Every change gets a sequence number, and the last 'history_size' changes are kept.
+    A subscriber asks for the changes after the last sequence number it has seen, and
+    waits if there are none yet. Subscribers do not get a buffer of their own: they
+    read from the shared history with their own cursor, so a subscriber costs no memory
+    however far behind it is, and publishing never waits for a slow subscriber. A
+    subscriber that falls further behind than the history is told to start over
+    (a reset) instead of holding up the writers.
+
+    A waiting subscriber holds a thread of the server, so the feed is off until enable()
+    is called by a server that has threads to spare. A server with a single thread (or a
+    single thread per process, as in the pre-fork mode, where a waiting worker would not
+    see the changes of the others either) would otherwise stop making the changes the
+    subscribers wait for. While it is off, nothing is published and every subscription
+    is refused.
+
+    The numbers start at 0 when the server starts. Publishing and waiting are thread-safe.
+    """
+
+    def __init__(self, history_size=1024, max_subscribers=8):
+        """
+        Args:
+            history_size (int): The number of changes that are kept.
+            max_subscribers (int): The most subscribers at the same time, since every
+                subscriber holds a thread of the server while it waits.
+        """
+        self.enabled = False
+        self.history_size = history_size
+        self.max_subscribers = max_subscribers
+        self.sequence = 0
+        self._history = collections.deque(maxlen=history_size)
+        self._condition = threading.Condition()
+        self._subscribers = 0
+        self._closed = False
+
+    def enable(self, threads):
+        """
+        Turn the feed on, for a server that handles requests with 'threads' threads.
+        Subscribers may hold at most half of them, so the others are left for the
+        requests that change the messages. With fewer than two threads the feed stays off.
+
+        Args:
+            threads (int): The number of threads that handle requests.
+        """
+        self.max_subscribers = min(self.max_subscribers, threads // 2)
+        self.enabled = self.max_subscribers > 0
+
+    def publish(self, operation, message):
+        """
+        Publish a change and wake the subscribers that are waiting.
+
+        Args:
+            operation (str): "create", "update" or "delete".
+            message (dict): The message after the change (before it, for a delete).
+        """
+        self.publish_many([(operation, message)])
+
+    def publish_many(self, changes):
+        """
+        Publish several changes at once.
+
+        Args:
+            changes (list): (operation, message) tuples, see publish().
+        """
+        if not changes or not self.enabled:
+            return
+        with self._condition:
+            for operation, message in changes:
+                self.sequence += 1
+                self._history.append(ChangeEvent(self.sequence, operation, message))
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def subscription(self):
+        """
+        Count a subscriber for as long as the 'with' block runs.
+
+        Raises:
+            FeedBusy: If 'max_subscribers' subscribers are already following the feed,
+                or the feed is off.
+        """
+        with self._condition:
+            if not self.enabled or self._subscribers >= self.max_subscribers:
+                raise FeedBusy()
+            self._subscribers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._subscribers -= 1
+
+    def wait(self, since, timeout, limit=256):
+        """
+        Get the changes after a sequence number, waiting for one if there are none yet.
+
+        Args:
+            since (int): The last sequence number the subscriber has seen.
+            timeout (float): The most seconds to wait.
+            limit (int): The most changes to return.
+
+        Returns:
+            tuple: The changes (ChangeEvents, possibly none if the wait timed out or the
+            feed was closed), and whether the subscriber must start over because the
+            changes after 'since' are no longer kept (or 'since' is from before a restart).
+        """
+        with self._condition:
+            if self._is_lost(since):
+                return [], True
+
+            if since == self.sequence and not self._closed:
+                self._condition.wait_for(lambda: self.sequence != since or self._closed, timeout)
+                if self._is_lost(since):
+                    return [], True
+
+            # The history holds consecutive sequence numbers, so the position of 'since' is known
+            start = len(self._history) - (self.sequence - since)
+            return list(itertools.islice(self._history, start, start + limit)), False
+
+    def close(self):
+        """Wake every waiting subscriber, e.g. when the server stops. Later waits return right away."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _is_lost(self, since):
+        """Whether the changes after 'since' cannot be given. The caller must hold '_condition'."""
+        return since > self.sequence or self.sequence - since > len(self._history)
@@ -0,0 +1,288 @@
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+import traceback
+
+from error_handling import ERROR_RESPONSES
+
+try:
+    import fcntl
+except ImportError:     # Not available on Windows, where the pre-fork mode cannot run anyway
+    fcntl = None
+
+
+class AdmissionMixIn:
+    """
+    Mix-in class that turns connections away when they are over the limits of 'admission'
+    (an AdmissionControl, see admission.py), before a handler is started for them.
+
+    A connection that is turned away gets a prebuilt error response (503 or 429), sent
+    without waiting for the client, and is closed. The accept loop therefore never
+    blocks on a client it does not take on.
+
+    Attributes:
+        admission (AdmissionControl): The limits, or None to take on every connection.
+    """
+    admission = None
+
+    def __init__(self, *args, admission=None, **kwargs):
+        if admission is not None:
+            self.admission = admission
+        self._admitted = {}         # Socket of a connection that was taken on -> address of the client
+        self._admitted_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def verify_request(self, request, client_address):
+        """Take the connection on, or answer it with an error and return False."""
+        if self.admission is None:
+            return True
+        status = self.admission.admit_connection(client_address[0])
+        if status is not None:
+            self.reject_request(request, status)
+            return False
+        with self._admitted_lock:
+            self._admitted[request] = client_address[0]
+        return True
+
+    def reject_request(self, request, status):
+        """Send the error response for a turned away connection, if the socket takes it right away."""
+        try:
+            request.setblocking(False)
+            request.send(ERROR_RESPONSES[status, False])
+        except OSError:
+            pass
+
+    def shutdown_request(self, request):
+        """Close the connection, and give it back to the admission control if it was taken on."""
+        with self._admitted_lock:
+            ip = self._admitted.pop(request, None)
+        if ip is not None:
+            self.admission.release_connection(ip)
+        super().shutdown_request(request)
+
+
+class ThreadPoolMixIn:
+    """
+    Mix-in class that handles every connection in a fixed pool of worker threads.
+
+    socketserver.ThreadingMixIn starts a new thread for every connection and has no
+    upper limit. Here the number of threads is fixed, and accepted connections wait in
+    a bounded queue. When the queue is full the accept loop blocks, so further clients
+    wait in the listen backlog of the kernel instead of costing the server a thread each.
+    With admission control (see AdmissionMixIn) they are turned away with 503 instead.
+
+    Attributes:
+        pool_size (int): The number of worker threads.
+        queue_size (int): The number of accepted connections that may wait for a worker.
+        block_on_close (bool): Whether server_close() waits for the workers to finish.
+        concurrent_connections (bool): Whether other connections are served while one is
+            open, so that connections may be kept alive (see MyTCPHandler.should_keep_alive()).
+    """
+    concurrent_connections = True
+    pool_size = 8
+    queue_size = 64
+    block_on_close = True
+
+    def __init__(self, *args, pool_size=None, **kwargs):
+        if pool_size is not None:
+            self.pool_size = pool_size
+        self._workers = []
+        super().__init__(*args, **kwargs)
+
+    def server_activate(self):
+        """Start listening and start the worker threads."""
+        super().server_activate()
+        self._connections = queue.Queue(self.queue_size)
+        for _ in range(self.pool_size):
+            worker = threading.Thread(target=self.process_request_worker, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        """Hand the connection over to the pool instead of handling it in the accept loop."""
+        if getattr(self, "admission", None) is None:
+            self._connections.put((request, client_address))
+            return
+        try:
+            self._connections.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, 503)
+            self.shutdown_request(request)
+
+    def process_request_worker(self):
+        """Handle queued connections until the server is closed."""
+        while True:
+            connection = self._connections.get()
+            if connection is None:
+                # Sentinel put in the queue by server_close()
+                return
+
+            request, client_address = connection
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        """Close the listening socket and stop the worker threads."""
+        super().server_close()
+        for _ in self._workers:
+            self._connections.put(None)
+        if self.block_on_close:
+            for worker in self._workers:
+                worker.join()
+        self._workers = []
+
+
+class ThreadPoolTCPServer(AdmissionMixIn, ThreadPoolMixIn, socketserver.TCPServer):
+    """A TCP server that handles connections in a bounded pool of threads."""
+    allow_reuse_address = True
+
+
+class SingleTCPServer(AdmissionMixIn, socketserver.TCPServer):
+    """
+    A TCP server that handles one connection at a time. An idle keep-alive connection
+    would keep every other client waiting, so connections are closed after each response.
+    """
+    allow_reuse_address = True
+    concurrent_connections = False
+
+
+class MessageLock:
+    """
+    Lock that guards the shared messages and their storage file.
+
+    Threads in one process share a reentrant lock. When a lock file is given, the lock
+    is also held across processes with flock(), which the pre-fork mode needs because
+    every worker process has its own copy of the messages. on_acquire is then called
+    every time the lock is taken, so the process can pick up changes made by the others.
+
+    Use it as a context manager:
+
+        with messages_lock:
+            new_message = messages.create(text)
+    """
+
+    def __init__(self, lock_path=None, on_acquire=None):
+        """
+        Args:
+            lock_path (str): Path of the lock file shared between processes, or None
+                to only guard against other threads.
+            on_acquire (callable): Called without arguments each time the lock is taken.
+        """
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._lock_path = lock_path
+        self._lock_file = None
+        self._lock_file_pid = None
+        self._on_acquire = on_acquire
+
+    def share_between_processes(self, lock_path, on_acquire=None):
+        """
+        Also hold the lock across processes from now on, see the class description.
+
+        Args:
+            lock_path (str): Path of the lock file shared between processes.
+            on_acquire (callable): Called without arguments each time the lock is taken.
+        """
+        with self._lock:
+            self._lock_path = lock_path
+            self._on_acquire = on_acquire
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth += 1
+
+        # Only the outermost acquire in this process needs to take the file lock
+        if self._depth == 1 and self._lock_path is not None:
+            try:
+                fcntl.flock(self._process_lock_file(), fcntl.LOCK_EX)
+                if self._on_acquire is not None:
+                    self._on_acquire()
+            except BaseException:
+                self.__exit__(None, None, None)
+                raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._depth -= 1
+        if self._depth == 0 and self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def _process_lock_file(self):
+        """
+        Return the lock file opened by this process.
+
+        flock() locks belong to an open file, and a forked child shares its open files
+        with the parent. Each process therefore opens the lock file itself.
+        """
+        if self._lock_file_pid != os.getpid():
+            self._lock_file = open(self._lock_path, 'a')
+            self._lock_file_pid = os.getpid()
+        return self._lock_file
+
+
+def serve_prefork(server, workers):
+    """
+    Serve forever from several pre-forked worker processes.
+
+    The listening socket of 'server' is created before forking, so all workers accept
+    connections on the same socket and the kernel spreads the clients between them.
+    Returns when the parent is interrupted (SIGINT) or terminated (SIGTERM), after
+    the workers have been stopped.
+
+    Args:
+        server (socketserver.TCPServer): A bound and listening server.
+        workers (int): The number of worker processes to fork.
+    """
+    if not hasattr(os, "fork") or fcntl is None:
+        raise RuntimeError("The pre-fork mode needs os.fork() and fcntl (Unix only)")
+
+    # Turn SIGTERM into SystemExit in the parent, so the workers are cleaned up below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    children = []
+    try:
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                _run_worker(server)
+            children.append(pid)
+
+        for pid in children:
+            os.waitpid(pid, 0)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+
+def _run_worker(server):
+    """Run the accept loop in a forked worker process. Never returns."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    status = 0
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
@@ -1,21 +1,41 @@
+from HTTP_handler import HTTPHandler
+
+
 class Error:
     """
     Error class for generating HTTP error responses.
 
     This class provides methods to generate HTML error bodies and complete
-    HTTP error responses for different HTTP error codes.
+    HTTP error responses for different HTTP error codes. The responses are the same
+    every time, so they are built once, when the module is imported, and kept as bytes.
 
     Attributes:
-        None
+        MESSAGES (dict): The reason phrase of each error code.
 
     Methods:
         generate_error_html_body(error_code, message):
             Generate an HTML body for displaying an error message.
 
-        error_handling(error_code):
-            Generate an HTTP response for a given error code, including headers and error message body.
+        error_handling(error_code, keep_alive=False):
+            Get the HTTP response for a given error code, including headers and error message body.
     """
-    def generate_error_html_body(self, error_code, message):
+    MESSAGES = {
+        204: "No Content",
+        400: "Bad Request",
+        403: "Forbidden",
+        404: "Not Found",
+        405: "Method Not Allowed",
+        408: "Request Timeout",
+        413: "Content Too Large",
+        414: "URI Too Long",
+        429: "Too Many Requests",
+        431: "Request Header Fields Too Large",
+        500: "Internal Server Error",
+        503: "Service Unavailable",
+    }
+
+    @staticmethod
+    def generate_error_html_body(error_code, message):
         """
         Generate an HTML body for displaying an error message.
 
@@ -35,45 +55,61 @@ class Error:
             """
         return error_body
 
-    
-    def error_handling(self, error_code):
+    @staticmethod
+    def build_response(error_code, keep_alive):
         """
-        Generate an HTTP response for a given error code.
+        Build the HTTP response for a given error code.
 
         Args:
-            error_code (int): The HTTP error code.
+            error_code (int): The HTTP error code, one of MESSAGES.
+            keep_alive (bool): Whether the connection stays open after the response.
 
         Returns:
-            str: The complete HTTP response as a string, including headers and error message body.
+            bytes: The complete HTTP response, including headers and error message body.
         """
-        
+        message = Error.MESSAGES[error_code]
+        content = f"HTTP/1.1 {error_code} {message} \r\n"
+        content += HTTPHandler.connection_header(keep_alive)
+
+        # A client that is turned away for being over a limit may try again a second later
+        if error_code in (429, 503):
+            content += "Retry-After: 1\r\n"
+
+        # A 204 response never has a body; sending one would corrupt the next response on a kept-alive connection
         if error_code == 204:
-            message = "No Content"
-            content = "HTTP/1.1 204 No Content \r\n"
-        elif error_code == 400:
-            message = "Bad Request"
-            content = "HTTP/1.1 400 Bad Request \r\n"
-        elif error_code == 403:
-            message = "Forbidden"
-            content = "HTTP/1.1 403 Forbidden \r\n"
-        elif error_code == 404:
-            message = "Not Found"
-            content = "HTTP/1.1 404 Not Found \r\n"
-        elif error_code == 405:
-            message = "Method Not Allowed"
-            content = "HTTP/1.1 405 Method Not Allowed \r\n"
-        elif error_code == 500:
-            message = "Internal Server Error"
-            content = "HTTP/1.1 500 Internal Server Error \r\n"
-        else:
-            print("In the error handling function, something went wrong.")
+            return (content + "\r\n").encode()
 
         # Create the error body
-        error_body = self.generate_error_html_body(error_code, message)
+        error_body = Error.generate_error_html_body(error_code, message)
 
         content += (
             "Content-Type: text/html \r\n" +
-            "Content-Length: " + str(len(error_body)) +"\r\n\r\n"       # dont work if i do it like the others 
+            "Content-Length: " + str(len(error_body)) +"\r\n\r\n"       # dont work if i do it like the others
             + error_body)
-            
-        return content
+
+        return content.encode()
+
+    def error_handling(self, error_code, keep_alive=False):
+        """
+        Get the HTTP response for a given error code.
+
+        Args:
+            error_code (int): The HTTP error code.
+            keep_alive (bool): Whether the connection stays open after the response.
+
+        Returns:
+            bytes: The complete HTTP response, including headers and error message body.
+        """
+        response = ERROR_RESPONSES.get((error_code, keep_alive))
+        if response is None:
+            print("In the error handling function, something went wrong.")
+            response = ERROR_RESPONSES[500, keep_alive]
+        return response
+
+
+# Every error response, for connections that are kept alive and for those that are closed
+ERROR_RESPONSES = {
+    (error_code, keep_alive): Error.build_response(error_code, keep_alive)
+    for error_code in Error.MESSAGES
+    for keep_alive in (True, False)
+}
@@ -0,0 +1,118 @@
+import os
+import stat
+import threading
+from collections import OrderedDict
+
+
+class OpenFile:
+    """
+    A file kept open by the OpenFileCache, with the metadata it was opened with.
+
+    Attributes:
+        path (str): The path the file was opened from.
+        fd (int): The open file descriptor. Read it with explicit offsets (os.pread,
+            os.sendfile), since the same descriptor is shared between requests.
+        size (int): The size of the file in bytes.
+        mtime (float): The modification time of the file.
+    """
+
+    def __init__(self, path, fd, file_stat):
+        self.path = path
+        self.fd = fd
+        self.size = file_stat.st_size
+        self.mtime = file_stat.st_mtime
+        self.identity = stat_identity(file_stat)
+        self.users = 0          # Requests that are using the descriptor right now
+        self.evicted = False    # Closed by the last user, once it has been evicted
+
+
+class OpenFileCache:
+    """
+    A small LRU cache of open file descriptors for the static files.
+
+    Serving a file used to cost os.path.exists(), open(), read() and close() on every
+    request. With the cache it costs one os.stat(), which also notices when the file
+    has been changed or replaced, in which case it is opened again.
+
+    A request uses a file between acquire() and release(). A file that is evicted while
+    it is in use is closed when the last request releases it.
+    """
+
+    def __init__(self, max_files=64):
+        """
+        Args:
+            max_files (int): The most file descriptors to keep open.
+        """
+        self.max_files = max_files
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, path):
+        """
+        Get an open file for 'path'. Call release() when the request is done with it.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            OpenFile: The open file, or None if there is no regular file at 'path'.
+        """
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+
+        with self._lock:
+            open_file = self._files.get(path)
+            if open_file is not None and open_file.identity == stat_identity(file_stat):
+                self._files.move_to_end(path)
+                open_file.users += 1
+                return open_file
+
+            # The file is new, or has been changed since it was opened
+            if open_file is not None:
+                self._evict(path)
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            # Take the metadata from the descriptor, in case the file was replaced in between
+            open_file = OpenFile(path, fd, os.fstat(fd))
+        except OSError:
+            return None
+
+        with self._lock:
+            open_file.users += 1
+            if path in self._files:
+                # Another request opened it in the meantime, so this one is not kept
+                open_file.evicted = True
+            else:
+                self._files[path] = open_file
+                while len(self._files) > self.max_files:
+                    self._evict(next(iter(self._files)))
+        return open_file
+
+    def release(self, open_file):
+        """Tell the cache that a request is done with a file from acquire()."""
+        with self._lock:
+            open_file.users -= 1
+            if open_file.evicted and open_file.users == 0:
+                os.close(open_file.fd)
+
+    def clear(self):
+        """Close every file that is not in use, and the rest once they are released."""
+        with self._lock:
+            for path in list(self._files):
+                self._evict(path)
+
+    def _evict(self, path):
+        open_file = self._files.pop(path)
+        open_file.evicted = True
+        if open_file.users == 0:
+            os.close(open_file.fd)
+
+
+def stat_identity(file_stat):
+    """Identify a version of a file by its device, inode, size and modification time."""
+    return (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
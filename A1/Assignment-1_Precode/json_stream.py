@@ -0,0 +1,63 @@
+import json
+
+
+class JSONArrayEncoder:
+    """
+    Encodes a JSON array piece by piece, so it can be sent while it is being encoded.
+
+    Only one item is encoded at a time, and the output is handed out in pieces of about
+    'chunk_size' bytes, so memory use does not grow with the number of items. With an
+    indentation the output is the same as json.dumps(items, indent=indent), without one
+    it is as compact as possible, which is what programs reading the output prefer.
+    """
+
+    def __init__(self, indent=None, chunk_size=64 * 1024):
+        """
+        Args:
+            indent (int): The indentation, as for json.dumps(), or None for compact output.
+            chunk_size (int): The size the pieces of output are collected into.
+        """
+        self.indent = indent
+        self.chunk_size = chunk_size
+        if indent is None:
+            self._encoder = json.JSONEncoder(separators=(",", ":"))
+        else:
+            self._encoder = json.JSONEncoder(indent=indent)
+
+    def iterencode(self, items):
+        """
+        Encode the items as a JSON array.
+
+        Args:
+            items (iterable): The items. They are only iterated over once.
+
+        Yields:
+            bytes: Pieces of the encoded array, of about 'chunk_size' bytes.
+        """
+        if self.indent is None:
+            opening, separator, closing = "[", ",", "]"
+        else:
+            # The items are indented one level inside the array, as json.dumps() does
+            padding = "\n" + " " * self.indent if isinstance(self.indent, int) else "\n" + self.indent
+            opening, separator, closing = "[" + padding, "," + padding, "\n]"
+
+        pending = []
+        pending_size = 0
+        first = True
+        for item in items:
+            text = self._encoder.encode(item)
+            if self.indent is not None:
+                # Strings in JSON cannot contain a raw newline, so every newline is a line break of the layout
+                text = text.replace("\n", padding)
+            text = (opening if first else separator) + text
+            first = False
+
+            pending.append(text)
+            pending_size += len(text)
+            if pending_size >= self.chunk_size:
+                yield "".join(pending).encode()
+                pending = []
+                pending_size = 0
+
+        pending.append("[]" if first else closing)
+        yield "".join(pending).encode()
@@ -0,0 +1,149 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+class SortedIndex:
+    """
+    A sorted collection of keys that supports range scans.
+
+    The keys are kept in blocks of at most 'block_size' sorted keys, so adding or
+    removing a key only moves the keys of one block instead of the whole list:
+
+        add, remove          O(log n + block_size)
+        iterate from a key   O(log n) to start, then O(1) per key
+    """
+
+    def __init__(self, keys=(), block_size=512):
+        """
+        Args:
+            keys (iterable): Keys to start with.
+            block_size (int): The largest number of keys in one block.
+        """
+        self.block_size = block_size
+        keys = sorted(keys)
+        self._blocks = [keys[i:i + block_size] for i in range(0, len(keys), block_size)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._length = len(keys)
+
+    def add(self, key):
+        """Add a key. Adding a key that is already there adds a second copy."""
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+        else:
+            i = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+            block = self._blocks[i]
+            insort(block, key)
+            self._maxes[i] = block[-1]
+
+            # Split a full block in two, so blocks stay small
+            if len(block) > self.block_size:
+                half = len(block) // 2
+                self._blocks[i:i + 1] = [block[:half], block[half:]]
+                self._maxes[i:i + 1] = [block[half - 1], block[-1]]
+        self._length += 1
+
+    def remove(self, key):
+        """Remove one copy of a key. Does nothing if the key is not there."""
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            return
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            return
+
+        del block[j]
+        self._length -= 1
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def iterate_from(self, key, inclusive=True):
+        """
+        Iterate over the keys from 'key' and up, in sorted order.
+
+        Args:
+            key: Where to start.
+            inclusive (bool): Whether a key equal to 'key' is included.
+        """
+        find = bisect_left if inclusive else bisect_right
+        i = find(self._maxes, key)
+        if i == len(self._blocks):
+            return
+        yield from self._blocks[i][find(self._blocks[i], key):]
+        for block in self._blocks[i + 1:]:
+            yield from block
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __len__(self):
+        return self._length
+
+
+class TrigramIndex:
+    """
+    Finds the texts that contain a substring, without looking at every text.
+
+    Every text is indexed under each of its trigrams (substrings of three characters).
+    A text that contains the query contains all of the query's trigrams, so only the
+    texts found under every trigram of the query need to be checked. Texts and queries
+    shorter than three characters are handled by looking through the index keys instead.
+    Texts are compared in lowercase.
+    """
+
+    def __init__(self):
+        self._postings = {}     # Trigram (or whole short text) -> set of IDs
+
+    @staticmethod
+    def grams(text):
+        """Return the set of index keys of a lowercase text."""
+        if len(text) < 3:
+            return {text}
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, message_id, text):
+        for gram in self.grams(str(text).lower()):
+            self._postings.setdefault(gram, set()).add(message_id)
+
+    def remove(self, message_id, text):
+        for gram in self.grams(str(text).lower()):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(message_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def candidates(self, query):
+        """
+        Find the IDs of the texts that may contain 'query'.
+
+        Every text that contains the query is among the candidates, but the caller
+        must still check each candidate, since all trigrams being present does not
+        mean that they are next to each other.
+
+        Args:
+            query (str): The lowercase substring.
+
+        Returns:
+            set: The candidate IDs.
+        """
+        if len(query) < 3:
+            # Every text that contains the query has an index key that contains it
+            found = set()
+            for gram, postings in self._postings.items():
+                if query in gram:
+                    found |= postings
+            return found
+
+        # Start from the rarest trigram, so the intersection stays small
+        postings = sorted((self._postings.get(gram, set()) for gram in self.grams(query)), key=len)
+        found = set(postings[0])
+        for other in postings[1:]:
+            if not found:
+                break
+            found &= other
+        return found
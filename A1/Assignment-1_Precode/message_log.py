@@ -0,0 +1,299 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class MessageLog:
+    """
+    Durable storage for a MessageStore: a snapshot plus an append-only write-ahead log.
+
+    The snapshot (message.json) holds all messages as they were at the last compaction,
+    in the same format as before. Every change after that is appended to the log
+    (message.log) as one JSON record per line:
+
+        {"op": "create", "ID": 1, "Text": "Hello"}
+        {"op": "update", "ID": 1, "Text": "Hello again"}
+        {"op": "delete", "ID": 1}
+
+    A write therefore costs the size of the change, not the size of all messages.
+    Records hold the new state of a message, so replaying one twice gives the same
+    result, and a record that was cut short by a crash is ignored when the log is read.
+
+    fsync() is batched (group commit): the log is synced by a background thread at most
+    every 'fsync_interval' seconds, or right away when 'fsync_batch' records are waiting.
+    With fsync_interval=0 every append is synced before it returns. The same background
+    thread compacts the log into a new snapshot once it has grown past 'compact_size'.
+
+    All methods except close() must be called while holding 'lock'.
+    """
+
+    def __init__(self, store, lock, snapshot_path="message.json", log_path="message.log",
+                 fsync_interval=0.05, fsync_batch=64, compact_interval=30, compact_size=1 << 20):
+        """
+        Args:
+            store (MessageStore): The messages that are persisted.
+            lock (MessageLock): The lock that guards 'store'.
+            snapshot_path (str): Path of the snapshot file.
+            log_path (str): Path of the log file.
+            fsync_interval (float): Most seconds an appended record waits for fsync(), 0 to sync every append.
+            fsync_batch (int): Number of waiting records that triggers an fsync() right away.
+            compact_interval (float): Seconds between checks of whether the log should be compacted.
+            compact_size (int): Size of the log (in bytes) that triggers a compaction.
+        """
+        self.store = store
+        self.lock = lock
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.compact_interval = compact_interval
+        self.compact_size = compact_size
+
+        self._log_file = None
+        self._log_offset = 0            # Where our view of the log ends
+        self._snapshot_stamp = None     # The snapshot our view of the messages is based on
+        self._unsynced = 0              # Records written but not yet synced to disk
+        self._sync_lock = threading.Lock()
+        self._background = None
+        self._background_pid = None
+        self._closed = threading.Event()
+
+    def load(self):
+        """Load the snapshot into the store and replay the log on top of it."""
+        messages = []
+        self._snapshot_stamp = file_stamp(self.snapshot_path)
+        if self._snapshot_stamp is not None:
+            with open(self.snapshot_path, 'r') as snapshot_file:
+                messages = json.load(snapshot_file)
+        self.store.load(messages)
+
+        self._log_offset = 0
+        self._replay_log()
+
+    def exists(self):
+        """
+        Returns:
+            bool: True if the messages have been stored before (a snapshot or a log exists).
+        """
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.log_path)
+
+    def catch_up(self):
+        """
+        Apply the changes that other processes have made since we last looked, which
+        the pre-fork mode needs since every worker has its own copy of the messages.
+        """
+        if file_stamp(self.snapshot_path) != self._snapshot_stamp:
+            # Another process has compacted the log, so start over from the new snapshot
+            self._close_log_file()
+            self.load()
+        elif self._log_size() > self._log_offset:
+            self._replay_log()
+
+    def append(self, operation, message):
+        """
+        Append a change to the log.
+
+        Args:
+            operation (str): "create", "update" or "delete".
+            message (dict): The message after the change (before it, for a delete).
+        """
+        self.append_many([(operation, message)])
+
+    def append_many(self, changes):
+        """
+        Append several changes to the log with a single write.
+
+        Args:
+            changes (list): (operation, message) tuples, see append().
+        """
+        records = []
+        for operation, message in changes:
+            record = {"op": operation, "ID": message["ID"]}
+            if operation != "delete":
+                record["Text"] = message["Text"]
+            records.append(json.dumps(record) + "\n")
+        if not records:
+            return
+
+        log_file = self._open_log_file()
+        log_file.write("".join(records).encode())
+        log_file.flush()
+        self._log_offset = log_file.tell()
+
+        with self._sync_lock:
+            self._unsynced += len(records)
+            sync_now = self.fsync_interval <= 0 or self._unsynced >= self.fsync_batch
+        if sync_now:
+            self.sync()
+
+        self._start_background_thread()
+
+    def sync(self):
+        """Make sure every appended record is on disk."""
+        with self._sync_lock:
+            if self._unsynced and self._log_file is not None:
+                os.fsync(self._log_file.fileno())
+            self._unsynced = 0
+
+    def compact(self):
+        """
+        Write all messages to a new snapshot and empty the log.
+        """
+        self._install_snapshot(self._write_snapshot(self.store.to_list()), self._log_offset)
+
+    def compact_in_background(self):
+        """
+        Compact the log if it has grown past 'compact_size'. Unlike the other methods,
+        this one takes the lock itself, and releases it while the snapshot is written,
+        so requests are only held up while the messages are copied.
+        """
+        with self.lock:
+            if self._log_offset < self.compact_size:
+                return
+            # Copy the messages, since updates change them in place
+            messages = [dict(message) for message in self.store]
+            snapshot_stamp, log_offset = self._snapshot_stamp, self._log_offset
+
+        temporary_snapshot = self._write_snapshot(messages)
+
+        with self.lock:
+            if self._snapshot_stamp != snapshot_stamp:
+                # Another process compacted the log in the meantime
+                os.remove(temporary_snapshot)
+                return
+            self._install_snapshot(temporary_snapshot, log_offset)
+
+    def _write_snapshot(self, messages):
+        """
+        Write the messages to a new temporary snapshot file and sync it.
+
+        Returns:
+            str: The path of the temporary file.
+        """
+        directory, name = os.path.split(os.path.abspath(self.snapshot_path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix=name + ".", suffix=".tmp", delete=False) as snapshot_file:
+            json.dump(messages, snapshot_file, indent=4)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        return snapshot_file.name
+
+    def _install_snapshot(self, temporary_snapshot, log_offset):
+        """
+        Move a temporary snapshot into place, and keep only the log records after
+        'log_offset', which the snapshot does not contain.
+
+        Both files are replaced by renaming a new file over them, so a crash leaves
+        either the old or the new file. If we crash between the two renames, the old log
+        is replayed on top of the new snapshot at startup, which does not change anything.
+        """
+        self._close_log_file()
+
+        remaining_records = b""
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as log_file:
+                log_file.seek(log_offset)
+                remaining_records = log_file.read()
+
+        with open(self.log_path + ".tmp", 'wb') as log_file:
+            log_file.write(remaining_records)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+
+        os.replace(temporary_snapshot, self.snapshot_path)
+        os.replace(self.log_path + ".tmp", self.log_path)
+
+        self._snapshot_stamp = file_stamp(self.snapshot_path)
+        self._log_offset = len(remaining_records)
+
+    def close(self):
+        """Stop the background thread and sync the log."""
+        self._closed.set()
+        if self._background is not None and self._background_pid == os.getpid():
+            self._background.join()
+        self.sync()
+        self._close_log_file()
+
+    def _replay_log(self):
+        """Apply the records after our current log offset to the store."""
+        if not os.path.exists(self.log_path):
+            return
+
+        with open(self.log_path, 'rb') as log_file:
+            log_file.seek(self._log_offset)
+            for line in log_file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("record was cut short")
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash in the middle of an append, the record never completed
+                    break
+
+                if record["op"] == "delete":
+                    self.store.delete(record["ID"])
+                else:
+                    self.store.put(record["ID"], record["Text"])
+                self._log_offset += len(line)
+
+        # Drop an incomplete record, so new records are not appended after it
+        if self._log_size() > self._log_offset:
+            self._close_log_file()
+            os.truncate(self.log_path, self._log_offset)
+
+    def _log_size(self):
+        try:
+            return os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            return 0
+
+    def _open_log_file(self):
+        if self._log_file is None:
+            self._log_file = open(self.log_path, 'ab')
+        return self._log_file
+
+    def _close_log_file(self):
+        with self._sync_lock:
+            if self._log_file is not None:
+                if self._unsynced:
+                    os.fsync(self._log_file.fileno())
+                    self._unsynced = 0
+                self._log_file.close()
+                self._log_file = None
+
+    def _start_background_thread(self):
+        """
+        Start the thread that syncs and compacts the log. It is started on the first
+        append in each process, since a forked worker does not inherit the parent's threads.
+        """
+        if self._background_pid == os.getpid() or self._closed.is_set():
+            return
+        self._background_pid = os.getpid()
+        self._background = threading.Thread(target=self._background_loop, daemon=True)
+        self._background.start()
+
+    def _background_loop(self):
+        interval = self.fsync_interval if self.fsync_interval > 0 else self.compact_interval
+        next_compaction_check = time.monotonic() + self.compact_interval
+
+        while not self._closed.wait(interval):
+            self.sync()
+
+            if time.monotonic() >= next_compaction_check:
+                next_compaction_check = time.monotonic() + self.compact_interval
+                self.compact_in_background()
+
+
+def file_stamp(filename):
+    """
+    Identify the current version of a file by its inode, size and modification time.
+
+    Returns:
+        tuple: The stamp, or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,340 @@
+import heapq
+
+from message_index import SortedIndex, TrigramIndex
+
+
+def to_message_id(value):
+    """
+    Convert an ID from a request to the integer IDs the server creates. JSON does not
+    tell integers and floats apart, so 1.0 is the ID 1.
+
+    Args:
+        value: The ID, as decoded from JSON.
+
+    Returns:
+        int: The ID, or None if it is not an integer (e.g., 1.5, "1", true or a list).
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return None
+
+
+class MessageStore:
+    """
+    In-memory store of the messages, indexed by ID.
+
+    Messages are dictionaries with the keys "ID" and "Text", as they are stored in
+    message.json. A dictionary maps each ID to its message, and a min-heap holds the IDs
+    that have been freed by deletes. A new message gets the smallest free ID, just like
+    before, but without scanning the messages:
+
+        get                         O(1)
+        create, put, update, delete O(log n) plus the length of the text
+
+    query() uses three further indexes, so it does not have to look at every message:
+    the IDs in sorted order (for pagination), the lowercase texts in sorted order (for
+    prefix filters) and the trigrams of the texts (for substring filters).
+
+    get(), put(), update() and delete() convert an ID that is an integer in another
+    form (1.0) to the integer, so the message is indexed, and its ID freed, under the
+    same key as when it was created.
+
+    Iterating over the store yields the messages in the order they were created.
+    'version' is increased by every change, so anything derived from the messages
+    (e.g., an encoded response) can be reused for as long as it stays the same.
+    The store is not thread-safe, callers must hold 'messages_lock' (see server.py).
+    """
+
+    def __init__(self, messages=()):
+        """
+        Args:
+            messages (iterable): Messages to start with, e.g. the content of message.json.
+        """
+        self.version = 0
+        self.load(messages)
+
+    def load(self, messages):
+        """
+        Replace the content of the store.
+
+        Args:
+            messages (iterable): Dictionaries with the keys "ID" and "Text".
+        """
+        self._index = {message["ID"]: message for message in messages}
+
+        # IDs below the highest one in use that are free, smallest first
+        integer_ids = [message_id for message_id in self._index if isinstance(message_id, int)]
+        self._next_id = max(integer_ids, default=0) + 1
+        self._free_ids = [message_id for message_id in range(1, self._next_id) if message_id not in self._index]
+        heapq.heapify(self._free_ids)
+
+        # The query indexes only cover integer IDs, which is all the server creates
+        self._ids = SortedIndex(integer_ids)
+        self._texts = SortedIndex((str(self._index[message_id]["Text"]).lower(), message_id) for message_id in integer_ids)
+        self._trigrams = TrigramIndex()
+        for message_id in integer_ids:
+            self._trigrams.add(message_id, self._index[message_id]["Text"])
+
+        self.version += 1
+
+    def get(self, message_id):
+        """
+        Look up a message.
+
+        Args:
+            message_id (int): The ID of the message.
+
+        Returns:
+            dict: The message, or None if there is no message with that ID.
+        """
+        try:
+            return self._index.get(self._key(message_id))
+        except TypeError:
+            # An unhashable ID (e.g., a list from a JSON body) never matches a message
+            return None
+
+    def create(self, text):
+        """
+        Create a message with the smallest free ID.
+
+        Args:
+            text (str): The text of the message.
+
+        Returns:
+            dict: The new message.
+        """
+        message_id = self._next_id
+        while self._free_ids:
+            free_id = heapq.heappop(self._free_ids)
+            # put() may have taken the ID after it was freed
+            if free_id not in self._index:
+                message_id = free_id
+                break
+        if message_id == self._next_id:
+            self._next_id += 1
+
+        return self._add({"ID": message_id, "Text": text})
+
+    def put(self, message_id, text):
+        """
+        Create or replace the message with the given ID, e.g. when replaying a log.
+
+        Args:
+            message_id (int): The ID of the message.
+            text (str): The text of the message.
+
+        Returns:
+            dict: The message.
+        """
+        message_id = self._key(message_id)
+        message = self.get(message_id)
+        if message is not None:
+            return self._set_text(message, text)
+
+        # IDs skipped over become free. A free ID that is taken here stays in the heap
+        # until create() pops it and sees that it is in use.
+        if isinstance(message_id, int) and message_id >= self._next_id:
+            for free_id in range(self._next_id, message_id):
+                heapq.heappush(self._free_ids, free_id)
+            self._next_id = message_id + 1
+
+        return self._add({"ID": message_id, "Text": text})
+
+    def update(self, message_id, text):
+        """
+        Replace the text of a message.
+
+        Args:
+            message_id (int): The ID of the message.
+            text (str): The new text.
+
+        Returns:
+            dict: The updated message, or None if there is no message with that ID.
+        """
+        message = self.get(message_id)
+        if message is not None:
+            self._set_text(message, text)
+        return message
+
+    def delete(self, message_id):
+        """
+        Delete a message and free its ID for reuse.
+
+        Args:
+            message_id (int): The ID of the message.
+
+        Returns:
+            dict: The deleted message, or None if there is no message with that ID.
+        """
+        message_id = self._key(message_id)
+        if self.get(message_id) is None:
+            return None
+
+        message = self._index.pop(message_id)
+        # The stored ID decides, since it is the one the message was indexed under
+        stored_id = message["ID"]
+        if isinstance(stored_id, int):
+            self._unindex(message)
+            if 0 < stored_id < self._next_id:
+                heapq.heappush(self._free_ids, stored_id)
+        self.version += 1
+        return message
+
+    def check_batch(self, operations):
+        """
+        Check whether a batch of operations can be applied, without changing anything.
+
+        Updates and deletes must name a message that exists before the batch, and that
+        is not deleted by an earlier operation of the batch. They cannot refer to a
+        message that the batch creates, since its ID is only chosen when it is applied.
+
+        Args:
+            operations (list): ("create", None, text), ("update", ID, text) or ("delete", ID, None) tuples.
+
+        Returns:
+            list: For each operation, None if it can be applied, otherwise the reason why not.
+        """
+        deleted = set()
+        problems = []
+        for operation, message_id, text in operations:
+            if operation == "create":
+                problems.append(None)
+            elif self.get(message_id) is None or message_id in deleted:
+                problems.append("message not found")
+            else:
+                if operation == "delete":
+                    deleted.add(message_id)
+                problems.append(None)
+        return problems
+
+    def apply_batch(self, operations):
+        """
+        Apply a batch of operations, in order. Check it with check_batch() first, so
+        that either all of the operations are applied or none of them.
+
+        Args:
+            operations (list): The operations, as for check_batch().
+
+        Returns:
+            list: (operation, message) tuples with a copy of each message right after
+            its operation (before it, for a delete), as for MessageLog.append_many().
+        """
+        changes = []
+        for operation, message_id, text in operations:
+            if operation == "create":
+                message = self.create(text)
+            elif operation == "update":
+                message = self.update(message_id, text)
+            else:
+                message = self.delete(message_id)
+            # A later operation of the batch may change the same message
+            changes.append((operation, dict(message)))
+        return changes
+
+    def query(self, after_id=None, limit=None, prefix=None, contains=None):
+        """
+        Find messages by ID range and text, in order of their IDs.
+
+        Args:
+            after_id (int): Only messages with a larger ID (a pagination cursor).
+            limit (int): The most messages to return.
+            prefix (str): Only messages whose text starts with this (ignoring case).
+            contains (str): Only messages whose text contains this (ignoring case).
+
+        Returns:
+            list: The matching messages.
+        """
+        prefix = prefix.lower() if prefix else None
+        contains = contains.lower() if contains else None
+
+        if contains is not None:
+            # The trigram index narrows the search down to a few candidates
+            candidate_ids = sorted(self._trigrams.candidates(contains))
+        elif prefix is not None:
+            # The texts with the prefix are next to each other in the sorted text index
+            candidate_ids = []
+            for text, message_id in self._texts.iterate_from((prefix,)):
+                if not text.startswith(prefix):
+                    break
+                candidate_ids.append(message_id)
+            candidate_ids.sort()
+        elif after_id is not None:
+            candidate_ids = self._ids.iterate_from(after_id, inclusive=False)
+        else:
+            candidate_ids = self._ids
+
+        found = []
+        for message_id in candidate_ids:
+            if limit is not None and len(found) >= limit:
+                break
+            if after_id is not None and message_id <= after_id:
+                continue
+
+            message = self._index[message_id]
+            text = str(message["Text"]).lower()
+            if prefix is not None and not text.startswith(prefix):
+                continue
+            if contains is not None and contains not in text:
+                continue
+            found.append(message)
+
+        return found
+
+    def to_list(self):
+        """
+        Returns:
+            list: The messages in the order they were created, ready for json.dumps().
+        """
+        return list(self._index.values())
+
+    @staticmethod
+    def _key(message_id):
+        """The ID as the messages are keyed by: an integer if it is one, otherwise unchanged."""
+        integer_id = to_message_id(message_id)
+        return message_id if integer_id is None else integer_id
+
+    def _add(self, message):
+        """Add a new message and index it."""
+        self._index[message["ID"]] = message
+        if isinstance(message["ID"], int):
+            self._ids.add(message["ID"])
+            self._index_text(message)
+        self.version += 1
+        return message
+
+    def _set_text(self, message, text):
+        """Change the text of a message and re-index it."""
+        indexed = isinstance(message["ID"], int)
+        if indexed:
+            self._unindex_text(message)
+        message["Text"] = text
+        if indexed:
+            self._index_text(message)
+        self.version += 1
+        return message
+
+    def _unindex(self, message):
+        """Remove a message from the query indexes."""
+        self._ids.remove(message["ID"])
+        self._unindex_text(message)
+
+    def _index_text(self, message):
+        self._texts.add((str(message["Text"]).lower(), message["ID"]))
+        self._trigrams.add(message["ID"], message["Text"])
+
+    def _unindex_text(self, message):
+        self._texts.remove((str(message["Text"]).lower(), message["ID"]))
+        self._trigrams.remove(message["ID"], message["Text"])
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index.values())
+
+    def __contains__(self, message_id):
+        return self.get(message_id) is not None
@@ -0,0 +1,194 @@
+import bisect
+import threading
+import time
+
+
+class Histogram:
+    """
+    Counts observations (e.g., durations in seconds) in buckets, the way Prometheus does.
+
+    Attributes:
+        bounds (tuple): The upper bound of each bucket, in increasing order.
+        counts (list): The number of observations in each bucket, and above the last bound.
+        sum (float): The sum of all observations.
+        count (int): The number of observations.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """
+        Returns:
+            list: The lines of the histogram in the Prometheus text format, with cumulative buckets.
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {self.count}')
+        labels = "{" + labels.rstrip(",") + "}" if labels else ""
+        lines.append(f"{name}_sum{labels} {self.sum:.6f}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the requests the server has answered.
+
+    When 'enabled' is False nothing is recorded, and the server only pays for checking
+    the flag at the few places it would record something. All methods are thread-safe.
+    Every process of the pre-fork mode has its own metrics.
+
+    Recorded are the latency of the requests of each route, the time spent in each phase
+    of a request (parse, route, handler, persist and write), the number of responses by
+    route and status code, the number of requests being handled and the bytes received
+    and sent.
+    """
+
+    # The upper bounds of the latency buckets, in seconds
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PHASES = ("parse", "route", "handler", "persist", "write")
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._requests = {}         # (route, status) -> number of responses
+        self._latencies = {}        # route -> Histogram
+        self._phases = {phase: Histogram(self.LATENCY_BUCKETS) for phase in self.PHASES}
+        self._in_flight = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+    def request_started(self):
+        """Count a request that is being handled, until request_finished() is called."""
+        with self._lock:
+            self._in_flight += 1
+
+    def request_finished(self, route, status, seconds):
+        """
+        Record an answered request.
+
+        Args:
+            route (str): The route that answered it.
+            status (int): The status code of the response, or None if no response was written.
+            seconds (float): How long the request took.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            key = (route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._latencies.get(route)
+            if histogram is None:
+                histogram = self._latencies[route] = Histogram(self.LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def count_response(self, route, status):
+        """Count a response that was not the answer to a handled request, e.g. to a malformed one."""
+        with self._lock:
+            key = (route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def observe_phase(self, phase, seconds):
+        """Record the time spent in a phase of a request, one of PHASES."""
+        with self._lock:
+            self._phases[phase].observe(seconds)
+
+    def add_bytes_in(self, count):
+        with self._lock:
+            self._bytes_in += count
+
+    def add_bytes_out(self, count):
+        with self._lock:
+            self._bytes_out += count
+
+    def render(self):
+        """
+        Returns:
+            bytes: The metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            lines = [
+                "# HELP http_requests_total Responses sent, by route and status code.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (route, status), count in sorted(self._requests.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                lines.append(f'http_requests_total{{route="{route}",status="{status or ""}"}} {count}')
+
+            lines += [
+                "# HELP http_request_duration_seconds Time from a parsed request to its answer, by route.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for route, histogram in sorted(self._latencies.items()):
+                lines += histogram.render("http_request_duration_seconds", f'route="{route}",')
+
+            lines += [
+                "# HELP http_phase_duration_seconds Time spent in each phase of a request.",
+                "# TYPE http_phase_duration_seconds histogram",
+            ]
+            for phase in self.PHASES:
+                lines += self._phases[phase].render("http_phase_duration_seconds", f'phase="{phase}",')
+
+            lines += [
+                "# HELP http_requests_in_flight Requests being handled.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self._in_flight}",
+                "# HELP http_received_bytes_total Bytes received from clients.",
+                "# TYPE http_received_bytes_total counter",
+                f"http_received_bytes_total {self._bytes_in}",
+                "# HELP http_sent_bytes_total Bytes sent to clients, including files.",
+                "# TYPE http_sent_bytes_total counter",
+                f"http_sent_bytes_total {self._bytes_out}",
+                "# HELP process_start_time_seconds When the metrics started, in seconds since the epoch.",
+                "# TYPE process_start_time_seconds gauge",
+                f"process_start_time_seconds {self._started:.3f}",
+            ]
+        return ("\n".join(lines) + "\n").encode()
+
+
+class MeteredWriter:
+    """
+    Wraps the wfile of a handler to count the bytes that are written, measure how long
+    writing takes and find the status code of each response.
+
+    Call start_response() before each request. Every other attribute is the wfile's own.
+    """
+
+    def __init__(self, wfile, metrics):
+        self.wfile = wfile
+        self.metrics = metrics
+        self.status = None
+        self.write_time = 0.0
+
+    def start_response(self):
+        self.status = None
+        self.write_time = 0.0
+
+    def write(self, data):
+        if self.status is None and data[:5] == b"HTTP/":
+            # The status code follows the version, e.g. 'HTTP/1.1 200 OK'
+            try:
+                self.status = int(data[9:12])
+            except ValueError:
+                pass
+        started = time.perf_counter()
+        written = self.wfile.write(data)
+        self.write_time += time.perf_counter() - started
+        self.metrics.add_bytes_out(len(data))
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
@@ -0,0 +1,306 @@
+import abc
+import collections
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+
+class ProfileWindow:
+    """
+    The profile of the requests sampled during a window of time.
+
+    Attributes:
+        start (float): When the window started, in seconds since the epoch.
+        end (float): When the window ended, or None while it is the current window.
+        requests (int): The number of requests that were sampled.
+        data: What the profiler collected, e.g. pstats.Stats or a Counter of stacks.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+        self.requests = 0
+        self.data = None
+
+
+class SamplingProfiler(abc.ABC):
+    """
+    Profiles a random fraction of the requests, and keeps the results in windows of time.
+
+    Only 'sample_rate' of the requests are profiled, so the others run at full speed.
+    Every 'window_seconds' the current window is closed, and the last 'windows' closed
+    windows are kept, so the profile shows recent traffic and its memory stays bounded.
+    dump() writes the windows to files, and report() summarizes them as text.
+
+    It is abstract: subclasses decide how a request is profiled (run_sampled()), how the
+    results of two requests are combined (merge()), and how they are written and summarized.
+    """
+
+    # The extension of the files that dump() writes
+    EXTENSION = ""
+
+    # Whether only one request can be profiled at a time. A request that is sampled while
+    # another one is being profiled runs without the profiler.
+    exclusive = False
+
+    def __init__(self, sample_rate=0.01, window_seconds=60, windows=10):
+        """
+        Args:
+            sample_rate (float): The fraction of requests to profile, between 0 and 1.
+            window_seconds (float): The length of a window.
+            windows (int): The number of closed windows that are kept.
+        """
+        self.sample_rate = sample_rate
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._active = threading.Lock()     # Held while a request is profiled
+        self._current = ProfileWindow(time.time())
+        self._closed = collections.deque(maxlen=windows)
+
+    def run(self, function, *args):
+        """
+        Call function(*args), and profile the call if it is sampled.
+
+        Returns:
+            The result of the function.
+        """
+        if random.random() >= self.sample_rate:
+            return function(*args)
+        if not self.exclusive:
+            result, data = self.run_sampled(function, args)
+        elif self._active.acquire(blocking=False):
+            try:
+                result, data = self.run_sampled(function, args)
+            finally:
+                self._active.release()
+        else:
+            return function(*args)
+
+        with self._lock:
+            window = self._window()
+            window.data = self.merge(window.data, data)
+            window.requests += 1
+        return result
+
+    def windows(self):
+        """
+        Returns:
+            list: Copies of the kept windows that have samples, oldest first, including
+            the current one. Requests that are sampled later do not change the copies.
+        """
+        with self._lock:
+            self._window()
+            copies = []
+            for window in (*self._closed, self._current):
+                if window.requests:
+                    copy = ProfileWindow(window.start)
+                    copy.end = window.end
+                    copy.requests = window.requests
+                    copy.data = self.merge(None, window.data)
+                    copies.append(copy)
+            return copies
+
+    def dump(self, directory):
+        """
+        Write every window with samples to a file of its own in the directory, named after
+        the process and the time the window started. A window that is still open is
+        written again by the next dump, with what it has collected by then.
+
+        Args:
+            directory (str): Where to write the files. It is created if needed.
+
+        Returns:
+            list: The paths of the files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for window in self.windows():
+            started = time.strftime("%Y%m%d-%H%M%S", time.localtime(window.start))
+            path = os.path.join(directory, f"profile-{os.getpid()}-{started}{self.EXTENSION}")
+            self.write(window, path)
+            paths.append(path)
+        return paths
+
+    def report(self, limit=30):
+        """
+        Returns:
+            str: A summary of all kept windows together, as text.
+        """
+        windows = self.windows()
+        requests = sum(window.requests for window in windows)
+        if not windows:
+            return f"No requests have been sampled yet (sample rate {self.sample_rate:g}).\n"
+
+        data = None
+        for window in windows:
+            data = self.merge(data, window.data)
+        header = (f"{requests} sampled requests in {len(windows)} windows of {self.window_seconds:g} s, "
+                  f"since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(windows[0].start))}\n\n")
+        return header + self.summarize(data, limit)
+
+    def _window(self):
+        """Get the current window, closing it first if its time is up. The caller must hold '_lock'."""
+        now = time.time()
+        if now - self._current.start >= self.window_seconds:
+            self._current.end = now
+            self._closed.append(self._current)
+            self._current = ProfileWindow(now)
+        return self._current
+
+    @abc.abstractmethod
+    def run_sampled(self, function, args):
+        """Call function(*args) while profiling it. Returns the result and what was collected."""
+
+    @abc.abstractmethod
+    def merge(self, data, other):
+        """
+        Add what was collected for some requests to 'data', which is changed and returned.
+        If 'data' is None, a new object is returned and 'other' is left as it is.
+        """
+
+    @abc.abstractmethod
+    def write(self, window, path):
+        """Write what was collected during a window to a file, in the format of EXTENSION."""
+
+    @abc.abstractmethod
+    def summarize(self, data, limit):
+        """
+        Returns:
+            str: What was collected, as text, with at most 'limit' functions or stacks.
+        """
+
+
+class CProfileSampler(SamplingProfiler):
+    """
+    Profiles the sampled requests with cProfile, which records every call and its time.
+
+    The windows are written as pstats files, e.g. for 'python3 -m pstats' or snakeviz.
+    """
+
+    EXTENSION = ".pstats"
+
+    # From Python 3.12 only one cProfile profiler can be enabled at a time in the whole interpreter
+    exclusive = True
+
+    def run_sampled(self, function, args):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            result = function(*args)
+        finally:
+            profile.disable()
+        return result, profile
+
+    def merge(self, data, other):
+        if data is None:
+            data = pstats.Stats(stream=io.StringIO())
+        data.add(other)
+        return data
+
+    def write(self, window, path):
+        window.data.dump_stats(path)
+
+    def summarize(self, data, limit):
+        stream = io.StringIO()
+        data.stream = stream
+        data.sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+
+class StackSampler(SamplingProfiler):
+    """
+    Samples the call stack of the threads that handle sampled requests, every 'interval'
+    seconds, from a background thread. Unlike cProfile it does not slow down the calls
+    of the request, which makes it cheap enough for a larger sample rate.
+
+    The windows are written as collapsed stacks, one 'frame;frame;frame count' line per
+    stack, which flame graph tools (e.g. flamegraph.pl or speedscope) read.
+    """
+
+    EXTENSION = ".folded"
+
+    def __init__(self, sample_rate=0.01, window_seconds=60, windows=10, interval=0.005):
+        """
+        Args:
+            interval (float): The seconds between two samples of the stacks.
+            (The other arguments are those of SamplingProfiler.)
+        """
+        super().__init__(sample_rate, window_seconds, windows)
+        self.interval = interval
+        self._threads = {}      # Thread ID -> Counter of the stacks sampled during its request
+        self._has_threads = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="stack-sampler", daemon=True)
+        self._sampler.start()
+
+    def run_sampled(self, function, args):
+        stacks = collections.Counter()
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] = stacks
+            self._has_threads.set()
+        try:
+            result = function(*args)
+        finally:
+            with self._lock:
+                del self._threads[thread_id]
+                if not self._threads:
+                    self._has_threads.clear()
+        return result, stacks
+
+    def merge(self, data, other):
+        if data is None:
+            data = collections.Counter()
+        data.update(other)
+        return data
+
+    def write(self, window, path):
+        with open(path, "w") as folded_file:
+            for stack, count in window.data.items():
+                folded_file.write(f"{stack} {count}\n")
+
+    def summarize(self, data, limit):
+        total = sum(data.values())
+        # The frame at the end of a stack is the one that was running when the sample was taken
+        running = collections.Counter()
+        for stack, count in data.items():
+            running[stack.rpartition(";")[2]] += count
+
+        lines = [f"{total} samples, every {self.interval * 1000:g} ms", "", "Running (self):"]
+        lines += [f"  {count:>7} {count / total:>6.1%}  {frame}" for frame, count in running.most_common(limit)]
+        lines += ["", "Stacks:"]
+        lines += [f"  {count:>7} {count / total:>6.1%}  {stack}" for stack, count in data.most_common(limit)]
+        return "\n".join(lines) + "\n"
+
+    def _sample_loop(self):
+        while True:
+            self._has_threads.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def collapse_stack(frame):
+    """
+    Returns:
+        str: The stack of the frame as 'file:function' names, outermost first, separated by ';'.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# The profilers that can be chosen with --profile-mode
+PROFILERS = {"cprofile": CProfileSampler, "stacks": StackSampler}
@@ -0,0 +1,361 @@
+import string
+
+
+class ParseError(Exception):
+    """
+    Raised when a request is malformed or exceeds a limit of the parser.
+
+    Attributes:
+        status (int): The HTTP error code to answer with (e.g., 400, 413, 431).
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Headers(dict):
+    """
+    The headers of a request. Names are stored in lowercase, and can be looked up in any case.
+    """
+
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name.lower(), value)
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+class Request:
+    """
+    A complete request, as returned by RequestParser.
+
+    Attributes:
+        method (str): The method, as it was sent (e.g., 'GET').
+        uri (str): The request target, as it was sent (e.g., '/message?limit=10').
+        version (str): The HTTP version in uppercase, 'HTTP/1.0' if it was left out.
+        headers (Headers): The headers.
+        body (bytes): The body, with the chunked transfer encoding removed.
+    """
+
+    def __init__(self, method, uri, version, headers, body):
+        self.method = method
+        self.uri = uri
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+
+class RequestParser:
+    """
+    An incremental HTTP/1.x request parser.
+
+    Bytes are given to feed() as they arrive from the connection, in pieces of any size,
+    and next_request() returns each request once all of it has arrived. Pipelined requests
+    are returned one at a time, in order. The bytes are kept in one bytearray. The end of
+    the request line and headers is found with a single search, which continues where the
+    last one stopped when the headers arrive in pieces, and the headers are then split up
+    and decoded in one go instead of line by line.
+
+    Both a Content-Length body and a chunked body (Transfer-Encoding: chunked) are read.
+    Limits on the length of a line, the size and number of headers and the size of a body
+    make sure that a client cannot make the server buffer an unbounded amount of data. A
+    request that breaks a limit or cannot be parsed raises ParseError, after which the
+    connection should be closed, since it is no longer known where the next request starts.
+    """
+
+    # The states of the parser
+    HEAD = 0
+    BODY = 1
+    CHUNK_SIZE = 2
+    CHUNK_DATA = 3
+    CHUNK_END = 4
+    TRAILERS = 5
+
+    def __init__(self, max_line_length=8192, max_header_count=100, max_header_size=65536,
+                 max_body_size=10 * 1024 * 1024):
+        """
+        Args:
+            max_line_length (int): The longest request line, header line or chunk size line, in bytes.
+            max_header_count (int): The most header (and trailer) lines in one request.
+            max_header_size (int): The most bytes of request line and headers together.
+            max_body_size (int): The largest body, in bytes.
+        """
+        self.max_line_length = max_line_length
+        self.max_header_count = max_header_count
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self._buffer = bytearray()
+        self._position = 0          # Where the unparsed bytes start in the buffer
+        self._scanned = 0           # How far the buffer has been searched for the end of the headers or line
+        self._state = self.HEAD
+        self._request = None
+        self._header_count = 0
+        self._body_length = 0       # Bytes of a Content-Length body, or of the current chunk
+        self._body = bytearray()
+
+    def feed(self, data):
+        """
+        Add bytes that were received from the connection.
+
+        Args:
+            data (bytes): The received bytes.
+        """
+        if self._position:
+            # Drop the bytes that have been parsed, so the buffer does not grow with the connection
+            del self._buffer[:self._position]
+            self._scanned = max(self._scanned - self._position, 0)
+            self._position = 0
+        self._buffer += data
+
+    def has_partial_request(self):
+        """
+        Returns:
+            bool: True if part of a request has been received, but not all of it.
+        """
+        return self._state != self.HEAD or len(self._buffer) > self._position
+
+    def next_request(self):
+        """
+        Parse the next request from the bytes received so far.
+
+        Returns:
+            Request: The next complete request, or None if more bytes are needed.
+
+        Raises:
+            ParseError: If the request is malformed or breaks a limit.
+        """
+        while True:
+            state = self._state
+            if state == self.HEAD:
+                if not self._parse_head():
+                    return None
+                if self._state == self.HEAD:
+                    # The request has no body
+                    return self._finish()
+
+            elif state == self.BODY:
+                if not self._read_body_bytes():
+                    return None
+                return self._finish()
+
+            elif state == self.CHUNK_SIZE:
+                line = self._read_line()
+                if line is None:
+                    return None
+                self._parse_chunk_size(line)
+
+            elif state == self.CHUNK_DATA:
+                if not self._read_body_bytes():
+                    return None
+                self._state = self.CHUNK_END
+
+            elif state == self.CHUNK_END:
+                # The chunk data is followed by a line ending
+                buffer = self._buffer
+                if buffer.startswith(b"\r\n", self._position):
+                    self._position += 2
+                elif buffer.startswith(b"\n", self._position):
+                    self._position += 1
+                elif len(buffer) - self._position < 2:
+                    return None
+                else:
+                    raise ParseError(400, "chunk data is longer than its size")
+                self._state = self.CHUNK_SIZE
+
+            else:
+                line = self._read_line()
+                if line is None:
+                    return None
+                if not line:
+                    return self._finish()
+                # Trailer fields are counted, but not used
+                self._header_count += 1
+                if self._header_count > self.max_header_count:
+                    raise ParseError(431, "too many header fields")
+
+    def _parse_head(self):
+        """
+        Parse the request line and headers, once all of them have arrived.
+
+        Returns:
+            bool: True if they were parsed, False if more bytes are needed.
+        """
+        buffer = self._buffer
+        position = self._position
+        size = len(buffer)
+
+        # Empty lines before a request are ignored
+        while position < size and buffer[position] in (10, 13):
+            if buffer[position] == 10:
+                position += 1
+            elif position + 1 == size:
+                break   # A lone '\r', its '\n' has not arrived yet
+            elif buffer[position + 1] == 10:
+                position += 2
+            else:
+                raise ParseError(400, "malformed request line")
+        self._position = position
+
+        # The headers end with an empty line. The search only covers as many bytes as the
+        # headers may take up, and continues where the last search stopped.
+        limit = position + self.max_header_size
+        search_from = max(self._scanned - 3, position)
+        end = buffer.find(b"\r\n\r\n", search_from, limit)
+        # Clients may also end lines with a bare '\n'. Only the first empty line counts,
+        # since a later one may belong to the next pipelined request.
+        bare_end = buffer.find(b"\n\n", search_from, limit if end == -1 else end)
+        if bare_end != -1:
+            next_position = bare_end + 2
+            end = bare_end - 1 if buffer[bare_end - 1] == 13 else bare_end
+        elif end != -1:
+            next_position = end + 4
+        else:
+            return self._wait_for_head()
+
+        lines = buffer[position:end].decode("utf-8", errors="replace").split("\n")
+        self._position = self._scanned = next_position
+
+        if len(lines) > self.max_header_count + 1:
+            raise ParseError(431, "too many header fields")
+        if len(lines[0]) > self.max_line_length:
+            raise ParseError(414, "request line too long")
+        if end - position > self.max_line_length and max(map(len, lines)) > self.max_line_length:
+            raise ParseError(431, "header line too long")
+
+        parts = lines[0].split()
+        if len(parts) == 3:
+            version = parts[2].upper()
+        elif len(parts) == 2:
+            version = "HTTP/1.0"
+        else:
+            raise ParseError(400, "malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            name, colon, value = line.partition(":")
+            if not colon or not name or " " in name or "\t" in name:
+                # Whitespace in or after a name, or a folded line, could make a proxy read the header differently
+                raise ParseError(400, "malformed header line")
+            name = name.lower()
+            if name in headers:
+                # Repeated headers are combined into one comma-separated list
+                headers[name] += ", " + value.strip()
+            else:
+                headers[name] = value.strip()
+
+        self._request = Request(parts[0], parts[1], version, Headers(headers), b"")
+        self._header_count = len(lines) - 1
+        if "content-length" in headers or "transfer-encoding" in headers:
+            self._start_body(headers)
+        return True
+
+    def _wait_for_head(self):
+        """Check the limits while the end of the headers has not arrived yet."""
+        buffer = self._buffer
+        self._scanned = len(buffer)
+        received = len(buffer) - self._position
+        if received >= self.max_header_size:
+            raise ParseError(431, "headers too large")
+        if received > self.max_line_length and buffer.find(b"\n", self._position, self._position + self.max_line_length + 1) == -1:
+            raise ParseError(414, "request line too long")
+        return False
+
+    def _read_line(self):
+        """
+        Take the next line from the buffer, without its line ending.
+
+        Returns:
+            bytes: The line, or None if the whole line has not arrived yet.
+        """
+        end = self._buffer.find(b"\n", max(self._scanned, self._position))
+        if end == -1:
+            self._scanned = len(self._buffer)
+            if len(self._buffer) - self._position > self.max_line_length:
+                raise ParseError(400, "line too long")
+            return None
+        if end - self._position > self.max_line_length:
+            raise ParseError(400, "line too long")
+
+        line = bytes(self._buffer[self._position:end])
+        self._position = self._scanned = end + 1
+        return line[:-1] if line.endswith(b"\r") else line
+
+    def _start_body(self, headers):
+        """
+        Find out how the body of the request is framed.
+
+        Args:
+            headers (dict): The headers of the request, with lowercase names.
+        """
+        transfer_encoding = headers.get("transfer-encoding")
+
+        if transfer_encoding is not None:
+            if transfer_encoding.split(",")[-1].strip().lower() != "chunked":
+                raise ParseError(400, "unsupported transfer encoding")
+            # The length of a chunked body is given by the chunks, so a Content-Length header is ignored
+            self._request.headers.pop("content-length", None)
+            self._state = self.CHUNK_SIZE
+            return
+
+        content_length = headers.get("content-length")
+        if content_length is None:
+            return
+
+        if "," in content_length:
+            # Repeated Content-Length headers are only accepted if they agree
+            values = {value.strip() for value in content_length.split(",")}
+            content_length = values.pop() if len(values) == 1 else ""
+        # int() would also accept signs, underscores and non-ASCII digits
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise ParseError(400, "invalid Content-Length")
+        body_length = int(content_length)
+        if body_length > self.max_body_size:
+            raise ParseError(413, "body too large")
+
+        if len(self._buffer) - self._position >= body_length:
+            # The whole body has arrived already, as it usually has
+            self._request.body = bytes(self._buffer[self._position:self._position + body_length])
+            self._position += body_length
+        else:
+            self._body_length = body_length
+            self._state = self.BODY
+
+    def _parse_chunk_size(self, line):
+        # Chunk extensions (after ';') are ignored
+        size = line.decode("utf-8", errors="replace").split(";", 1)[0].strip()
+        # int() would also accept signs, underscores, '0x' and non-ASCII digits
+        if not size or size.strip(string.hexdigits):
+            raise ParseError(400, "invalid chunk size")
+        self._body_length = int(size, 16)
+        if len(self._body) + self._body_length > self.max_body_size:
+            raise ParseError(413, "body too large")
+        self._state = self.CHUNK_DATA if self._body_length else self.TRAILERS
+
+    def _read_body_bytes(self):
+        """
+        Move up to '_body_length' bytes from the buffer to the body.
+
+        Returns:
+            bool: True if all of them have arrived.
+        """
+        available = min(len(self._buffer) - self._position, self._body_length)
+        self._body += self._buffer[self._position:self._position + available]
+        self._position += available
+        self._body_length -= available
+        return self._body_length == 0
+
+    def _finish(self):
+        request = self._request
+        if self._body:
+            request.body = bytes(self._body)
+            self._body = bytearray()
+        self._state = self.HEAD
+        self._request = None
+        return request
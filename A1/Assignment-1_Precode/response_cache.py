@@ -0,0 +1,81 @@
+import hashlib
+import json
+
+from HTTP_handler import HTTPHandler
+
+
+class CachedResponse:
+    """
+    An encoded response body together with its length and ETag.
+
+    Compressed variants of the body are made the first time a client asks for them,
+    and kept for as long as the response is.
+
+    Attributes:
+        body (bytes): The encoded body.
+        content_length (int): The length of the body.
+        etag (str): The ETag of the body, including its quotes.
+        compressible (bool): Whether the body is large enough to be compressed.
+    """
+
+    def __init__(self, body, content_type="application/json"):
+        self.body = body
+        self.content_length = len(body)
+        # The ETag is derived from the content, so it is the same across restarts and worker processes
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.compressible = HTTPHandler.is_compressible(content_type, len(body))
+        self._variants = {None: (body, self.etag)}
+
+    def variant(self, encoding):
+        """
+        Get the body in a content encoding.
+
+        Args:
+            encoding (str): An encoding from HTTPHandler.negotiate_encoding(), or None.
+
+        Returns:
+            tuple: The body in that encoding and its ETag.
+        """
+        variant = self._variants.get(encoding)
+        if variant is None:
+            # Two requests may compress it at the same time, which only costs the time of one of them
+            variant = (HTTPHandler.compress(self.body, encoding), HTTPHandler.encoded_etag(self.etag, encoding))
+            self._variants[encoding] = variant
+        return variant
+
+
+class MessagesResponseCache:
+    """
+    Caches the JSON body of GET /message until the messages change.
+
+    Encoding every message on every GET is wasted work when nothing has changed. The
+    cached body is kept for as long as the 'version' of the store stays the same, so
+    it is dropped by the first POST, PUT or DELETE that changes the store.
+    """
+
+    def __init__(self, store, indent=4):
+        """
+        Args:
+            store (MessageStore): The messages to encode.
+            indent (int): The indentation of the JSON, as for json.dumps().
+        """
+        self.store = store
+        self.indent = indent
+        self._version = None
+        self._response = None
+
+    def get(self):
+        """
+        Get the encoded messages, encoding them only if they have changed.
+        The caller must hold 'messages_lock'.
+
+        Returns:
+            CachedResponse: The encoded messages, or None if there are no messages.
+        """
+        if self._version != self.store.version:
+            if len(self.store):
+                self._response = CachedResponse(json.dumps(self.store.to_list(), indent=self.indent).encode())
+            else:
+                self._response = None
+            self._version = self.store.version
+        return self._response
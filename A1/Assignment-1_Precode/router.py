@@ -0,0 +1,131 @@
+class _Node:
+    """A node of the prefix trie: the routes that end here, and the edges to longer prefixes."""
+
+    __slots__ = ("routes", "edges")
+
+    def __init__(self):
+        self.routes = {}        # Method -> handler name
+        self.edges = {}         # First character of an edge label -> (label, child node)
+
+
+class Router:
+    """
+    Maps a request method and URI to the name of the handler method that answers it.
+
+    Exact routes are looked up in a dictionary. Prefix routes are kept in a compressed
+    trie, whose edges are labelled with whole pieces of a prefix instead of single
+    characters, and the longest prefix that matches the URI wins, so '/message/' is chosen
+    over '/message' for '/message/3'.
+
+    Most requests are for an exact route, or for a path that is itself a prefix route
+    (e.g. PUT /message), which are kept in one table per method with the result of the
+    match already built, so they cost a dictionary lookup for the method and one for the
+    URI. A prefix route with a query string after it (e.g. GET /message?limit=10) costs one
+    more lookup, for the path, and only the other URIs walk the trie, one step per prefix
+    on the way to the longest match.
+    """
+
+    def __init__(self):
+        self._exact = {}        # Method -> {URI: handler name}, the exact routes
+        self._prefixes = {}     # Method -> {prefix: handler name}, the prefix routes
+        self._table = {}        # Method -> {URI: (handler name, '')}, the exact routes and the prefixes
+        self._root = _Node()
+
+    def add_exact(self, method, uri, handler):
+        """
+        Route requests for exactly this URI.
+
+        Args:
+            method (str): The request method (e.g., 'GET').
+            uri (str): The URI.
+            handler (str): The name of the handler method.
+        """
+        self._exact.setdefault(method, {})[uri] = handler
+        self._table.setdefault(method, {})[uri] = (handler, "")
+
+    def add_prefix(self, method, prefix, handler):
+        """
+        Route requests for every URI that starts with the prefix, unless a longer prefix or an exact route matches.
+
+        Args:
+            method (str): The request method (e.g., 'GET').
+            prefix (str): The start of the URI. It is a path, so it cannot contain '?'.
+            handler (str): The name of the handler method.
+        """
+        # With no '?' in a prefix, the longest prefix of '/message?limit=10' is '/message' if that is a prefix
+        if '?' in prefix:
+            raise ValueError(f"A prefix route cannot contain '?': {prefix}")
+
+        node = self._root
+        position = 0
+        while position < len(prefix):
+            edge = node.edges.get(prefix[position])
+            if edge is None:
+                child = _Node()
+                node.edges[prefix[position]] = (prefix[position:], child)
+                node = child
+                break
+
+            label, child = edge
+            common = 0
+            while common < len(label) and position + common < len(prefix) and label[common] == prefix[position + common]:
+                common += 1
+            if common < len(label):
+                # The prefix ends or branches off inside the edge, so the edge is split in two
+                middle = _Node()
+                middle.edges[label[common]] = (label[common:], child)
+                node.edges[prefix[position]] = (label[:common], middle)
+                child = middle
+            node = child
+            position += common
+
+        node.routes[method] = handler
+        self._prefixes.setdefault(method, {})[prefix] = handler
+        # An exact route for the same URI wins
+        if prefix not in self._exact.get(method, ()):
+            self._table.setdefault(method, {})[prefix] = (handler, "")
+
+    def match(self, method, uri):
+        """
+        Find the handler for a request.
+
+        Args:
+            method (str): The request method.
+            uri (str): The URI.
+
+        Returns:
+            tuple: The handler name and the rest of the URI after the matched prefix
+            ('' for an exact route), or None if no route matches.
+        """
+        table = self._table.get(method)
+        if table is None:
+            return None
+        route = table.get(uri)
+        if route is not None:
+            return route
+
+        # A prefix route with a query string after it
+        if '?' in uri:
+            path, _, query = uri.partition('?')
+            handler = self._prefixes.get(method, {}).get(path)
+            if handler is not None:
+                return handler, '?' + query
+
+        found = None
+        node = self._root
+        position = 0
+        while True:
+            handler = node.routes.get(method)
+            if handler is not None:
+                found = handler, position
+            if position == len(uri):
+                break
+            edge = node.edges.get(uri[position])
+            if edge is None or not uri.startswith(edge[0], position):
+                break
+            node = edge[1]
+            position += len(edge[0])
+
+        if found is None:
+            return None
+        return found[0], uri[found[1]:]
@@ -1,10 +1,28 @@
 #!/usr/bin/env python3
+import argparse
 import socketserver
 import os
 import json 
+import selectors
+import signal
+import threading
+import time
 import urllib.parse
+from admission import AdmissionControl
+from asset_cache import AssetCache
+from change_feed import ChangeFeed, FeedBusy
+from concurrency import MessageLock, SingleTCPServer, ThreadPoolTCPServer, serve_prefork
 from error_handling import *
-from HTTP_handler import HTTPHandler
+from json_stream import JSONArrayEncoder
+from file_cache import OpenFileCache
+from HTTP_handler import ChunkedWriter, HTTPHandler
+from message_log import MessageLog
+from message_store import MessageStore, to_message_id
+from metrics import MeteredWriter, Metrics
+from profiler import PROFILERS
+from request_parser import ParseError, RequestParser
+from router import Router
+from response_cache import MessagesResponseCache
 
 
 """
@@ -19,8 +37,105 @@ May 9th, 2019
 # Instans
 handle_error = Error()
 
-# Messages are stored in a list. The messages are represented as dictionaries, containing keys such as "ID" and "Text"
-messages = []
+# Messages are stored in a MessageStore, indexed by ID. The messages are represented as dictionaries, containing keys such as "ID" and "Text"
+messages = MessageStore()
+
+# Every handler that reads or changes 'messages' (or message.json) must hold this lock, since
+# connections may be handled concurrently. In the pre-fork mode it also locks out other processes.
+messages_lock = MessageLock()
+
+# How often the message log is synced to disk (see message_log.py). Changes are written to the log right
+# away, but a crash of the machine may lose the changes of the last LOG_FSYNC_INTERVAL seconds.
+LOG_FSYNC_INTERVAL = 0.05
+LOG_FSYNC_BATCH = 64
+
+# The messages are persisted as a snapshot (message.json) and a write-ahead log of the changes since then
+message_log = MessageLog(messages, messages_lock, "message.json", "message.log",
+                         fsync_interval=LOG_FSYNC_INTERVAL, fsync_batch=LOG_FSYNC_BATCH)
+
+# Query parameters that GET /message answers from the indexes of the store, see query_messages()
+MESSAGE_QUERY_PARAMETERS = ("limit", "after_id", "prefix", "contains")
+
+# GET /message?stream=1 sends the messages in pages of this many, so the memory it needs does not
+# depend on how many messages there are, and 'messages_lock' is only held while a page is copied
+MESSAGE_STREAM_PAGE_SIZE = 256
+MESSAGE_STREAM_MAX_INDENT = 16
+
+# Clients follow the changes to the messages through GET /message/_feed instead of downloading
+# every message again. The last FEED_HISTORY changes are kept for clients that are behind, and at
+# most FEED_MAX_SUBSCRIBERS clients may wait at a time, since each of them holds a thread. The feed is
+# only turned on in the threaded mode and the asyncio engine (see ChangeFeed.enable()), and answers
+# 503 in the single and pre-fork modes, where a waiting client would hold up every other request.
+FEED_HISTORY = 1024
+FEED_MAX_SUBSCRIBERS = 8
+change_feed = ChangeFeed(history_size=FEED_HISTORY, max_subscribers=FEED_MAX_SUBSCRIBERS)
+
+# How long a long-poll waits by default and at most, how often an event stream sends a comment to
+# find clients that have gone, and how long an event stream runs before the client has to reconnect
+FEED_POLL_TIMEOUT = 25
+FEED_MAX_POLL_TIMEOUT = 60
+FEED_HEARTBEAT_INTERVAL = 15
+FEED_STREAM_DURATION = 300
+FEED_RETRY_MS = 3000
+
+# The encoded body of GET /message, reused until the messages change
+messages_cache = MessagesResponseCache(messages, indent=4)
+
+# Static files are kept open between requests and sent straight from the file to the socket, see send_file()
+open_files = OpenFileCache(max_files=64)
+
+# The pages of the site are small, so they are kept in memory with their responses already built.
+# An edited page is noticed within ASSET_REVALIDATE_INTERVAL seconds.
+ASSET_REVALIDATE_INTERVAL = 1.0
+assets = AssetCache(max_bytes=4 * 1024 * 1024, revalidate_interval=ASSET_REVALIDATE_INTERVAL)
+
+# The size of the pieces a file is copied in when os.sendfile() cannot be used
+FILE_CHUNK_SIZE = 64 * 1024
+
+# A request must arrive in full within REQUEST_READ_TIMEOUT seconds of its first byte, and every write of
+# a response must finish within RESPONSE_WRITE_TIMEOUT seconds, so a client that sends or reads very slowly
+# cannot hold on to a thread (an idle keep-alive connection is closed after KEEP_ALIVE_TIMEOUT seconds).
+# Connections are only kept alive when the server serves others at the same time, see should_keep_alive().
+REQUEST_READ_TIMEOUT = 10
+RESPONSE_WRITE_TIMEOUT = 10
+
+# Connections over these limits are turned away right away with 503 (too many in total) or 429 (too many
+# from one address, or more requests per second than RATE_LIMIT). A limit of 0 is off. See admission.py.
+MAX_CONNECTIONS = 256
+MAX_CONNECTIONS_PER_IP = 0
+RATE_LIMIT = 0
+RATE_BURST = None
+admission = AdmissionControl(MAX_CONNECTIONS, MAX_CONNECTIONS_PER_IP, RATE_LIMIT, RATE_BURST)
+
+# Request counters and latency histograms for GET /metrics. Recording is turned on with --metrics,
+# and costs next to nothing while it is off.
+metrics = Metrics(enabled=False)
+
+# Samples requests with a profiler when it is turned on with --profile-rate (see start_profiler()).
+# GET /_profile from this machine shows what the samples have found, and GET /_profile?dump=1
+# or the signal SIGUSR1 writes them to PROFILE_DIRECTORY.
+profiler = None
+PROFILE_DIRECTORY = "profiles"
+
+# Which handler method of MyTCPHandler answers which request. URIs are matched in lowercase,
+# and a prefix route also matches every URI that starts with it (e.g. /message?limit=10).
+router = Router()
+for page in ("/", "/index.html", "/favicon.ico"):
+    router.add_exact("GET", page, "handle_page")
+router.add_exact("GET", "/test.txt", "handle_test_file")
+router.add_exact("GET", "/metrics", "handle_metrics")
+router.add_prefix("GET", "/_profile", "handle_profile")
+router.add_prefix("GET", "/message/", "handle_message")
+router.add_prefix("GET", "/message/_feed", "handle_message_feed")
+router.add_prefix("GET", "/message", "handle_messages")
+router.add_exact("POST", "/test.txt", "handle_post_test_file")
+router.add_exact("POST", "/message/_bulk", "handle_bulk_messages")
+router.add_prefix("POST", "/message", "handle_post_message")
+router.add_prefix("PUT", "/message", "handle_put_message")
+router.add_prefix("DELETE", "/message", "handle_delete_message")
+
+# The error for a URI without a route, by method. Methods without any routes get 405.
+ROUTE_NOT_FOUND = {"GET": 404, "POST": 403, "PUT": 404, "DELETE": 404}
 
 
 class MyTCPHandler(socketserver.StreamRequestHandler):
@@ -28,7 +143,7 @@ class MyTCPHandler(socketserver.StreamRequestHandler):
     This class is responsible for handling a request. The whole class is
     handed over as a parameter to the server instance so that it is capable
     of processing request. The server will use the handle-method to do this.
-    It is instantiated once for each request!
+    It is instantiated once for each connection, which may carry several requests!
     Since it inherits from the StreamRequestHandler class, it has two very
     usefull attributes you can use:
 
@@ -48,91 +163,371 @@ class MyTCPHandler(socketserver.StreamRequestHandler):
     finish() - Does nothing by default, but is called after handle() to do any
     necessary clean up after a request is handled.
     """        
+    # StreamRequestHandler.setup() applies this as the socket timeout. It doubles as the
+    # idle timeout of a kept-alive connection that is waiting for its next request.
+    timeout = HTTPHandler.KEEP_ALIVE_TIMEOUT
+
+    # Whether wfile writes to the socket, so that the time spent writing is the write phase of the metrics
+    writes_to_socket = True
+
+    def setup(self):
+        super().setup()
+        if metrics.enabled:
+            self.wfile = MeteredWriter(self.wfile, metrics)
+
     def handle(self):
         """
         This method is responsible for handling an http-request. You can, and should(!),
         make additional methods to organize the flow with which a request is handled by
         this method. But it all starts here!
+
+        The connection is kept alive, so requests are served one after another until the
+        client asks to close, goes idle for too long or reaches the per-connection cap.
+        A server that handles one connection at a time closes it after every response.
+        Pipelined requests are read from the same stream and therefore answered in order.
         """
+        self.requests_handled = 0
+        self.keep_alive = True
+        self.parser = RequestParser()
+
+        while self.keep_alive:
+            try:
+                request = self.read_request()
+            except ParseError as error:
+                # We cannot trust where the next request starts, so the connection is closed
+                self.keep_alive = False
+                self.send_error(error.status)
+                if metrics.enabled:
+                    metrics.count_response("parse_error", error.status)
+                break
+            except TimeoutError:
+                # The client went idle, or is sending its request too slowly
+                if self.parser.has_partial_request():
+                    self.send_request_timeout()
+                break
+            except ConnectionError:
+                # The client disappeared
+                break
+            if request is None:
+                # The client closed the connection
+                break
 
-        # Request, parse, and process the requested link 
-        request_line = self.rfile.readline().decode('utf-8').strip()    # Using utf-8 encoding in decode() ensures that bytes are correctly decoded. 
-        requested_part = request_line.split()
+            try:
+                self.connection.settimeout(RESPONSE_WRITE_TIMEOUT)
+                self.handle_one_request(request)
+            except (TimeoutError, ConnectionError):
+                # The client stopped reading the response, or disappeared, so the connection is closed
+                break
+
+    def read_request(self):
+        """
+        Read the next request from the connection. Whatever has been received is given to
+        the request parser, until it has a complete request.
+
+        The connection waits up to 'timeout' seconds for a request to start, and then up
+        to REQUEST_READ_TIMEOUT seconds for all of it.
+
+        Returns:
+            Request: The request, or None if the client closed the connection.
+
+        Raises:
+            ParseError: If the request is malformed or too large.
+            TimeoutError: If the request does not arrive in time.
+        """
+        self.connection.settimeout(self.timeout)
+        deadline = None
+        parse_time = 0.0
+        while True:
+            started = time.perf_counter()
+            request = self.parser.next_request()
+            parse_time += time.perf_counter() - started
+            if request is not None:
+                if metrics.enabled:
+                    metrics.observe_phase("parse", parse_time)
+                return request
+
+            if deadline is None and self.parser.has_partial_request():
+                deadline = time.monotonic() + REQUEST_READ_TIMEOUT
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("the request did not arrive in time")
+                self.connection.settimeout(min(remaining, self.timeout))
+
+            # read1() returns what has arrived, without waiting for a full buffer
+            data = self.rfile.read1(65536)
+            if not data:
+                return None
+            if metrics.enabled:
+                metrics.add_bytes_in(len(data))
+            self.parser.feed(data)
+
+    def handle_one_request(self, request):
+        """
+        Answer a single request on the connection, with the profiler if it is turned on.
 
-        # Determine whether the request is legitimate and force the HTTP method to be uppercase and the URI to be lowercase. 
-        if len(requested_part) >= 2:
-            HTTP_method = requested_part[0].upper()
-            URI = requested_part[1].lower()
+        Args:
+            request (Request): The request, as parsed by the RequestParser.
+        """
+        if profiler is not None:
+            profiler.run(self.answer_request, request)
         else:
-            self.wfile.write(handle_error.error_handling(400).encode())
-            return
+            self.answer_request(request)
 
-        if URI.endswith('.py') or URI.endswith("md"):
-            self.wfile.write(handle_error.error_handling(403).encode())
-            return
+    def answer_request(self, request):
+        """
+        Answer a single request: route it, and run its handler.
 
-        # Determine if the HTTP method is GET, POST, PUT, or DELETE and handle it accordingly.
-        if HTTP_method == "GET":
-            self.handle_GET(URI)
-        elif HTTP_method == 'POST':
-            self.handle_POST(URI)
-        elif HTTP_method == 'PUT':
-            self.handle_PUT(URI)
-        elif HTTP_method == 'DELETE':
-            self.handle_DELETE(URI)
+        Args:
+            request (Request): The request, as parsed by the RequestParser.
+        """
+        metered = metrics.enabled
+        if metered:
+            started = time.perf_counter()
+            metrics.request_started()
+            self.wfile.start_response()
+
+        # Force the HTTP method to be uppercase and the URI to be lowercase. 
+        HTTP_method = request.method.upper()
+        URI = request.uri.lower()
+
+        self.request_version = request.version
+        self.headers = request.headers
+        self.body = request.body
+        self.requests_handled += 1
+        self.keep_alive = self.should_keep_alive(request.version)
+
+        # Look up the handler for the method and URI in the routing table. Python and Markdown files are never served.
+        if admission.rate and not admission.allow_request(self.client_address[0]):
+            route, error_code = None, 429
+        elif URI.endswith('.py') or URI.endswith("md"):
+            route, error_code = None, 403
         else:
-            self.wfile.write(handle_error.error_handling(405).encode())     # Method Not Allowed
-    
-    def handle_GET(self, URI):
-        if URI == "/" or URI == "/index.html" or URI == "/favicon.ico" or URI == "/test.txt":
-                # If the URI is "/" set it to be "/index.html"
-            if  URI == "/":
-                URI = "/index.html"
-
-            # Handle the GET request for the correct uri
-            self.get_request(self.get_filname(URI), 'rb')
-
-        elif URI.startswith('/message'):
-            # Handle GET request for messages
-            URI = "/message.json"
-            self.get_json(self.get_filname(URI))
-        
+            route = router.match(HTTP_method, URI)
+            error_code = ROUTE_NOT_FOUND.get(HTTP_method, 405)     # 405 Method Not Allowed
+
+        if metered:
+            self.run_metered_handler(route, URI, error_code, started)
+        elif route is not None:
+            getattr(self, route[0])(URI, route[1])
         else:
-            self.wfile.write(handle_error.error_handling(404).encode())
+            self.send_error(error_code)
 
-    def handle_POST(self, URI):
-        if URI == "/test.txt":
-            self.post_request(self.get_filname(URI))
+    def run_metered_handler(self, route, URI, error_code, started):
+        """
+        Run the handler of a request, or send its error, and record the metrics of the request.
 
-        
-        elif URI.startswith('/message'):
-            URI = "/message.json"
-            # Handle POST request to create a new message
-            self.post_json(self.get_filname(URI)) 
+        Args:
+            route (tuple): The handler name and the rest of the URI, or None if there is no route.
+            URI (str): The URI.
+            error_code (int): The error to send if there is no route.
+            started (float): When handling the request started, from time.perf_counter().
+        """
+        routed = time.perf_counter()
+        metrics.observe_phase("route", routed - started)
+        try:
+            if route is not None:
+                getattr(self, route[0])(URI, route[1])
+            else:
+                self.send_error(error_code)
+        finally:
+            finished = time.perf_counter()
+            metrics.observe_phase("handler", finished - routed)
+            if self.writes_to_socket:
+                metrics.observe_phase("write", self.wfile.write_time)
+            route_name = route[0].removeprefix("handle_") if route is not None else "none"
+            metrics.request_finished(route_name, self.wfile.status, finished - started)
+
+    def send_request_timeout(self):
+        """Answer a request that did not arrive in time with 408, if the socket takes it without waiting."""
+        try:
+            self.connection.settimeout(0)
+            self.connection.send(handle_error.error_handling(408, False))
+        except OSError:
+            pass
+        if metrics.enabled:
+            metrics.count_response("timeout", 408)
+
+    def should_keep_alive(self, version):
+        """
+        Decide whether the connection stays open after the current request.
+
+        Args:
+            version (str): The HTTP version from the request line (e.g., 'HTTP/1.1').
+
+        Returns:
+            bool: True if the connection should be kept alive.
+        """
+        # While a connection is open, a server without concurrency (the single mode, or a
+        # pre-fork worker) serves nobody else, so one idle client would hold up all others
+        if not self.serves_concurrently:
+            return False
+        if self.requests_handled >= HTTPHandler.MAX_KEEP_ALIVE_REQUESTS:
+            return False
+
+        connection = [token.strip().lower() for token in self.headers.get("connection", "").split(",")]
+
+        # HTTP/1.1 connections are persistent by default, HTTP/1.0 connections only on request
+        if version == "HTTP/1.1":
+            return "close" not in connection
+        return "keep-alive" in connection
+
+    @property
+    def serves_concurrently(self):
+        """Whether the server answers other connections while this one is open."""
+        return getattr(self.server, "concurrent_connections", False)
+
+    def send_error(self, error_code):
+        """
+        Write an error response for the given status code to the client.
+
+        Args:
+            error_code (int): The HTTP error code.
+        """
+        self.wfile.write(handle_error.error_handling(error_code, self.keep_alive))
+
+    def response_header(self, response, content_type, content_length, extra_headers=None):
+        """
+        Create a response header that matches the connection state of this request.
+
+        Args:
+            response (str): The HTTP response status (e.g., '200 OK', '404 Not Found').
+            content_type (str): The content type of the response, or None to leave it out.
+            content_length (int): The length of the response content, or None to leave it out.
+            extra_headers (dict): Further header names and values.
+
+        Returns:
+            bytes: The HTTP response header as bytes.
+        """
+        return HTTPHandler.create_response_header(response, content_type, content_length, self.keep_alive, extra_headers)
+    
+    def handle_page(self, URI, remainder):
+        """GET /, /index.html or /favicon.ico: one of the pages of the site."""
+        # If the URI is "/" set it to be "/index.html"
+        if URI == "/":
+            URI = "/index.html"
+
+        # Handle the GET request for the correct uri from the asset cache
+        self.get_asset(self.get_filname(URI))
+
+    def handle_test_file(self, URI, remainder):
+        """GET /test.txt: test.txt is changed by POST requests, so it is always read from the disk."""
+        self.get_request(self.get_filname(URI), 'rb')
+
+    def handle_metrics(self, URI, remainder):
+        """GET /metrics: the request metrics in the Prometheus text format, if they are turned on."""
+        if not metrics.enabled:
+            self.send_error(404)
+            return
+        self.send_content('200 OK', "text/plain; version=0.0.4; charset=utf-8", metrics.render())
 
+    def handle_profile(self, URI, remainder):
+        """GET /_profile: a summary of the profiled requests, or with ?dump=1 write them to PROFILE_DIRECTORY."""
+        if profiler is None or (remainder and not remainder.startswith('?')):
+            self.send_error(404)
+            return
+        # The profile shows the internals of the server, so it is only shown to this machine
+        if self.client_address[0] not in ("127.0.0.1", "::1"):
+            self.send_error(403)
+            return
+
+        if "dump" in urllib.parse.parse_qs(remainder[1:]):
+            response_content = json.dumps(profiler.dump(PROFILE_DIRECTORY), indent=4).encode()
+            self.send_content('200 OK', "application/json", response_content)
         else:
-            # Return a 403 Forbidden error for other POST requests
-            self.wfile.write(handle_error.error_handling(403).encode())
+            self.send_content('200 OK', "text/plain; charset=utf-8", profiler.report().encode())
 
-    def handle_PUT(self, URI):
-        if URI.startswith('/message'):
-            URI = "/message.json"
-            self.put_request(self.get_filname(URI))
+    def handle_message(self, URI, remainder):
+        """GET /message/<ID>: a single message, e.g. /message/3."""
+        self.get_message(remainder)
+
+    def handle_message_feed(self, URI, remainder):
+        """GET /message/_feed: the changes to the messages, e.g. /message/_feed?since=42."""
+        if remainder and not remainder.startswith('?'):
+            self.send_error(404)
+            return
+        self.get_changes(urllib.parse.parse_qs(remainder[1:]))
+
+    def handle_messages(self, URI, remainder):
+        """GET /message: all messages, or some of them, e.g. /message?limit=10&after_id=20 or /message?stream=1."""
+        path, _, query = URI.partition('?')
+        parameters = urllib.parse.parse_qs(query)
+
+        if "stream" in parameters:
+            self.stream_messages(parameters)
+        elif any(name in parameters for name in MESSAGE_QUERY_PARAMETERS):
+            self.query_messages(parameters)
         else:
-            self.wfile.write(handle_error.error_handling(404).encode())
+            self.get_json(self.get_filname("/message.json"))
+
+    def handle_post_test_file(self, URI, remainder):
+        """POST /test.txt: append a line to test.txt."""
+        self.post_request(self.get_filname(URI))
+
+    def handle_post_message(self, URI, remainder):
+        """POST /message: create a new message."""
+        self.post_json(self.get_filname("/message.json"))
+
+    def handle_bulk_messages(self, URI, remainder):
+        """POST /message/_bulk: create, update and delete many messages at once."""
+        self.bulk_request()
+
+    def handle_put_message(self, URI, remainder):
+        """PUT /message: update a message."""
+        self.put_request(self.get_filname("/message.json"))
+
+    def handle_delete_message(self, URI, remainder):
+        """DELETE /message: delete a message."""
+        self.delete_request(self.get_filname("/message.json"))
+
+    def get_asset(self, filename):
+        """
+        Handle a GET request for one of the pages of the site, from the asset cache.
+
+        Args:
+            filename (str): The name of the file to retrieve.
 
-    def handle_DELETE(self, URI):
-        if URI.startswith('/message'):
-            #  Handle DELETE request for deleting a message
-            URI = "/message.json"
-            self.delete_request(self.get_filname(URI))
+        Returns:
+            None
+        """
+        if "range" in self.headers:
+            # Parts of a file are sent from the disk
+            self.get_request(filename, 'rb')
+            return
+
+        asset = assets.get(filename)
+        if asset is None:
+            # The file does not exist or is too large to keep in memory
+            self.get_request(filename, 'rb')
+            return
+
+        # Text files are sent compressed to clients that accept it, from the copies compressed when the file was loaded
+        encoding = asset.negotiate(self.headers.get("accept-encoding"))
+        if self.is_not_modified(asset.etag_for(encoding), asset.mtime):
+            self.wfile.write(asset.not_modified_response(self.keep_alive, encoding))
         else:
-            # Return a 404 Not Found error
-            self.wfile.write(handle_error.error_handling(404).encode())
+            self.wfile.write(asset.response(self.keep_alive, encoding))
+
+    def is_not_modified(self, etag, mtime):
+        """
+        Check the conditional headers of the request against the current version of a resource.
+        If-None-Match is used when it is present, otherwise If-Modified-Since.
+
+        Args:
+            etag (str): The current ETag of the resource.
+            mtime (float): The modification time of the resource.
+
+        Returns:
+            bool: True if the client already has the current version (so 304 can be sent).
+        """
+        if "if-none-match" in self.headers:
+            return HTTPHandler.etag_matches(self.headers["if-none-match"], etag)
+        return HTTPHandler.not_modified_since(self.headers.get("if-modified-since"), mtime)
 
     def get_request(self, filename, mode):
         """
-        Handle a GET request for a specific file.
+        Handle a GET request for a specific file, or for parts of it if the request has a
+        Range header (e.g., a client resuming a download).
 
         Args:
             filename (str): The name of the file to retrieve.
@@ -141,24 +536,217 @@ class MyTCPHandler(socketserver.StreamRequestHandler):
         Returns:
             None
         """     
-
-        if not os.path.exists(filename):
-            self.wfile.write(handle_error.error_handling(404).encode())
+        # Look the file up in the cache of open files, which costs a single os.stat()
+        open_file = open_files.acquire(filename)
+        if open_file is None:
+            self.send_error(404)
             return
 
-        # Open the file and store its content for writing later 
-        with open(filename, mode) as f: 
-            content = f.read()
-        
-        # Find the content type and length 
-        content_type = HTTPHandler.find_content_type(filename)
-        content_lenght = len(content)
+        try:
+            # Find the content type and length 
+            content_type = HTTPHandler.find_content_type(filename)
+            content_lenght = open_file.size
+            last_modified = HTTPHandler.http_date(open_file.mtime)
+
+            if self.is_not_modified(None, open_file.mtime):
+                self.wfile.write(self.response_header('304 Not Modified', None, None, {"Last-Modified": last_modified}))
+                return
+
+            ranges = self.requested_ranges(open_file.size, last_modified)
+            if ranges is None:
+                # Write the response header, then send the content without reading it into memory
+                extra_headers = {"Accept-Ranges": "bytes", "Last-Modified": last_modified}
+                self.wfile.write(self.response_header('200 OK', content_type, content_lenght, extra_headers))
+                self.send_file(open_file.fd, 0, content_lenght)
+            elif not ranges:
+                # None of the ranges are inside the file
+                self.wfile.write(self.response_header('416 Range Not Satisfiable', None, 0,
+                                                      {"Content-Range": f"bytes */{open_file.size}"}))
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                extra_headers = {
+                    "Content-Range": f"bytes {start}-{end}/{open_file.size}",
+                    "Accept-Ranges": "bytes",
+                    "Last-Modified": last_modified,
+                }
+                self.wfile.write(self.response_header('206 Partial Content', content_type, end - start + 1, extra_headers))
+                self.send_file(open_file.fd, start, end - start + 1)
+            else:
+                self.send_ranges(open_file, ranges, content_type, last_modified)
+        finally:
+            open_files.release(open_file)
+
+    def requested_ranges(self, size, last_modified):
+        """
+        Find the byte ranges the request asks for.
+
+        Args:
+            size (int): The size of the file.
+            last_modified (str): The Last-Modified date of the file, to check If-Range against.
 
-        # Create the response header 
-        response_header = HTTPHandler.create_response_header('200 OK', content_type, content_lenght)
+        Returns:
+            list: (first byte, last byte) pairs, empty if none of them can be satisfied.
+            None if the whole file should be sent.
+        """
+        range_header = self.headers.get("range")
+        if range_header is None:
+            return None
+
+        # If-Range asks for the ranges only if the file has not changed, and for the whole file otherwise
+        if_range = self.headers.get("if-range")
+        if if_range is not None and if_range.strip() != last_modified:
+            return None
+
+        return HTTPHandler.parse_range(range_header, size)
+
+    def send_ranges(self, open_file, ranges, content_type, last_modified):
+        """
+        Send several parts of a file as a multipart/byteranges response.
+
+        Args:
+            open_file (OpenFile): The file.
+            ranges (list): (first byte, last byte) pairs.
+            content_type (str): The content type of the file, or None if it is not known.
+            last_modified (str): The Last-Modified date of the file.
+        """
+        boundary = os.urandom(12).hex()
+        part_headers = []
+        for start, end in ranges:
+            part_header = f'--{boundary}\r\n'
+            if content_type is not None:
+                part_header += f'Content-Type: {content_type}\r\n'
+            part_header += f'Content-Range: bytes {start}-{end}/{open_file.size}\r\n\r\n'
+            part_headers.append(part_header.encode())
+        closing_boundary = f'--{boundary}--\r\n'.encode()
+
+        # Every part is followed by a CRLF before the next boundary
+        content_length = sum(len(part_header) + (end - start + 1) + 2 for part_header, (start, end) in zip(part_headers, ranges))
+        content_length += len(closing_boundary)
+
+        extra_headers = {"Accept-Ranges": "bytes", "Last-Modified": last_modified}
+        self.wfile.write(self.response_header('206 Partial Content', f'multipart/byteranges; boundary={boundary}',
+                                              content_length, extra_headers))
+        for part_header, (start, end) in zip(part_headers, ranges):
+            self.wfile.write(part_header)
+            self.send_file(open_file.fd, start, end - start + 1)
+            self.wfile.write(b'\r\n')
+        self.wfile.write(closing_boundary)
+
+    def send_file(self, fd, offset, count):
+        """
+        Send part of a file to the client. The kernel copies the file straight to the socket
+        with os.sendfile() where it can, otherwise the file is copied in chunks of
+        FILE_CHUNK_SIZE bytes. Either way, memory use does not grow with the size of the file.
+
+        Args:
+            fd (int): The open file descriptor. Its file position is not used or changed.
+            offset (int): Where in the file to start.
+            count (int): The number of bytes to send.
+        """
+        # Anything written to wfile must reach the socket before the file does
+        self.wfile.flush()
+
+        sent = 0
+        if hasattr(os, "sendfile"):
+            sent = self.sendfile_to_socket(fd, offset, count)
+            if metrics.enabled:
+                metrics.add_bytes_out(sent)
+
+        # Fall back to chunked reads for whatever os.sendfile() did not send
+        while sent < count:
+            chunk = os.pread(fd, min(FILE_CHUNK_SIZE, count - sent), offset + sent)
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            sent += len(chunk)
 
-        # Write the response header and the content of the file
-        self.wfile.write(response_header + content)
+        if sent < count:
+            # The file shrank after the header was sent, so the response is cut short and the client must not wait for more
+            self.keep_alive = False
+
+    def send_content(self, response, content_type, content, extra_headers=None):
+        """
+        Write a response with the given content, compressed if it is large enough and the client accepts it.
+
+        Args:
+            response (str): The HTTP response status (e.g., '200 OK').
+            content_type (str): The content type of the response.
+            content (bytes): The content.
+            extra_headers (dict): Further header names and values.
+        """
+        if HTTPHandler.is_compressible(content_type, len(content)):
+            extra_headers = {**(extra_headers or {}), "Vary": "Accept-Encoding"}
+            encoding = HTTPHandler.negotiate_encoding(self.headers.get("accept-encoding"))
+            if encoding is not None:
+                content = HTTPHandler.compress(content, encoding)
+                extra_headers["Content-Encoding"] = encoding
+
+        self.wfile.write(self.response_header(response, content_type, len(content), extra_headers) + content)
+
+    def start_streamed_response(self, response, content_type, extra_headers=None):
+        """
+        Write the header of a response whose length is not known up front, e.g. because
+        the content is produced while it is sent.
+
+        HTTP/1.1 clients get the body with chunked transfer encoding, so the connection can
+        be kept alive. HTTP/1.0 clients do not understand chunks, so for them the end of the
+        body is marked by closing the connection.
+
+        Args:
+            response (str): The HTTP response status (e.g., '200 OK').
+            content_type (str): The content type of the response, or None to leave it out.
+            extra_headers (dict): Further header names and values.
+
+        Returns:
+            ChunkedWriter: Write the body with write() and finish it with close().
+        """
+        chunked = self.request_version == "HTTP/1.1"
+        if chunked:
+            extra_headers = {"Transfer-Encoding": "chunked", **(extra_headers or {})}
+        else:
+            self.keep_alive = False
+
+        self.wfile.write(self.response_header(response, content_type, None, extra_headers))
+        return ChunkedWriter(self.wfile, chunked)
+
+    def sendfile_to_socket(self, fd, offset, count):
+        """
+        Send part of a file with os.sendfile().
+
+        Returns:
+            int: The number of bytes sent. It is 0 if os.sendfile() does not support this
+            file or socket, and less than 'count' if the file ended early.
+        """
+        sock = self.connection
+        sent = 0
+        selector = None
+        try:
+            while sent < count:
+                try:
+                    n = os.sendfile(sock.fileno(), fd, offset + sent, count - sent)
+                except BlockingIOError:
+                    # The socket has a timeout and is therefore non-blocking, so wait until the client has read some data
+                    if selector is None:
+                        selector = selectors.DefaultSelector()
+                        selector.register(sock, selectors.EVENT_WRITE)
+                    if not selector.select(sock.gettimeout()):
+                        raise TimeoutError("timed out while sending a file")
+                    continue
+                except ConnectionError:
+                    raise
+                except OSError:
+                    # E.g., the file system or the socket type is not supported
+                    if sent == 0:
+                        return 0
+                    raise
+                if n == 0:
+                    # End of file
+                    break
+                sent += n
+        finally:
+            if selector is not None:
+                selector.close()
+        return sent
 
     def get_json(self, filename):
         """
@@ -170,25 +758,270 @@ class MyTCPHandler(socketserver.StreamRequestHandler):
         Returns:
             None
         """
-        if not os.path.exists(filename):
-            # Send a 404 Not Found response if the file does not exist
-            self.wfile.write(HTTPHandler.create_response_header('404 Not Found', "application/json", 0))
+        with messages_lock:
+            if not message_log.exists():
+                # Send a 404 Not Found response if the storage file does not exist
+                self.wfile.write(self.response_header('404 Not Found', "application/json", 0))
+                return
+
+            # The messages are only converted to JSON when they have changed since the last GET
+            cached = messages_cache.get()
+
+        # If there are no messages, send a custom error response
+        if cached is None:
+            self.send_error(204)
             return
 
-        # Convert the 'message' list to a JSON-formatted string
-        json_data = json.dumps(messages, indent=4)
+        # Compress the messages for clients that accept it. The compressed body is also kept until the messages change.
+        encoding = HTTPHandler.negotiate_encoding(self.headers.get("accept-encoding")) if cached.compressible else None
+        body, etag = cached.variant(encoding)
+        extra_headers = {"ETag": etag}
+        if cached.compressible:
+            extra_headers["Vary"] = "Accept-Encoding"
 
-        # Calculate the content length
-        content_length = len(json_data)
-
-        # If there are no messages or only empty brackets in the JSON data, send a custom error response
-        if content_length <= 2: 
-            self.wfile.write(handle_error.error_handling(204).encode())
+        # The client already has this version of the messages, so there is no need to send them again
+        if HTTPHandler.etag_matches(self.headers.get("if-none-match"), etag):
+            self.wfile.write(self.response_header('304 Not Modified', None, None, extra_headers))
             return
 
+        if encoding is not None:
+            extra_headers["Content-Encoding"] = encoding
+
         # Make a response header and send the response header and JSON data to the client.
-        response_header = HTTPHandler.create_response_header('200 OK', "application/json", content_length)
-        self.wfile.write(response_header + json_data.encode())
+        response_header = self.response_header('200 OK', "application/json", len(body), extra_headers)
+        self.wfile.write(response_header + body)
+
+    def get_message(self, message_id):
+        """
+        Handle a GET request for a single message.
+
+        Args:
+            message_id (str): The ID from the URI.
+
+        Returns:
+            None
+        """
+        try:
+            message_id = int(message_id)
+        except ValueError:
+            self.send_error(404)
+            return
+
+        with messages_lock:
+            message = messages.get(message_id)
+            response_content = json.dumps(message, indent=4) if message is not None else None
+
+        if response_content is None:
+            self.send_error(404)
+            return
+
+        self.send_content('200 OK', "application/json", response_content.encode())
+
+    def query_messages(self, parameters):
+        """
+        Handle a GET request for the messages that match the query parameters, in order of their IDs:
+
+            limit       the most messages to return
+            after_id    only messages with a larger ID, for paging through the messages
+            prefix      only messages whose text starts with this
+            contains    only messages whose text contains this
+
+        The lookups are served by the indexes of the message store. When a page is full,
+        a Link header points to the next page.
+
+        Args:
+            parameters (dict): The parsed query string, as returned by urllib.parse.parse_qs().
+
+        Returns:
+            None
+        """
+        try:
+            limit = int(parameters["limit"][0]) if "limit" in parameters else None
+            after_id = int(parameters["after_id"][0]) if "after_id" in parameters else None
+        except ValueError:
+            self.send_error(400)
+            return
+        if limit is not None and limit < 0:
+            self.send_error(400)
+            return
+
+        prefix = parameters.get("prefix", [None])[0]
+        contains = parameters.get("contains", [None])[0]
+
+        with messages_lock:
+            found = messages.query(after_id=after_id, limit=limit, prefix=prefix, contains=contains)
+            response_content = json.dumps(found, indent=4).encode()
+
+        extra_headers = None
+        if limit and len(found) == limit:
+            # There may be more messages, continue after the last one on this page
+            next_page = {name: values[0] for name, values in parameters.items() if name in MESSAGE_QUERY_PARAMETERS}
+            next_page["after_id"] = found[-1]["ID"]
+            extra_headers = {"Link": f'</message?{urllib.parse.urlencode(next_page)}>; rel="next"'}
+
+        self.send_content('200 OK', "application/json", response_content, extra_headers)
+
+    def stream_messages(self, parameters):
+        """
+        Handle a GET request for all messages that is sent while it is encoded, with
+        chunked transfer encoding (see start_streamed_response()):
+
+            stream      turns streaming on, e.g. /message?stream=1
+            indent      the indentation of the JSON, e.g. indent=4. Without it the JSON is compact.
+
+        The messages are sent in order of their IDs. They are copied and encoded one page
+        at a time, so the memory needed stays the same however many messages there are,
+        and other requests can change the messages between two pages. A message that is
+        changed while the response is being sent may therefore show up in either version,
+        but never twice, and a message is never left out unless it was deleted. Unlike
+        without streaming, an empty list is sent as [] instead of a 204 response.
+
+        Args:
+            parameters (dict): The parsed query string, as returned by urllib.parse.parse_qs().
+
+        Returns:
+            None
+        """
+        indent = None
+        if "indent" in parameters:
+            try:
+                indent = int(parameters["indent"][0])
+            except ValueError:
+                self.send_error(400)
+                return
+            if not 0 <= indent <= MESSAGE_STREAM_MAX_INDENT:
+                self.send_error(400)
+                return
+
+        with messages_lock:
+            if not message_log.exists():
+                self.wfile.write(self.response_header('404 Not Found', "application/json", 0))
+                return
+
+        encoder = JSONArrayEncoder(indent=indent, chunk_size=FILE_CHUNK_SIZE)
+        writer = self.start_streamed_response('200 OK', "application/json")
+        for chunk in encoder.iterencode(self.iterate_messages()):
+            writer.write(chunk)
+        writer.close()
+
+    def iterate_messages(self):
+        """
+        Yield copies of all messages in order of their IDs, taking 'messages_lock' for
+        one page of MESSAGE_STREAM_PAGE_SIZE messages at a time.
+
+        Yields:
+            dict: A copy of a message.
+        """
+        after_id = None
+        while True:
+            with messages_lock:
+                page = [dict(message) for message in messages.query(after_id=after_id, limit=MESSAGE_STREAM_PAGE_SIZE)]
+            yield from page
+            if len(page) < MESSAGE_STREAM_PAGE_SIZE:
+                return
+            after_id = page[-1]["ID"]
+
+    def get_changes(self, parameters):
+        """
+        Handle a GET request for the changes to the messages after a sequence number:
+
+            since       the sequence number of the last change the client has seen
+            timeout     how long to wait for a change, for a long-poll (at most FEED_MAX_POLL_TIMEOUT)
+
+        Without 'since' the client gets the changes from now on. Clients that accept
+        text/event-stream get the changes as Server-Sent Events (see stream_changes()),
+        which also take the cursor from the Last-Event-ID header of a reconnecting
+        EventSource. Other clients long-poll (see poll_changes()). If the feed is off, or
+        as many clients as it allows are following it, the answer is 503.
+
+        Args:
+            parameters (dict): The parsed query string, as returned by urllib.parse.parse_qs().
+
+        Returns:
+            None
+        """
+        since = parameters.get("since", [self.headers.get("last-event-id")])[0]
+        try:
+            since = int(since) if since is not None else None
+            timeout = float(parameters["timeout"][0]) if "timeout" in parameters else FEED_POLL_TIMEOUT
+        except ValueError:
+            self.send_error(400)
+            return
+        if not 0 <= timeout <= FEED_MAX_POLL_TIMEOUT:
+            self.send_error(400)
+            return
+
+        try:
+            with change_feed.subscription():
+                if since is None:
+                    since = change_feed.sequence
+                if "text/event-stream" in self.headers.get("accept", ""):
+                    self.stream_changes(since)
+                else:
+                    self.poll_changes(since, timeout)
+        except FeedBusy:
+            self.send_error(503)
+
+    def poll_changes(self, since, timeout):
+        """
+        Answer a long-poll: the changes after 'since' as soon as there is at least one, e.g.
+
+            {"events": [{"sequence": 43, "op": "create", "message": {"ID": 3, "Text": "Hi"}}],
+             "next": 43, "reset": false}
+
+        or no events once 'timeout' seconds have passed. The client asks again with
+        since=<next>. If the changes after 'since' are no longer kept, "reset" is true:
+        the client must then get all messages again and continue from "next".
+
+        Args:
+            since (int): The sequence number of the last change the client has seen.
+            timeout (float): The most seconds to wait.
+        """
+        events, reset = change_feed.wait(since, timeout)
+        if reset:
+            next_sequence = change_feed.sequence
+        elif events:
+            next_sequence = events[-1].sequence
+        else:
+            next_sequence = since
+
+        response_content = '{"events": [%s], "next": %d, "reset": %s}' % (
+            ", ".join(event.to_json() for event in events), next_sequence, "true" if reset else "false")
+        self.send_content('200 OK', "application/json", response_content.encode(), {"Cache-Control": "no-cache"})
+
+    def stream_changes(self, since):
+        """
+        Send the changes after 'since' as Server-Sent Events while they happen, e.g.
+
+            id: 43
+            event: create
+            data: {"ID": 3, "Text": "Hi"}
+
+        If the changes after the client's cursor are no longer kept, a 'reset' event tells
+        it to get all messages again. The stream ends after FEED_STREAM_DURATION seconds,
+        or when the server stops, and the EventSource then reconnects with Last-Event-ID.
+
+        Args:
+            since (int): The sequence number of the last change the client has seen.
+        """
+        writer = self.start_streamed_response('200 OK', "text/event-stream", {"Cache-Control": "no-cache"})
+        writer.write(b"retry: %d\n\n" % FEED_RETRY_MS)
+        writer.flush()
+
+        deadline = time.monotonic() + FEED_STREAM_DURATION
+        while not change_feed.closed and time.monotonic() < deadline:
+            events, reset = change_feed.wait(since, FEED_HEARTBEAT_INTERVAL)
+            if reset:
+                since = change_feed.sequence
+                writer.write(b"id: %d\nevent: reset\ndata: {}\n\n" % since)
+            elif events:
+                since = events[-1].sequence
+                writer.write(b"".join(event.to_server_sent_event() for event in events))
+            else:
+                # A comment, which fails to send once the client has gone
+                writer.write(b": keep-alive\n\n")
+            writer.flush()
+        writer.close()
 
     def post_request(self, filename):
         """
@@ -203,35 +1036,28 @@ class MyTCPHandler(socketserver.StreamRequestHandler):
         # Determine the response status based on whether or not the file exists.
         if os.path.exists(filename): 
             response_status = '200 OK'
-            file_size = os.path.getsize(filename)
         else: 
             response_status = '201 Created'
-            file_size = 0
 
         # Read the request body with the specified Content-Length
-        content_length = self.find_length()
-        request_body = self.rfile.read(content_length).decode().strip()
+        request_body = self.read_body().decode().strip()
 
-        # Unquote the body to handle special characters (æ, ø, å) and update the size to incorporate the new message. 
+        # Unquote the body to handle special characters (æ, ø, å). 
         body = urllib.parse.unquote(request_body)[5:]  # Start at 5 to skip "text=" prefix
-        file_size += len(body)
 
         # Append the body to the file
         with open(filename, 'ab') as f:
             f.write(body.encode() + b"\n")  # Append with a newline for better formatting
 
-        # Read the entire content of the file
-        with open(filename, "rb") as f:    
-            content = f.readlines()
-
         # Determine the content type based on the file extension
         content_type = HTTPHandler.find_content_type(filename)
-        response_header = HTTPHandler.create_response_header(response_status, content_type, file_size)
-        self.wfile.write(response_header)
 
-        # Write the file content to the client
-        for line in content: 
-            self.wfile.write(line)  # Write each line of content
+        # The file is sent in pieces as it is read, so its length does not have to be known beforehand
+        writer = self.start_streamed_response(response_status, content_type)
+        with open(filename, "rb") as f:    
+            for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b""):
+                writer.write(chunk)  # Write each piece of content
+        writer.close()
 
     def post_json(self, filename):
         """
@@ -244,73 +1070,161 @@ class MyTCPHandler(socketserver.StreamRequestHandler):
             None
         """
 
-        # Determine the response status based on whether or not the file exists.
-        response_status = '200 OK' if os.path.exists(filename) else '201 Created'
-
-        content_length = self.find_length()
-
         # Use the Content-Length header to get the length of the JSON data.
-        json_data = json.loads(self.rfile.read(content_length))    
+        json_data = json.loads(self.read_body())
 
-        # Generate a new message with a unique ID and the text from the JSON data.
-        
-        # Check if there are available IDs; if so, reuse the smallest one
-        new_ID = 1  # Start with ID 1
+        with messages_lock:
+            # Determine the response status based on whether or not the file exists.
+            response_status = '200 OK' if message_log.exists() else '201 Created'
 
-        # Find the smallest unused ID by iterating through existing messages
-        while any(message["ID"] == new_ID for message in messages):
-            new_ID += 1
+            # Generate a new message with a unique ID and the text from the JSON data.
+            # The store reuses the smallest free ID, if there is one.
+            new_message = messages.create(json_data["text"])
 
-        new_message = {"ID": new_ID, "Text": json_data["text"]}
+            # Save the new message to the storage
+            self.save_change("create", new_message)
 
         # Calculate the content length of the response JSON data and retrieve the content length of the response JSON data
         response_content = json.dumps(new_message, indent=4)  # Format with proper indentation (to get them below eachoter) source: https://pynative.com/python-prettyprint-json-data/
         content_length = len(response_content)
         
         # Create an HTTP response header
-        response_header = HTTPHandler.create_response_header(response_status, "application/json", content_length)
-
-        # Append the new message to the 'messages' list
-        messages.append(new_message)
+        response_header = self.response_header(response_status, "application/json", content_length)
 
         # Write the response header and its content
         self.wfile.write(response_header + response_content.encode())  
-
-        # Save the updated 'messages' list to the storage file
-        self.save_messages_to_file(filename)
         
+    def bulk_request(self):
+        """
+        Handle a POST request with a batch of operations on the messages, e.g.
+
+            [{"op": "create", "text": "Hello"},
+             {"op": "update", "ID": 3, "Text": "Hello again"},
+             {"op": "delete", "ID": 4}]
+
+        The batch is atomic: if any operation cannot be applied (e.g., it names a message
+        that does not exist), none of them are, and the response is an error. Otherwise all
+        of them are applied and saved with a single write to the message log. The response
+        has one result per operation, in the same order.
+
+        Returns:
+            None
+        """
+        try:
+            items = json.loads(self.read_body())
+        except ValueError:
+            self.send_error(400)
+            return
+        if not isinstance(items, list):
+            self.send_error(400)
+            return
+
+        operations, problems = [], []
+        for item in items:
+            operation, problem = self.parse_bulk_operation(item)
+            operations.append(operation)
+            problems.append(problem)
+
+        with messages_lock:
+            if not any(problems):
+                problems = messages.check_batch(operations)
+
+            changes = None
+            if not any(problems):
+                changes = messages.apply_batch(operations)
+                # Save every change with a single write
+                self.save_changes(changes)
+
+        if changes is not None:
+            results = []
+            for operation, message in changes:
+                result = {"status": 201 if operation == "create" else 200, "ID": message["ID"]}
+                if operation != "delete":
+                    result["Text"] = message["Text"]
+                results.append(result)
+            response_status = '200 OK'
+        else:
+            # Nothing was applied. The operations that were fine are marked as failing because of the others.
+            results = [
+                {"status": 404 if problem == "message not found" else 400, "error": problem} if problem
+                else {"status": 424, "error": "not applied, since another operation failed"}
+                for problem in problems
+            ]
+            response_status = '409 Conflict' if "message not found" in problems else '400 Bad Request'
+
+        # Bulk responses are read by programs and may be long, so they are not indented
+        self.send_content(response_status, "application/json", json.dumps(results).encode())
+
+    def parse_bulk_operation(self, item):
+        """
+        Check the form of one operation of a bulk request.
+
+        Args:
+            item: The operation, as decoded from the JSON body.
+
+        Returns:
+            tuple: The operation as (operation, ID, text) for MessageStore.check_batch(),
+            and None, or None and the reason why the operation is invalid.
+        """
+        if not isinstance(item, dict):
+            return None, "operation must be an object"
+
+        # Creates use "text" like POST /message, updates "Text" like PUT /message, but both are accepted
+        operation = item.get("op")
+        text = item.get("Text", item.get("text"))
+        if operation == "create":
+            if text is None:
+                return None, "missing text"
+            return ("create", None, text), None
+        if operation in ("update", "delete"):
+            if item.get("ID") is None:
+                return None, "missing ID"
+            message_id = to_message_id(item["ID"])
+            if message_id is None:
+                return None, "ID must be an integer"
+            if operation == "update":
+                if text is None:
+                    return None, "missing Text"
+                return ("update", message_id, text), None
+            return ("delete", message_id, None), None
+        return None, "op must be create, update or delete"
+
     def put_request(self, filename):
         """
         Handle a PUT request to update a message with new content.
         """
         # Parse the JSON request body
-        content_length = self.find_length()
-        json_data = json.loads(self.rfile.read(content_length).decode())
+        json_data = json.loads(self.read_body().decode())
 
         # Find the ID in the request data
         message_id = json_data.get("ID")
 
         if message_id is None:
             # Return an error response if the ID is missing in the request
-            self.wfile.write(HTTPHandler.create_response_header('404 Not Found', "application/json", 0))
+            self.wfile.write(self.response_header('404 Not Found', "application/json", 0))
             return
 
-        # Search for the message with the given ID
-        updated = False
-        for message in messages:
-            if message["ID"] == message_id:
-                # Update the message's text with the new content
-                message["Text"] = json_data["Text"]
-                updated = True
-                break
+        # The server only creates integer IDs, so anything else is a bad request
+        message_id = to_message_id(message_id)
+        if message_id is None:
+            self.wfile.write(self.response_header('400 Bad Request', "application/json", 0))
+            return
+
+        # Update the message's text with the new content, if the message with the given ID exists
+        with messages_lock:
+            message = messages.update(message_id, json_data["Text"])
+            updated = message is not None
+
+            if updated:
+                # Save the updated message
+                self.save_change("update", message)
 
         if updated:
-            # Respond with a success status code and save the updated messages
-            self.wfile.write(HTTPHandler.create_response_header('200 OK', "application/json", 0))
-            self.save_messages_to_file("message.json")
+            # Respond with a success status code
+            self.wfile.write(self.response_header('200 OK', "application/json", 0))
         else:
             # If the message with the given ID doesn't exist, return a not found error
-            self.wfile.write(HTTPHandler.create_response_header('404 Not Found', "application/json", 0))
+            self.wfile.write(self.response_header('404 Not Found', "application/json", 0))
 
     def delete_request(self, filename):
         """
@@ -323,89 +1237,224 @@ class MyTCPHandler(socketserver.StreamRequestHandler):
         None
         """
         # Read the request body to get the ID of the message to be deleted
-        content_length = self.find_length()
-        json_data = json.loads(self.rfile.read(content_length).decode())
+        json_data = json.loads(self.read_body().decode())
 
         # Find the ID in the request data
         message_id = json_data.get("ID")
 
         # Return an error response if the ID is missing in the request
         if message_id is None:
-            self.wfile.write(HTTPHandler.create_response_header('404 Not Found', "application/json", 0))
+            self.wfile.write(self.response_header('404 Not Found', "application/json", 0))
             return
 
-        # Search for the message with the given ID
-        deleted = False
-        for message in messages:
-            if message["ID"] == message_id:
-                # Delete the message and free its ID
-                messages.remove(message)
-                deleted = True
-                break
+        # The server only creates integer IDs, so anything else is a bad request
+        message_id = to_message_id(message_id)
+        if message_id is None:
+            self.wfile.write(self.response_header('400 Bad Request', "application/json", 0))
+            return
+
+        # Delete the message with the given ID and free its ID
+        with messages_lock:
+            message = messages.delete(message_id)
+            deleted = message is not None
+
+            if deleted:
+                # Save the deletion to the storage
+                self.save_change("delete", message)
 
         if deleted:
             # Respond with a success status code
-            self.wfile.write(HTTPHandler.create_response_header('200 OK', "application/json", 0))
+            self.wfile.write(self.response_header('200 OK', "application/json", 0))
         else:
             # If the message with the given ID doesn't exist, return a not found error
             print(f"Message with ID {message_id} not found.")
-            self.wfile.write(HTTPHandler.create_response_header('404 Not Found', "application/json", 0))
-        
-        # Save the updated 'messages' list to the storage file
-        self.save_messages_to_file(filename)
+            self.wfile.write(self.response_header('404 Not Found', "application/json", 0))
     
-    def save_messages_to_file(self, filename):
+    def save_change(self, operation, message):
         """
-        Save messages from the 'messages' list into a storage file (e.g., message.json).
+        Save a change to the messages by appending it to the message log, which costs
+        the size of the change instead of rewriting every message, and publish it to the
+        subscribers of the change feed. The caller must hold 'messages_lock', so the changes
+        get their sequence numbers in the order they are written to the log.
+
+        Args:
+            operation (str): "create", "update" or "delete".
+            message (dict): The message after the change (before it, for a delete).
         """
-        with open(filename, 'w') as storage_file:
-            json.dump(messages, storage_file, indent=4)  
+        self.save_changes([(operation, message)])
     
+    def save_changes(self, changes):
+        """
+        Save several changes to the messages with a single write to the message log, and
+        publish them to the change feed. The caller must hold 'messages_lock'.
+
+        Args:
+            changes (list): (operation, message) tuples, see save_change().
+        """
+        if metrics.enabled:
+            started = time.perf_counter()
+            message_log.append_many(changes)
+            metrics.observe_phase("persist", time.perf_counter() - started)
+        else:
+            message_log.append_many(changes)
+        change_feed.publish_many(changes)
+
     def get_filname(self, URI):
         filename = URI[1:]
         return filename
 
-    def find_length(self):  
+    def read_body(self):
         """
-        Extract the Content-Length from the HTTP request headers.
+        Get the request body. The parser has already read all of it, so this never blocks.
 
         Returns:
-            int: The Content-Length value extracted from the headers.
+            bytes: The request body.
         """
-        content_length = 0
+        return self.body
 
-        #  Read the HTTP request headers until an empty line is encountered 
-        while True:
-            header_line = self.rfile.readline().decode().strip()
-            if not header_line:
-                # Empty line indicates the end of headers
-                break
-            if ':' not in header_line:
-                # Skip invalid header field lines
-                continue
-            header_name, header_value = header_line.split(":", 1)
-            if header_name == "Content-Length":
-                content_length = int(header_value.strip())
 
-        return content_length
+def load_messages_from_file():
+    """
+    Load the messages from storage into the 'messages' store: the snapshot (message.json)
+    with the changes in the message log (message.log) replayed on top of it.
+    """
+    with messages_lock:
+        message_log.load()
 
 
-def load_messages_from_file():
+def start_profiler(mode="cprofile", sample_rate=0.01, window_seconds=60):
     """
-    Load messages from a storage file (e.g., message.json) into the 'messages' list.
+    Profile a fraction of the requests from now on, and write the profile to
+    PROFILE_DIRECTORY when the process gets SIGUSR1.
+
+    Args:
+        mode (str): 'cprofile' records every call of a sampled request, 'stacks' samples its stack (see profiler.py).
+        sample_rate (float): The fraction of requests to profile.
+        window_seconds (float): The length of the windows of time the samples are kept in.
     """
-    global messages
-    if os.path.exists("message.json"):
-        with open("message.json", 'r') as storage_file:
-            messages = json.load(storage_file)
-    
+    global profiler
+    profiler = PROFILERS[mode](sample_rate=sample_rate, window_seconds=window_seconds)
+
+    def dump_profile(signum, frame):
+        # The signal may arrive while this thread holds a lock of the profiler, so another thread writes the files
+        threading.Thread(target=profiler.dump, args=(PROFILE_DIRECTORY,)).start()
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, dump_profile)
+
 
+def close_message_log():
+    """
+    Compact the message log into message.json and close it, when the server stops.
+    """
+    with messages_lock:
+        message_log.compact()
+    message_log.close()
+
+
+# Default number of workers for each concurrency mode, when --workers is not given
+DEFAULT_WORKERS = {
+    "single": 1,
+    "threaded": 16,
+    "prefork": os.cpu_count() or 4,
+}
+
+
+def create_server(host, port, mode="single", workers=None):
+    """
+    Create a listening server for the given concurrency mode.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        mode (str): 'single' handles one connection at a time, 'threaded' uses a bounded
+            pool of threads and 'prefork' uses worker processes (see serve()).
+        workers (int): The number of threads in the 'threaded' mode.
+
+    Returns:
+        socketserver.TCPServer: The server.
+    """
+    if mode == "threaded":
+        pool_size = workers or DEFAULT_WORKERS[mode]
+        # Only this mode has threads to spare for the subscribers of the change feed
+        change_feed.enable(pool_size)
+        return ThreadPoolTCPServer((host, port), MyTCPHandler, pool_size=pool_size, admission=admission)
+
+    return SingleTCPServer((host, port), MyTCPHandler, admission=admission)
+
+
+def serve(server, mode="single", workers=None):
+    """
+    Serve requests until the server is interrupted.
+
+    Args:
+        server (socketserver.TCPServer): A server made by create_server().
+        mode (str): The concurrency mode the server was created with.
+        workers (int): The number of worker processes in the 'prefork' mode.
+    """
+    if mode == "prefork":
+        # The workers share the message storage, so they lock it across processes and pick up each other's changes
+        messages_lock.share_between_processes("message.json.lock", on_acquire=message_log.catch_up)
+        serve_prefork(server, workers or DEFAULT_WORKERS[mode])
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        # Subscribers of the change feed hold a thread, which must finish before the server can be closed
+        change_feed.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="INF-2300 HTTP server")
+    parser.add_argument("--host", default="localhost", help="address to listen on (default: localhost)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--mode", choices=sorted(DEFAULT_WORKERS), default="single",
+                        help="how connections are handled concurrently (default: single)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="threads (threaded) or processes (prefork) to use")
+    parser.add_argument("--metrics", action="store_true", help="record request metrics and serve them at /metrics")
+    add_profile_arguments(parser)
+    add_admission_arguments(parser)
+    return parser.parse_args()
+
+
+def add_admission_arguments(parser):
+    """Add the options that set the limits of the admission control to a parser of command-line arguments."""
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help=f"most open connections, 0 for no limit (default: {MAX_CONNECTIONS})")
+    parser.add_argument("--max-connections-per-ip", type=int, default=MAX_CONNECTIONS_PER_IP,
+                        help="most open connections from one address, 0 for no limit (default: 0)")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT,
+                        help="requests per second from one address, 0 for no limit (default: 0)")
+    parser.add_argument("--rate-burst", type=int, default=RATE_BURST,
+                        help="requests one address may make at once (default: the rate limit)")
+
+
+def set_admission_limits(max_connections, max_connections_per_ip, rate, burst):
+    """Replace the limits of the admission control. Call it before the server is created."""
+    global admission
+    admission = AdmissionControl(max_connections, max_connections_per_ip, rate, burst)
+
+
+def add_profile_arguments(parser):
+    """Add the options that turn on the profiler (see start_profiler()) to a parser of command-line arguments."""
+    parser.add_argument("--profile-rate", type=float, default=0,
+                        help="fraction of requests to profile, e.g. 0.01 (default: 0, no profiling)")
+    parser.add_argument("--profile-mode", choices=sorted(PROFILERS), default="cprofile",
+                        help="cprofile records every call, stacks samples the stack (default: cprofile)")
+    parser.add_argument("--profile-window", type=float, default=60,
+                        help="seconds of samples in each window of the profile (default: 60)")
 
 
 if __name__ == "__main__":
-    HOST, PORT = "localhost", 8080
-    socketserver.TCPServer.allow_reuse_address = True
-    with socketserver.TCPServer((HOST, PORT), MyTCPHandler) as server:
-        print("Serving at: http://{}:{}".format(HOST, PORT))
-        load_messages_from_file()             # Added so that the message from the json file may be loaded and maintained even if the server goes down.
-        server.serve_forever()
\ No newline at end of file
+    args = parse_arguments()
+    metrics.enabled = args.metrics
+    if args.profile_rate > 0:
+        start_profiler(args.profile_mode, args.profile_rate, args.profile_window)
+    set_admission_limits(args.max_connections, args.max_connections_per_ip, args.rate_limit, args.rate_burst)
+    with create_server(args.host, args.port, args.mode, args.workers) as server:
+        print("Serving at: http://{}:{} ({} mode)".format(args.host, args.port, args.mode))
+        load_messages_from_file()             # Added so that the message from the json file may be loaded and maintained even if the server goes down.
+        serve(server, args.mode, args.workers)
+        close_message_log()
@@ -31,7 +31,12 @@ class MockServer(socketserver.TCPServer):
     allow_reuse_address = True
 
 
-server = MockServer((HOST, PORT), HTTPHandler)
+# Set TEST_ENGINE=asyncio to run the tests against the asyncio engine (async_server.py)
+if os.environ.get("TEST_ENGINE") == "asyncio":
+    from async_server import AsyncHTTPServer
+    server = AsyncHTTPServer(HOST, PORT)
+else:
+    server = MockServer((HOST, PORT), HTTPHandler)
 server_thread = threading.Thread(target=server.serve_forever)
 server_thread.start()
 client = HTTPConnection(HOST, PORT)
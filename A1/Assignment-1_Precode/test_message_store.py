@@ -0,0 +1,108 @@
+import os
+import tempfile
+import threading
+
+from message_log import MessageLog
+from message_store import MessageStore, to_message_id
+
+"""
+Tests of the MessageStore and of replaying the MessageLog into it. They do not
+need a running server, run them with: python3 test_message_store.py
+"""
+
+
+def new_store():
+    return MessageStore([{"ID": 1, "Text": "Hello"}, {"ID": 2, "Text": "World"}, {"ID": 3, "Text": "Hello again"}])
+
+
+def test_to_message_id():
+    """Integer IDs, also as floats, are IDs, other values are not."""
+    return (to_message_id(3) == 3 and to_message_id(3.0) == 3 and isinstance(to_message_id(3.0), int)
+            and to_message_id(3.5) is None and to_message_id("3") is None
+            and to_message_id(True) is None and to_message_id([3]) is None)
+
+
+def test_delete_float_id_unindexes_message():
+    """Deleting with a float ID removes the message from the query indexes."""
+    store = new_store()
+    if store.delete(1.0) is None:
+        return False
+    try:
+        return (store.query(limit=10) == [{"ID": 2, "Text": "World"}, {"ID": 3, "Text": "Hello again"}]
+                and store.query(prefix="hello") == [{"ID": 3, "Text": "Hello again"}]
+                and store.query(contains="ello") == [{"ID": 3, "Text": "Hello again"}])
+    except KeyError:
+        return False
+
+
+def test_delete_float_id_frees_id():
+    """The ID of a message deleted with a float ID is given to the next new message."""
+    store = new_store()
+    store.delete(2.0)
+    return store.create("New")["ID"] == 2 and store.create("Newer")["ID"] == 4
+
+
+def test_update_float_id():
+    """Updating with a float ID re-indexes the text of the message."""
+    store = new_store()
+    store.update(2.0, "Changed")
+    return store.query(contains="chan") == [{"ID": 2, "Text": "Changed"}] and store.query(contains="world") == []
+
+
+def test_batch_delete_float_id():
+    """A batch that deletes with a float ID leaves the indexes consistent."""
+    store = new_store()
+    operations = [("delete", 3.0, None), ("create", None, "Bye")]
+    if any(store.check_batch(operations)):
+        return False
+    store.apply_batch(operations)
+    try:
+        return store.query(prefix="hello") == [{"ID": 1, "Text": "Hello"}] and store.get(3)["Text"] == "Bye"
+    except KeyError:
+        return False
+
+
+def test_replay_float_id_delete():
+    """Replaying a log record that deletes with a float ID leaves the indexes consistent."""
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, "message.json")
+        log_path = os.path.join(directory, "message.log")
+        with open(log_path, "w") as log_file:
+            log_file.write('{"op": "create", "ID": 1, "Text": "Hello"}\n')
+            log_file.write('{"op": "create", "ID": 2, "Text": "World"}\n')
+            log_file.write('{"op": "delete", "ID": 1.0}\n')
+
+        store = MessageStore()
+        message_log = MessageLog(store, threading.Lock(), snapshot_path, log_path)
+        message_log.load()
+        message_log.close()
+        try:
+            return store.query(limit=10) == [{"ID": 2, "Text": "World"}] and store.create("New")["ID"] == 1
+        except KeyError:
+            return False
+
+
+test_functions = [
+    test_to_message_id,
+    test_delete_float_id_unindexes_message,
+    test_delete_float_id_frees_id,
+    test_update_float_id,
+    test_batch_delete_float_id,
+    test_replay_float_id_delete,
+]
+
+
+def run_tests(all_tests):
+    passed = 0
+    for test_function in all_tests:
+        result = test_function()
+        if result:
+            passed += 1
+        print(("FAIL", "PASS")[result] + "\t" + test_function.__doc__)
+    print(f"\n{passed} of {len(all_tests)} tests PASSED.\n")
+    return passed == len(all_tests)
+
+
+if __name__ == "__main__":
+    if not run_tests(test_functions):
+        raise SystemExit(1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Compare the goodput of the transport protocols on the same seeds.
+
+Every protocol in TRANSPORT_LAYERS transfers the same data over a network with the
+same chances of dropping, corrupting and delaying packets, once for every seed.
+The random numbers are seeded the same way for every protocol, so each run starts
+from the same data and the same seed. The network events diverge, though, as soon
+as the protocols send different packets.
+
+Usage:
+    python3 benchmark_goodput.py
+    python3 benchmark_goodput.py --packets 1000 --seeds 10 --drop 0.3 --corrupt 0.3 --delay 0.3
+    python3 benchmark_goodput.py --timeout 0.4      # A fixed retransmission timeout
+    python3 benchmark_goodput.py --window 4         # A fixed window, without congestion control
+"""
+from argparse import ArgumentParser
+from logging import disable, WARNING
+from random import seed
+from statistics import mean
+
+from config import DROP_CHANCE, CORRUPT_CHANCE, DELAY_CHANCE, RANDOM_SEED
+from layers import TRANSPORT_LAYERS
+from simulation import Sim
+
+
+def run(protocol, packets, run_seed, timeout, window, channel):
+    """
+    Returns:
+        dict: The statistics of one run, see Sim.statistics().
+    """
+    seed(run_seed)
+    sim = Sim(packets, protocol, timeout, window, **channel)
+    sim.run()
+    return sim.statistics()
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="Compare the goodput of the transport protocols")
+    parser.add_argument("--packets", type=int, default=200, help="packets per run (default: 200)")
+    parser.add_argument("--seeds", type=int, default=5, help="runs per protocol, one per seed (default: 5)")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED,
+                        help="the first seed, the others follow it (default: RANDOM_SEED in config.py)")
+    parser.add_argument("--timeout", type=float,
+                        help="a fixed retransmission timeout in seconds, instead of the adaptive one")
+    parser.add_argument("--window", type=int,
+                        help="a fixed window of packets in flight, instead of congestion control")
+    parser.add_argument("--drop", type=float, default=DROP_CHANCE, help=f"chance of dropping (default: {DROP_CHANCE})")
+    parser.add_argument("--corrupt", type=float, default=CORRUPT_CHANCE,
+                        help=f"chance of corrupting (default: {CORRUPT_CHANCE})")
+    parser.add_argument("--delay", type=float, default=DELAY_CHANCE, help=f"chance of delaying (default: {DELAY_CHANCE})")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    disable(WARNING)
+    channel = {"drop_chance": args.drop, "corrupt_chance": args.corrupt, "delay_chance": args.delay}
+    seeds = range(args.seed, args.seed + args.seeds)
+
+    timeout = "adaptive timeout" if args.timeout is None else f"timeout {args.timeout:g} s"
+    window = "congestion control" if args.window is None else f"window {args.window}"
+    print(f"{args.packets} packets, {args.seeds} seeds, drop {args.drop:g}, corrupt {args.corrupt:g}, "
+          f"delay {args.delay:g}, {timeout}, {window}\n")
+    print(f"{'protocol':<18} {'goodput (B/s)':>14} {'sim. time (s)':>14} {'sent':>9} {'resent':>9} "
+          f"{'duplicates':>11} {'efficiency':>11}")
+    goodputs = {}
+    for protocol in TRANSPORT_LAYERS:
+        runs = [run(protocol, args.packets, run_seed, args.timeout, args.window, channel) for run_seed in seeds]
+        goodputs[protocol] = mean(statistics["goodput"] for statistics in runs)
+        print(f"{protocol:<18} {goodputs[protocol]:>14.2f} {mean(r['seconds'] for r in runs):>14.1f} "
+              f"{mean(r['transmissions'] for r in runs):>9.0f} {mean(r['retransmissions'] for r in runs):>9.0f} "
+              f"{mean(r['duplicates'] for r in runs):>11.0f} {mean(r['efficiency'] for r in runs):>11.1%}")
+
+    baseline = goodputs["go-back-n"]
+    for protocol, goodput in goodputs.items():
+        if protocol != "go-back-n":
+            print(f"\n{protocol}: {goodput / baseline:.2f}x the goodput of go-back-n")
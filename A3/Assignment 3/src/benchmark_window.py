@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Measure what one ACK costs the sender, for windows of different sizes.
+
+A Go-Back-N sender fills its window with packets, and then, as long as the benchmark
+runs, handles the ACK of the oldest packet and sends a new one. The window stays full,
+so every ACK slides the window by one packet, as in the steady state of a long transfer.
+The network drops everything, and the ACKs are made by the benchmark, so only the
+sender is measured. With the ring buffer in window.py the time per ACK stays the same
+from a window of ten packets to one of thousands.
+
+For comparison, 'list.pop(0)' is the time the same slide takes with the packets in a
+plain list, which grows with the window, since every packet after the first is moved.
+
+Usage:
+    python3 benchmark_window.py
+    python3 benchmark_window.py --windows 10 1000 30000 --acks 50000
+"""
+from argparse import ArgumentParser
+from logging import disable, getLogger, WARNING
+from time import perf_counter
+
+from config import SEQUENCE_NUMBERS
+from layers import NetworkLayer, TransportLayer
+from packet import Packet, wrap
+from scheduler import Scheduler
+
+
+DATA = b"ABCD"
+
+
+def sender(window):
+    """
+    Returns:
+        TransportLayer: A sender with a full window of 'window' packets in flight.
+    """
+    logger = getLogger("benchmark")
+    scheduler = Scheduler()
+    transport = TransportLayer().with_logger(logger).with_scheduler(scheduler)
+    network = NetworkLayer(drop_chance=1.0).with_logger(logger).with_scheduler(scheduler)
+    transport.register_below(network)
+
+    # A fixed window, and a receiver that can take everything
+    transport.congestion = None
+    transport.window_size = window
+    transport.peer_window_end = window
+    for _ in range(window):
+        transport.from_app(DATA)
+    return transport
+
+
+def ack(seqnr):
+    """
+    Returns:
+        Packet: The ACK of the packet 'seqnr', as the receiver would send it.
+    """
+    packet = Packet(DATA)
+    packet.ack = True
+    packet.seqnr = wrap(seqnr)
+    packet.acknr = wrap(seqnr + 1)
+    packet.window = SEQUENCE_NUMBERS // 2
+    return packet
+
+
+def time_transport(window, acks):
+    """
+    Returns:
+        float: The seconds per ACK, with a new packet sent after every ACK.
+    """
+    transport = sender(window)
+    base = transport.packets_window.base
+    # The ACKs are made before the clock starts, so only the sender is timed
+    packets = [ack(seqnr) for seqnr in range(base, base + acks)]
+
+    start = perf_counter()
+    for packet in packets:
+        transport.from_network(packet)
+        transport.from_app(DATA)
+    return (perf_counter() - start) / acks
+
+
+def time_list(window, acks):
+    """
+    Returns:
+        float: The seconds per ACK for sliding a list of 'window' packets by one.
+    """
+    packets_window = [Packet(DATA) for _ in range(window)]
+    start = perf_counter()
+    for _ in range(acks):
+        packets_window.pop(0)
+        packets_window.append(Packet(DATA))
+    return (perf_counter() - start) / acks
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="Measure what one ACK costs the sender, for windows of different sizes")
+    parser.add_argument("--windows", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="the window sizes, in packets (default: 10 100 1000 10000)")
+    parser.add_argument("--acks", type=int, default=20000, help="ACKs per window size (default: 20000)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    disable(WARNING)
+
+    # A packet more than half the sequence numbers away cannot be told apart from one behind it
+    for window in args.windows:
+        if window >= SEQUENCE_NUMBERS // 2:
+            raise SystemExit(f"The window must be less than {SEQUENCE_NUMBERS // 2} packets (SEQUENCE_NUMBERS / 2)")
+
+    print(f"{args.acks} ACKs per window size\n")
+    print(f"{'window':>8} {'sender (us/ACK)':>16} {'list.pop(0) (us/ACK)':>21}")
+    for window in args.windows:
+        print(f"{window:>8} {time_transport(window, args.acks) * 1e6:>16.2f} "
+              f"{time_list(window, args.acks) * 1e6:>21.3f}")
@@ -30,5 +30,38 @@ DELAY_CHANCE = 0.7
 # Delay in seconds
 DELAY_AMOUNT = 0.5
 
-# Window size 
-WINDOW_SIZE = 4 
\ No newline at end of file
+# Retransmission timeout in seconds. It starts at INITIAL_TIMEOUT and adapts to
+# the measured round-trip times, within MIN_TIMEOUT and MAX_TIMEOUT (see rto.py).
+# Set ADAPTIVE_TIMEOUT to False for a fixed timeout of INITIAL_TIMEOUT.
+ADAPTIVE_TIMEOUT = True
+INITIAL_TIMEOUT = 1.0
+MIN_TIMEOUT = 0.2
+MAX_TIMEOUT = 2.0
+
+# Window size, the packets in flight when CONGESTION_CONTROL is False
+WINDOW_SIZE = 4
+
+# Congestion control (see congestion.py): the packets in flight start at
+# INITIAL_CWND and adapt to the losses, with slow start up to INITIAL_SSTHRESH,
+# additive increase after that, and fast retransmit after DUPLICATE_ACKS
+# duplicate ACKs. Set it to False for a fixed window of WINDOW_SIZE.
+CONGESTION_CONTROL = True
+INITIAL_CWND = 1
+INITIAL_SSTHRESH = 16
+DUPLICATE_ACKS = 3
+
+# The packets the receiver can buffer. It advertises this window in every ACK,
+# and the sender never sends more than this beyond the last ACK (flow control).
+RECEIVE_WINDOW = 32
+
+# Sequence numbers on the wire count modulo SEQUENCE_NUMBERS (see packet.py).
+# It must be more than twice the largest window, or a packet that is a window
+# behind cannot be told apart from one that is a window ahead.
+SEQUENCE_NUMBERS = 2 ** 16
+
+# How lost packets are recovered:
+# - "go-back-n": cumulative ACKs, a timeout resends the whole window,
+#   and the receiver drops packets that arrive out of order
+# - "selective-repeat": an ACK for every packet, a timer for every packet,
+#   and the receiver buffers packets that arrive out of order
+PROTOCOL = "go-back-n" 
\ No newline at end of file
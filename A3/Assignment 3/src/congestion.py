@@ -0,0 +1,81 @@
+from config import INITIAL_CWND, INITIAL_SSTHRESH, RECEIVE_WINDOW
+
+
+class CongestionControl:
+    """
+    The congestion window (cwnd) of a sender, as in TCP Reno (RFC 5681), counted in packets.
+
+    In slow start (cwnd below ssthresh) the window grows by one packet for every packet
+    that is ACKed, so it doubles every round trip. In congestion avoidance it grows by
+    about one packet per round trip (additive increase). A loss that is found by
+    duplicate ACKs halves it (multiplicative decrease), and a timeout starts over from
+    one packet, with ssthresh at half of what was in flight.
+
+    If 'trace' is enabled, every change of the window is recorded in it, as
+    (time, cwnd, ssthresh, reason).
+    """
+
+    def __init__(self, initial=INITIAL_CWND, ssthresh=INITIAL_SSTHRESH, maximum=RECEIVE_WINDOW, trace=False):
+        """
+        Args:
+            initial (int): The window at the start, in packets.
+            ssthresh (int): The window at which slow start ends.
+            maximum (int): The largest window. It is no use growing beyond the
+                window the receiver advertises.
+            trace (bool): Whether to record every change of the window.
+        """
+        self.cwnd = float(initial)
+        self.ssthresh = float(ssthresh)
+        self.maximum = maximum
+        self.trace = [(0.0, self.cwnd, self.ssthresh, "initial")] if trace else None
+
+    @property
+    def window(self):
+        """The number of packets that may be in flight."""
+        return max(1, int(self.cwnd))
+
+    def on_ack(self, acked, now):
+        """
+        Grow the window after an ACK of new data.
+
+        Args:
+            acked (int): The number of packets the ACK acknowledged for the first time.
+            now (float): The current time, for the trace.
+        """
+        cwnd = self.cwnd
+        if cwnd < self.ssthresh:
+            # Slow start, up to ssthresh, and congestion avoidance for the rest
+            growth = min(acked, self.ssthresh - cwnd)
+            cwnd += growth
+            acked -= growth
+        if acked > 0:
+            cwnd += acked / cwnd
+        self.set_cwnd(min(cwnd, self.maximum), now, "ack")
+
+    def on_duplicate_acks(self, in_flight, now):
+        """
+        Halve the window after a loss that duplicate ACKs found (fast retransmit).
+
+        Args:
+            in_flight (int): The number of packets that were not ACKed yet.
+            now (float): The current time, for the trace.
+        """
+        self.ssthresh = max(in_flight / 2, 2.0)
+        self.set_cwnd(self.ssthresh, now, "fast retransmit")
+
+    def on_timeout(self, in_flight, now):
+        """
+        Start over from one packet after a timeout.
+
+        Args:
+            in_flight (int): The number of packets that were not ACKed yet.
+            now (float): The current time, for the trace.
+        """
+        self.ssthresh = max(in_flight / 2, 2.0)
+        self.set_cwnd(1.0, now, "timeout")
+
+    def set_cwnd(self, cwnd, now, reason):
+        if cwnd != self.cwnd or reason != "ack":
+            self.cwnd = cwnd
+            if self.trace is not None:
+                self.trace.append((now, cwnd, self.ssthresh, reason))
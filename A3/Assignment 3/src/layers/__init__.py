@@ -1,5 +1,18 @@
 from .application import ApplicationLayer
 from .network import NetworkLayer
+from .selective_repeat import SelectiveRepeatTransportLayer
 from .transport import TransportLayer
 
-__all__ = ["ApplicationLayer", "NetworkLayer", "TransportLayer"]
+# The transport layer of each protocol that can be chosen in config.py
+TRANSPORT_LAYERS = {
+    "go-back-n": TransportLayer,
+    "selective-repeat": SelectiveRepeatTransportLayer,
+}
+
+__all__ = [
+    "ApplicationLayer",
+    "NetworkLayer",
+    "SelectiveRepeatTransportLayer",
+    "TransportLayer",
+    "TRANSPORT_LAYERS",
+]
@@ -1,6 +1,5 @@
-from copy import copy
+from logging import WARNING
 from secrets import token_bytes
-from threading import Timer
 
 from config import DROP_CHANCE, CORRUPT_CHANCE, DELAY_CHANCE, DELAY_AMOUNT
 from utils import validate_packet, should
@@ -10,40 +9,54 @@ class NetworkLayer:
     """Simulate an unreliable network which might drop,
     corrupt or delay packets."""
 
+    def __init__(self, drop_chance=DROP_CHANCE, corrupt_chance=CORRUPT_CHANCE,
+                 delay_chance=DELAY_CHANCE, delay_amount=DELAY_AMOUNT):
+        # The chances default to those in config.py
+        self.drop_chance = drop_chance
+        self.corrupt_chance = corrupt_chance
+        self.delay_chance = delay_chance
+        self.delay_amount = delay_amount
+
     def with_logger(self, logger):
         self.logger = logger
         return self
 
+    def with_scheduler(self, scheduler):
+        self.scheduler = scheduler
+        return self
+
     def register_above(self, layer):
         self.transport_layer = layer
 
     def send(self, packet):
         # Make sure we only send packets which have valid data in them
         validate_packet(packet)
-        packet = copy(packet)
+        packet = packet.copy()
+
+        # A call to the logger costs time even when logging is off (--quiet), so it is only made when it would log
+        log = self.logger.isEnabledFor(WARNING)
 
         # Should we DROP this packet?
-        if should(DROP_CHANCE):
-            self.logger.warning(f"Dropping {packet}")
+        if should(self.drop_chance):
+            if log:
+                self.logger.warning("Dropping %s", packet)
             return
 
         # Should we CORRUPT this packet?
-        if should(CORRUPT_CHANCE):
-            self.logger.warning(f"Corrupting {packet}")
+        if should(self.corrupt_chance):
+            if log:
+                self.logger.warning("Corrupting %s", packet)
             packet.data = token_bytes(len(packet.data))
 
         # Should we DELAY this packet?
-        if should(DELAY_CHANCE):
-            self.logger.warning(f"Delaying {packet}")
-            # We actually delay this! A Timer object is a subclass of Thread.
-            # This will basically call:
-            # 'self.transport_layer.from_network(packet)' after DELAY_AMOUNT
-            # seconds have passed, from a separate thread. So other packets
+        if should(self.delay_chance):
+            if log:
+                self.logger.warning("Delaying %s", packet)
+            # We actually delay this! The scheduler will call
+            # 'self.recipient.receive(packet)' once the virtual clock has
+            # moved 'delay_amount' seconds ahead, so other packets
             # will arrive in the meantime.
-            timer_object = Timer(
-                DELAY_AMOUNT, self.recipient.receive, (packet,)           # måtte ende her 
-            )
-            timer_object.start()
+            self.scheduler.call_later(self.delay_amount, self.recipient.receive, packet)
             return
 
         self.recipient.receive(packet)
@@ -0,0 +1,159 @@
+from packet import unwrap
+
+from .transport import TransportLayer
+
+
+class SelectiveRepeatTransportLayer(TransportLayer):
+    """
+    A transport layer that uses Selective Repeat instead of Go-Back-N.
+
+    The receiver ACKs every packet it receives intact, and keeps packets that arrive
+    ahead of the one it expects in a reorder buffer, until the gap before them is filled.
+    Every ACK also carries the next sequence number the receiver expects ('acknr'), so
+    one ACK that gets through acknowledges all the packets before it, as in Go-Back-N.
+    The sender has a timer for every packet, and only resends the packets whose timer
+    runs out, instead of the whole window. At high loss rates far fewer packets are sent.
+
+    'packets_window' holds the sent packets from the oldest one that is not ACKed yet,
+    so the window counts every sequence number in use from there, even if some of the
+    packets after the oldest one have been ACKed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.acked          = set()         # Sequence numbers in the window that have been ACKed
+        self.timers         = {}            # Sequence number -> timeout event of the packet
+        self.receive_buffer = {}            # Sequence number -> data that arrived out of order
+
+
+    # BOB
+    def handle_data_packet(self, packet):
+        """
+        Receiving data from the network layer. Packets inside the receive window are
+        ACKed and buffered, and delivered in order. Packets just before the window were
+        delivered already, but their ACK may have been lost, so they are ACKed again.
+
+        Args:
+            packet (Packet): The received packet.
+        """
+        if packet.checksum != self.calculate_checksum(packet.data):
+            self.debugger("Received corrupt data packet with seqnr: %s. Dropping it, not sending ACK.\n", packet.seqnr)
+            return
+
+        seqnr = unwrap(packet.seqnr, self.expected_seqnr)
+        if self.expected_seqnr <= seqnr < self.expected_seqnr + self.receive_window:
+            self.debugger("Received data packet with seqnr: %s, expected: %s \n", seqnr, self.expected_seqnr)
+            if seqnr in self.receive_buffer:
+                self.duplicates += 1
+            self.receive_buffer[seqnr] = packet.data
+
+            # Deliver the buffered packets that are next in order
+            while self.expected_seqnr in self.receive_buffer:
+                self.application_layer.receive_from_transport(self.receive_buffer.pop(self.expected_seqnr))
+                self.expected_seqnr += 1
+        elif self.expected_seqnr - self.receive_window <= seqnr < self.expected_seqnr:
+            self.duplicates += 1
+        else:
+            self.debugger("Ignoring data packet with seqnr: %s, outside the window\n", seqnr)
+            return
+
+        self.debugger("Sending ack for %s", seqnr)
+        self.send_ack(packet)
+
+
+    # ALICE
+    def handle_ack_packet(self, packet):
+        """
+        Handling received Ack packets. The timers of the ACKed packet, and of the
+        packets before 'acknr', are stopped, and the window slides past the packets
+        at its start that have been ACKed. An ACK whose 'acknr' does not move past the
+        start of the window is a duplicate ACK, even if it ACKs a later packet.
+
+        Args:
+            packet (Packet): The received ack.
+        """
+        window = self.packets_window
+        base = window.base
+        seqnr = unwrap(packet.seqnr, base)
+        acknr = unwrap(packet.acknr, base)
+        self.debugger("Alice received ACK for %s, expecting %s", seqnr, acknr)
+        self.update_peer_window(acknr, packet.window)
+
+        # Measure the round-trip time of the ACKed packet, if it was not ACKed before
+        if seqnr in self.timers:
+            self.sample_rtt(window.get(seqnr))
+        acked = self.acknowledge(seqnr)
+        for seqnr in range(base, min(acknr, window.end)):
+            acked += self.acknowledge(seqnr)
+
+        if acked:
+            self.acked_new_data(acked)
+        if acknr > base:
+            self.duplicate_acks = 0
+        elif window:
+            self.duplicate_ack()
+
+        # Slide the window to the right
+        while window and window.base in self.acked:
+            self.acked.discard(window.base)
+            window.popleft()
+
+
+    def acknowledge(self, seqnr):
+        """
+        Stop the timer of a packet in the window, and mark it as ACKed.
+
+        Returns:
+            int: 1 if the packet had not been ACKed before, otherwise 0.
+        """
+        # Only packets in the window that are not ACKed yet have a timer
+        timer = self.timers.pop(seqnr, None)
+        if timer is None:
+            return 0
+        self.scheduler.cancel(timer)
+        self.acked.add(seqnr)
+        return 1
+
+    def fast_retransmit(self):
+        """Resend the packet at the start of the window, the one the receiver is missing."""
+        base = self.packets_window.base
+        if base in self.timers:
+            self.resend(base)
+
+    def handle_timeout(self, seqnr):
+        """
+        Handle the timeout event of a packet by retransmitting it alone.
+
+        The packets sent around the same time usually time out together, so the timeout
+        is backed off and the congestion window started over once per window of data, as
+        in duplicate_ack(): only for a packet sent after the last time they were. The
+        other packets that time out are just resent.
+
+        Args:
+            seqnr (int): The sequence number of the packet whose timer ran out.
+        """
+        self.debugger("Timeout occurred. Retransmitting packet %s\n", seqnr)
+        if seqnr >= self.recover:
+            self.timed_out()
+        self.resend(seqnr)
+
+    def resend(self, seqnr):
+        """Retransmit a packet in the window, and restart its timer."""
+        packet = self.packets_window.get(seqnr)
+        packet.increment_retry_count()
+        self.start_timer(seqnr)
+        self.network_layer.send(packet)
+        self.retransmissions += 1
+
+    def start_timer(self, seqnr):
+        """
+        Start the timer of a packet, which calls handle_timeout(seqnr) if the
+        packet is not ACKed in time. A timer that is running is restarted.
+
+        Args:
+            seqnr (int): The sequence number of the packet that was sent.
+        """
+        timer = self.timers.get(seqnr)
+        if timer is not None:
+            self.scheduler.cancel(timer)
+        self.timers[seqnr] = self.scheduler.call_later(self.timeout, self.handle_timeout, seqnr)
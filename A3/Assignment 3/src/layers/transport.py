@@ -1,11 +1,11 @@
-from collections import deque
-
 from copy import copy
-from threading import Timer
+from zlib import crc32
 
-from packet import Packet
+from packet import Packet, wrap, unwrap
 from config import *
-import time
+from congestion import CongestionControl
+from rto import RTOEstimator
+from window import SendWindow
 
 
 
@@ -13,25 +13,40 @@ class TransportLayer:
     """
     The transport layer receives chunks of data from the application layer
     and must make sure it arrives on the other side unchanged and in order.
+
+    Sequence numbers are counted from 0 without wrapping inside the layer, and
+    wrapped modulo SEQUENCE_NUMBERS in the packets (see packet.py). The sent
+    packets are kept in a ring buffer (see window.py), so sending a packet and
+    sliding the window past an ACKed one cost the same however large the window is.
     """
 
     def __init__(self):
         # Initialize instance variables
         self.timer          = None
-        self.timeout        = 0.4           # Seconds
+        self.rto            = RTOEstimator() # Retransmission timeout, adapts to the round-trip times
         self.window_size = WINDOW_SIZE      # Window size, value sat in config 
-        self.packets_window = []            # Buffer for sending packets
-        self.window_start   = 0             # Start positions within the list of packets
-        self.window_end     = 0             # End positions within the list of packets
+        self.packets_window = SendWindow()  # Sent packets that are not ACKed yet, by seqnr
         self.seqnr          = 0             # Sequence number, increm for all pacets 
         self.expected_seqnr = 0             # The expected data sequence number
-        self.expected_ack   = 0             # The last acknowledged sequence number
+        self.packets_sent   = 0             # Data packets sent for the first time
+        self.retransmissions = 0            # Data packets sent again
+        self.duplicates     = 0             # Data packets received again after they were delivered
+        self.receive_window = RECEIVE_WINDOW # Packets we can buffer as receiver, advertised in ACKs
+        self.peer_window_end = RECEIVE_WINDOW # The first seqnr the receiver cannot take yet
+        self.congestion     = CongestionControl() if CONGESTION_CONTROL else None
+        self.duplicate_acks = 0             # ACKs in a row that did not acknowledge new data
+        self.recover        = 0             # Losses are only reacted to again once the window (or a lost packet) is past this
         self.debug          = False          # Set to false if you do not want debug prints       
 
+    @property
+    def timeout(self):
+        """The current retransmission timeout in seconds."""
+        return self.rto.rto
 
     def calculate_checksum(self, data):
         """
-        Calculate a simple XOR-based checksum for the data.
+        Calculate a CRC-32 checksum for the data. (An XOR of the bytes lets one
+        corrupted packet in 256 through, which long runs are sure to hit.)
 
         Args:
             data (bytes): The data for which the checksum is calculated.
@@ -39,25 +54,29 @@ class TransportLayer:
         Returns:
             int: The calculated checksum.
         """
-        checksum = 0
-        for byte in data:
-            checksum ^= byte
-        return checksum
+        return crc32(data)
 
-    def debugger(self, message):
+    def debugger(self, message, *args):
         """
         A helper method to print debugging messages if debugging is enabled.
+        The message is only formatted with the arguments if it is printed, so
+        a message about the whole window costs nothing when debugging is off.
 
         Args:
-            message (str): The message to print.
+            message (str): The message to print, with %s for every argument.
+            *args: The arguments of the message.
         """
         if self.debug == True:
-            self.logger.debug(message)
+            self.logger.debug(message, *args)
 
     def with_logger(self, logger):
         self.logger = logger
         return self
 
+    def with_scheduler(self, scheduler):
+        self.scheduler = scheduler
+        return self
+
     def register_above(self, layer):
         self.application_layer = layer
 
@@ -75,31 +94,46 @@ class TransportLayer:
         """
 
         if binary_data is None: 
-            self.debugger(f"Binary data is {binary_data}, something is wrong")
+            self.debugger("Binary data is %s, something is wrong", binary_data)
             return
 
-        if not self.packets_window or self.packets_window[-1].seqnr != self.seqnr:
-            # Wait until there is space in the window
-            while len(self.packets_window) >= self.window_size:
-                self.debugger("Window is full, waiting for space")
-                time.sleep(1)
+        # Wait until there is space in the window, by running the events
+        # (ACKs and timeouts) that are due next on the virtual clock
+        while self.window_is_full():
+            self.debugger("Window is full, waiting for space")
+            if not self.scheduler.step():
+                raise RuntimeError("The window is full, and no ACK or timeout is on its way")
 
-            # Create a packet with the binary data, sequence number, and checksum.
-            packet = Packet(binary_data)
-            packet.seqnr = self.seqnr
-            self.seqnr += 1
+        # Create a packet with the binary data, sequence number, and checksum.
+        seqnr = self.seqnr
+        packet = Packet(binary_data)
+        packet.seqnr = wrap(seqnr)
+        packet.sent_at = self.scheduler.now
+        self.seqnr += 1
 
-            # Calculate the data's checksum. This is done to determine whether or not the data is corrupted. 
-            packet.checksum = self.calculate_checksum(binary_data)  
+        # Calculate the data's checksum. This is done to determine whether or not the data is corrupted. 
+        packet.checksum = self.calculate_checksum(binary_data)  
 
-            # Append the packet to the window
-            self.debugger(f"append packet nr {self.seqnr} \n")
-            self.packets_window.append(packet)
-            self.window_end = self.seqnr
-            self.debugger(f"window: {self.packets_window} \n")
+        # Append the packet to the window
+        self.debugger("append packet nr %s \n", seqnr)
+        self.packets_window.append(packet)
+        self.debugger("window: %s \n", self.packets_window)
 
-            self.network_layer.send(packet)
-            self.reset_timer(self.handle_timeout)
+        # The timer is started first, since the ACK may be back before send() returns
+        self.start_timer(seqnr)
+        self.network_layer.send(packet)
+        self.packets_sent += 1
+
+
+    def window_is_full(self):
+        """
+        Returns:
+            bool: True if no more packets may be sent until some are ACKed, because the
+            congestion window (or WINDOW_SIZE) is in flight, or the receiver cannot
+            take the next packet.
+        """
+        window = self.congestion.window if self.congestion else self.window_size
+        return len(self.packets_window) >= window or self.seqnr >= self.peer_window_end
 
 
     def from_network(self, packet):
@@ -110,7 +144,7 @@ class TransportLayer:
             packet (Packet): The received packet.
         """
         
-        self.debugger(self.packets_window)
+        self.debugger("%s", self.packets_window)
         
         if packet.ack:
             # Handling acknowledgment packets
@@ -123,7 +157,9 @@ class TransportLayer:
     # BOB 
     def handle_data_packet(self, packet):
         """
-        Receiving data from the network layer.
+        Receiving data from the network layer. Every intact packet is ACKed with the
+        next sequence number we expect, so a packet that arrives after a missing one
+        gets a duplicate ACK, which tells Alice that a packet is missing.
 
         Args:
             packet (Packet): The received packet.
@@ -131,62 +167,127 @@ class TransportLayer:
     
         # Calculate the checksum of the received data
         received_checksum = packet.checksum
+        calculated_checksum = self.calculate_checksum(packet.data)
 
-        if packet.seqnr <= self.expected_seqnr:     
-            self.debugger(f"Recived data packet with seqnr: {packet.seqnr}, expected:  {self.expected_seqnr} \n")
-
-            # Calculate the checksum of the received data
-            calculated_checksum = self.calculate_checksum(packet.data)
+        # Check if the received checksum is equal to the calculated checksum
+        if received_checksum != calculated_checksum:
+            # Checksums do not match; data is corrupt
+            self.debugger("Received corrupt data (%s != %s). Dropping the packet, not sending ACK.\n",
+                          received_checksum, calculated_checksum)
+            return
 
-            # Check if the received checksum is equal to the calculated checksum
-            if received_checksum == calculated_checksum:
-                self.debugger(f"checksums {received_checksum} == {calculated_checksum}")
+        seqnr = unwrap(packet.seqnr, self.expected_seqnr)
+        self.debugger("Recived data packet with seqnr: %s, expected:  %s \n", seqnr, self.expected_seqnr)
+        if seqnr == self.expected_seqnr:
+            self.expected_seqnr += 1
+            self.application_layer.receive_from_transport(packet.data)
+        elif seqnr < self.expected_seqnr:
+            self.duplicates += 1
+        else:
+            # Go-Back-N drops packets that arrive after a missing one
+            self.debugger("Received future data packet: expected: %s\n", self.expected_seqnr)
 
-                # Send ACK for the received packet using self.network_layer.send.
-                packet.ack = True
-                self.debugger("Sending ack")
-                self.network_layer.send(packet)
-                self.expected_ack = packet.seqnr + 1           
+        self.debugger("Sending ack")
+        self.send_ack(packet)
 
-                if packet.seqnr == self.expected_seqnr:
-                    self.expected_seqnr += 1
-                    self.application_layer.receive_from_transport(packet.data)
-            else: 
-                # Checksums do not match; data is corrupt
-                self.debugger("Received corrupt data ({received_checksum} != {calculated_checksum}). Dropping the packet, not sending ACK.\n")
+    def send_ack(self, packet):
+        """
+        Send the ACK for a received data packet, with the next sequence number we
+        expect and the window we advertise. The application takes the data as soon
+        as it is delivered, so the whole receive window is free from 'acknr' on.
 
-        elif packet.seqnr > self.expected_ack:
-            # Sett starten på vinduet til der det elementet er i lista 
-            self.debugger(f"Received future data packet: expected: {self.expected_ack}\n")
+        Args:
+            packet (Packet): The received packet, which is turned into the ACK.
+        """
+        packet.ack = True
+        packet.acknr = wrap(self.expected_seqnr)
+        packet.window = self.receive_window
+        self.network_layer.send(packet)
 
 
     # ALICE 
     def handle_ack_packet(self, packet):
         """
-        Handling received Ack packets.
+        Handling received Ack packets. An ACK acknowledges every packet before its
+        'acknr'. An ACK that acknowledges nothing new while packets are in flight is
+        a duplicate ACK.
 
         Args:
             ACK (ack): The received ack.
         """
-    
-        # mindre eller expecte 
-        if packet.seqnr >= self.expected_seqnr:    
-            self.debugger(f"Alice recived ACK.  ack seqnr:{packet.seqnr} = exp seqnr: {self.expected_ack} \n")
-            self.expected_ack = packet.seqnr
-            
+        base = self.packets_window.base
+        seqnr = unwrap(packet.seqnr, base)
+        acknr = unwrap(packet.acknr, base)
+        self.update_peer_window(acknr, packet.window)
+        if not self.packets_window:
+            return
+
+        if acknr > base:
+            self.debugger("Alice recived ACK.  ack seqnr:%s, acknr: %s \n", seqnr, acknr)
+
+            # Measure the round-trip time of the ACKed packet, if it is still in the window
+            if seqnr < acknr:
+                acked_packet = self.packets_window.get(seqnr)
+                if acked_packet is not None:
+                    self.sample_rtt(acked_packet)
+
             # Slide the window to the right
-            while self.packets_window and self.packets_window[0].seqnr <= packet.seqnr: 
-                self.packets_window.pop(0)
-                self.debugger(f"Pop packet nr {packet.seqnr}")
-                self.window_start = self.expected_ack +1 
-                self.expected_ack += 1
-        else:
-            self.debugger(f"Ignoring out-of-order ACK packet with seqnr: {packet.seqnr}, expected: {self.expected_seqnr}")
+            self.packets_window.slide_to(acknr)
+            self.debugger("Popped packets up to nr %s", acknr - 1)
 
-        # Reset timer 
-        if self.packets_window:
+            self.duplicate_acks = 0
+            self.acked_new_data(acknr - base)
+
+            # Reset timer, which stops it if every packet has been ACKed
             self.reset_timer(self.handle_timeout)
             self.debugger("Resetting timer \n")
+        elif acknr == base:
+            self.duplicate_ack()
+        else:
+            self.debugger("Ignoring old ACK packet with acknr: %s, window starts at: %s", acknr, base)
+
+
+    def update_peer_window(self, acknr, window):
+        """
+        Move the end of the receiver's window to where the ACK says it is, unless
+        the ACK is older than one we have seen.
+
+        Args:
+            acknr (int): The 'acknr' of the received ack, without wrapping.
+            window (int): The window the ack advertises.
+        """
+        self.peer_window_end = max(self.peer_window_end, acknr + window)
+
+    def acked_new_data(self, acked):
+        """
+        Packets were ACKed for the first time: the timeout is not backed off any
+        more, and the congestion window grows.
+
+        Args:
+            acked (int): The number of packets.
+        """
+        self.rto.clear_backoff(self.scheduler.now)
+        if self.congestion:
+            self.congestion.on_ack(acked, self.scheduler.now)
+
+    def duplicate_ack(self):
+        """
+        Count a duplicate ACK. After DUPLICATE_ACKS in a row, the packet at the start
+        of the window is taken as lost and retransmitted without waiting for the
+        timeout (fast retransmit), once per window of data.
+        """
+        self.duplicate_acks += 1
+        if self.duplicate_acks == DUPLICATE_ACKS and self.packets_window.base >= self.recover:
+            self.debugger("%s duplicate ACKs. Fast retransmit\n", self.duplicate_acks)
+            self.recover = self.seqnr
+            if self.congestion:
+                self.congestion.on_duplicate_acks(len(self.packets_window), self.scheduler.now)
+            self.fast_retransmit()
+
+    def fast_retransmit(self):
+        """Go-Back-N resends the whole window, since the receiver dropped what came after the lost packet."""
+        self.retransmit_window()
+        self.reset_timer(self.handle_timeout)
 
 
     def handle_timeout(self):
@@ -194,28 +295,69 @@ class TransportLayer:
         Handle the timeout event by retransmitting unacknowledged packets.
         """
         self.debugger("Timeout occurred. Retransmitting unacknowledged packets\n")
+        self.timed_out()
 
         # Retransmit all unacknowledged packets
-        for packet in self.packets_window:
-            self.network_layer.send(packet)
+        self.retransmit_window()
         
         # Reset timer
         self.reset_timer(self.handle_timeout)
+
+    def timed_out(self):
+        """Back off the timeout, and start the congestion window over."""
+        self.rto.back_off(self.scheduler.now)
+        self.duplicate_acks = 0
+        self.recover = self.seqnr
+        if self.congestion:
+            self.congestion.on_timeout(len(self.packets_window), self.scheduler.now)
+
+    def retransmit_window(self):
+        """
+        Retransmit all unacknowledged packets. An ACK may come back while the window
+        is being sent, so the packets it acknowledges are skipped.
+        """
+        window = self.packets_window
+        for seqnr in range(window.base, window.end):
+            packet = window.get(seqnr)
+            if packet is None:
+                continue
+            packet.increment_retry_count()
+            self.network_layer.send(packet)
+            self.retransmissions += 1
         
 
+    def sample_rtt(self, packet):
+        """
+        Measure the round-trip time of a packet in the window that was just ACKed.
+        By Karn's algorithm, a retransmitted packet is not measured, since the ACK
+        may be for any of its copies.
+
+        Args:
+            packet (Packet): The ACKed packet.
+        """
+        if packet.retry_count == 0:
+            self.rto.sample(self.scheduler.now - packet.sent_at, self.scheduler.now)
+
+    def start_timer(self, seqnr):
+        """
+        Start timing a packet that was just sent for the first time. Go-Back-N has a
+        single timer for the whole window, which is restarted.
+
+        Args:
+            seqnr (int): The sequence number of the packet that was sent.
+        """
+        self.reset_timer(self.handle_timeout)
+
     def reset_timer(self, callback, *args):
-        # This is a safety-wrapper around the Timer-objects, which are
-        # separate threads. If we have a timer-object already,
-        # stop it before making a new one so we don't flood
-        # the system with threads!
+        # The timer is an event of the scheduler. If we have one already,
+        # cancel it before making a new one, so only one timeout is pending.
         if self.timer:
-            if self.timer.is_alive():
-                self.timer.cancel()
+            self.scheduler.cancel(self.timer)
+            self.timer = None
         # callback(a function) is called with *args as arguments
-        # after self.timeout seconds.
+        # after self.timeout seconds of virtual time.
 
         # Only reset the timer if there are unacknowledged packets in the window
         if self.packets_window:
-            self.timer = Timer(self.timeout, callback, *args)
-            self.timer.start()
+            self.timer = self.scheduler.call_later(self.timeout, callback, *args)
 
@@ -1,12 +1,16 @@
 from logging import getLogger
 
-from layers import ApplicationLayer, NetworkLayer, TransportLayer
+from config import PROTOCOL
+from layers import ApplicationLayer, NetworkLayer, TRANSPORT_LAYERS
 from utils import IterableBytes
 
 
 class OSIStack:
-    def __init__(self, name, packet_num, packet_size):
-        # Every layer in this stack will have a named logger
+    def __init__(self, name, packet_num, packet_size, scheduler, protocol=PROTOCOL, **channel):
+        # Every layer in this stack will have a named logger, and the layers
+        # of both stacks share the scheduler that drives the simulation.
+        # 'protocol' picks the transport layer, see 'config.py', and
+        # 'channel' may override the chances of the network layer, see 'network.py'.
         logger = getLogger(name)
         self.name = name
 
@@ -14,8 +18,8 @@ class OSIStack:
         self.app_layer = ApplicationLayer(
             IterableBytes(packet_num, packet_size)
         ).with_logger(logger)
-        self.transport_layer = TransportLayer().with_logger(logger)
-        self.network_layer = NetworkLayer().with_logger(logger)
+        self.transport_layer = TRANSPORT_LAYERS[protocol]().with_logger(logger).with_scheduler(scheduler)
+        self.network_layer = NetworkLayer(**channel).with_logger(logger).with_scheduler(scheduler)
 
         # Connect all the layers
         self.app_layer.register_below(self.transport_layer)
@@ -38,6 +42,11 @@ class OSIStack:
     def tick(self):
         self.app_layer.send_next_packet()
 
+    @property
+    def has_data(self):
+        # True while the application layer has data it has not sent yet
+        return bool(self.app_layer.payload)
+
     @property
     def received(self):
         return self.app_layer.payload
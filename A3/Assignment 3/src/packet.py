@@ -1,3 +1,33 @@
+from config import SEQUENCE_NUMBERS
+
+
+def wrap(number):
+    """
+    Returns:
+        int: The sequence number as it is sent on the wire, modulo SEQUENCE_NUMBERS.
+    """
+    return number % SEQUENCE_NUMBERS
+
+
+def unwrap(number, reference):
+    """
+    Turn a sequence number from the wire back into the count it was wrapped from,
+    taking the one closest to 'reference' (serial number arithmetic, RFC 1982).
+    The layers count sequence numbers from 0 without wrapping, and only wrap them
+    when they put them in a packet.
+
+    Args:
+        number (int): The sequence number from the wire.
+        reference (int): A sequence number that is less than SEQUENCE_NUMBERS / 2 away,
+            such as the start of the window.
+
+    Returns:
+        int: The sequence number, counted without wrapping.
+    """
+    half = SEQUENCE_NUMBERS // 2
+    return reference + (number - reference + half) % SEQUENCE_NUMBERS - half
+
+
 class Packet:
     """Represent a packet of data.
     Note - DO NOT REMOVE or CHANGE the data attribute!
@@ -9,8 +39,11 @@ class Packet:
         self.data = binary_data
         self.checksum = 0 
         self.ack = False            # True when sending response to Alice 
-        self.seqnr = 0              # Set when packet is sendt 
+        self.seqnr = 0              # Set when packet is sendt, modulo SEQUENCE_NUMBERS
+        self.acknr = 0              # On an ACK: the next seqnr the receiver expects (cumulative ACK), modulo SEQUENCE_NUMBERS
+        self.window = 0             # On an ACK: how many packets from acknr the receiver can take
         self.retry_count = 0        # Number of times a packet has been retransmitted or resent
+        self.sent_at = 0.0          # Simulated time the packet was first sent, to measure the RTT
         self.sendt = False     # Status attribute to track packet status
         self.ack = False
 
@@ -18,6 +51,27 @@ class Packet:
     
     # Extend me!
 
+    def copy(self):
+        """
+        Make a shallow copy of the packet, e.g. for the network to change without
+        changing the packet the sender keeps. The fields are copied one by one, which
+        is several times faster than copy.copy(); a new field must be added here too.
+
+        Returns:
+            Packet: The copy.
+        """
+        packet = Packet.__new__(Packet)
+        packet.data = self.data
+        packet.checksum = self.checksum
+        packet.ack = self.ack
+        packet.seqnr = self.seqnr
+        packet.acknr = self.acknr
+        packet.window = self.window
+        packet.retry_count = self.retry_count
+        packet.sent_at = self.sent_at
+        packet.sendt = self.sendt
+        return packet
+
     def increment_retry_count(self):
         """Increment the retry count to track the number of retransmissions."""
         self.retry_count += 1
@@ -0,0 +1,89 @@
+from config import ADAPTIVE_TIMEOUT, INITIAL_TIMEOUT, MIN_TIMEOUT, MAX_TIMEOUT
+
+
+class RTOEstimator:
+    """
+    Estimates the retransmission timeout (RTO) from the measured round-trip times,
+    as TCP does (Jacobson/Karels, RFC 6298).
+
+    SRTT is a smoothed average of the round-trip times and RTTVAR a smoothed average of
+    how far they are from it, and the timeout is SRTT + 4 * RTTVAR, within 'minimum' and
+    'maximum'. A timeout doubles the RTO (exponential backoff), until the next measurement
+    or until an ACK acknowledges new data (as Linux does), whichever comes first.
+    The caller measures only packets that were not retransmitted (Karn's algorithm), since
+    the ACK of a retransmitted packet may belong to any of its copies. When most packets
+    are lost, most of them are retransmitted, and only clearing the backoff on new ACKs
+    keeps the RTO from staying at 'maximum'.
+
+    If 'trace' is enabled, every change of the RTO is recorded in it, as
+    (time, rto, srtt, rttvar, reason).
+    """
+
+    ALPHA = 1 / 8       # Weight of a new measurement in SRTT
+    BETA = 1 / 4        # Weight of a new deviation in RTTVAR
+    K = 4               # How many RTTVARs the timeout leaves for variation
+
+    def __init__(self, initial=INITIAL_TIMEOUT, minimum=MIN_TIMEOUT, maximum=MAX_TIMEOUT,
+                 adaptive=ADAPTIVE_TIMEOUT, trace=False):
+        """
+        Args:
+            initial (float): The RTO until the first measurement, in seconds.
+            minimum (float): The smallest RTO.
+            maximum (float): The largest RTO, also after backoff.
+            adaptive (bool): If False, the RTO stays at 'initial', as a fixed timeout.
+            trace (bool): Whether to record every change of the RTO.
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.rto = initial
+        self.base = initial         # The RTO without backoff
+        self.srtt = None
+        self.rttvar = None
+        self.trace = [(0.0, self.rto, None, None, "initial")] if trace else None
+
+    def sample(self, rtt, now):
+        """
+        Update the estimate with a measured round-trip time.
+
+        Args:
+            rtt (float): The time from sending a packet to receiving its ACK.
+            now (float): The current time, for the trace.
+        """
+        if not self.adaptive:
+            return
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            # RTTVAR is updated first, with the deviation from the old SRTT
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.base = min(max(self.srtt + self.K * self.rttvar, self.minimum), self.maximum)
+        self.set_rto(self.base, now, "sample")
+
+    def back_off(self, now):
+        """
+        Double the RTO after a timeout, up to the maximum.
+
+        Args:
+            now (float): The current time, for the trace.
+        """
+        if self.adaptive:
+            self.set_rto(self.rto * 2, now, "backoff")
+
+    def clear_backoff(self, now):
+        """
+        Go back to the RTO without backoff, after an ACK that acknowledges new data.
+
+        Args:
+            now (float): The current time, for the trace.
+        """
+        self.set_rto(self.base, now, "ack")
+
+    def set_rto(self, rto, now, reason):
+        rto = min(max(rto, self.minimum), self.maximum)
+        if rto != self.rto:
+            self.rto = rto
+            if self.trace is not None:
+                self.trace.append((now, rto, self.srtt, self.rttvar, reason))
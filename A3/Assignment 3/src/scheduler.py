@@ -0,0 +1,90 @@
+from heapq import heapify, heappop, heappush
+
+
+class Event:
+    """A callback that is due at a point in virtual time. Returned by Scheduler.call_later()."""
+
+    __slots__ = ("time", "order", "callback", "args", "pending")
+
+    def __init__(self, time, order, callback, args):
+        self.time = time
+        self.order = order
+        self.callback = callback
+        self.args = args
+        self.pending = True         # False once the event has run or been cancelled
+
+    def __lt__(self, other):
+        # Events that are due at the same time run in the order they were scheduled
+        return (self.time, self.order) < (other.time, other.order)
+
+
+class Scheduler:
+    """
+    A discrete-event scheduler with a virtual clock.
+
+    Instead of waiting for real time to pass (with threading.Timer and time.sleep), the
+    delays of the network and the retransmission timers are events in a priority queue,
+    ordered by the virtual time they are due. step() jumps the clock to the next event and
+    runs it, so a simulation takes as long as its events take to run, and two runs with the
+    same seed run the same events in the same order.
+    """
+
+    # Cancelled events are left in the queue until they are due. When they make up more
+    # than half of the queue, and more than this many, the queue is rebuilt without them.
+    COMPACT_THRESHOLD = 1024
+
+    def __init__(self):
+        self.now = 0.0              # The virtual time, in seconds
+        self.events_run = 0         # The number of events that have run
+        self._queue = []
+        self._order = 0             # Breaks ties between events that are due at the same time
+        self._cancelled = 0         # The number of cancelled events in the queue
+
+    def call_later(self, delay, callback, *args):
+        """
+        Call callback(*args) after 'delay' seconds of virtual time.
+
+        Args:
+            delay (float): The seconds from now.
+            callback (function): What to call.
+
+        Returns:
+            Event: The event, which can be given to cancel().
+        """
+        event = Event(self.now + delay, self._order, callback, args)
+        self._order += 1
+        heappush(self._queue, event)
+        return event
+
+    def cancel(self, event):
+        """Cancel an event that was returned by call_later(), if it has not run yet."""
+        if event.pending:
+            event.pending = False
+            self._cancelled += 1
+            if self._cancelled > self.COMPACT_THRESHOLD and self._cancelled * 2 > len(self._queue):
+                self._queue = [event for event in self._queue if event.pending]
+                heapify(self._queue)
+                self._cancelled = 0
+
+    def step(self):
+        """
+        Advance the clock to the next event that is not cancelled, and run it.
+
+        Returns:
+            bool: False if there were no events left to run.
+        """
+        while self._queue:
+            event = heappop(self._queue)
+            if not event.pending:
+                self._cancelled -= 1
+                continue
+            event.pending = False
+            self.now = event.time
+            self.events_run += 1
+            event.callback(*event.args)
+            return True
+        return False
+
+    def __len__(self):
+        """The number of events in the queue, including cancelled ones that have not been removed yet."""
+        return len(self._queue)
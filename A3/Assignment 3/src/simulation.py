@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 
-from logging import basicConfig
-from logging import DEBUG as LOGGER_DEBUG
+import csv
+from argparse import ArgumentParser
+from logging import basicConfig, disable
+from logging import DEBUG as LOGGER_DEBUG, WARNING as LOGGER_WARNING
 from random import seed
 from sys import exit
 from signal import signal, SIGINT
+from time import process_time
 
-from config import PACKET_NUM, PACKET_SIZE, RANDOM_SEED, RANDOM_RUN
+from config import PACKET_NUM, PACKET_SIZE, PROTOCOL, RANDOM_SEED, RANDOM_RUN
+from layers import TRANSPORT_LAYERS
+from congestion import CongestionControl
 from osi import OSIStack
+from rto import RTOEstimator
+from scheduler import Scheduler
 
 """
 Written by: Raymon Skjørten Hansen
@@ -29,29 +36,148 @@ def sigint_handler(signum, frame):
 
 
 class Sim:
-    def __init__(self):
+    def __init__(self, packet_num=PACKET_NUM, protocol=PROTOCOL, timeout=None, window=None, trace=False,
+                 **channel):
+        # Both stacks share one scheduler, whose virtual clock drives the
+        # network delays and the retransmission timers.
+        # 'timeout' is a fixed retransmission timeout instead of the adaptive
+        # one, 'window' a fixed window instead of congestion control, and 'trace' records how the timeout and the congestion window
+        # change, see 'rto.py' and 'congestion.py'.
+        # 'channel' may override the chances in config.py, see 'network.py'.
+        self.scheduler = Scheduler()
+        self.protocol = protocol
+
         # Make both of our OSI stacks and connect them
-        self.alice = OSIStack("Alice", PACKET_NUM, PACKET_SIZE)
-        self.bob = OSIStack("Bob", 0, 0)
+        self.alice = OSIStack("Alice", packet_num, PACKET_SIZE, self.scheduler, protocol, **channel)
+        self.bob = OSIStack("Bob", 0, 0, self.scheduler, protocol, **channel)
 
         self.alice.connect(self.bob)
         self.bob.connect(self.alice)
 
+        for stack in (self.alice, self.bob):
+            if timeout is None:
+                stack.transport_layer.rto = RTOEstimator(trace=trace)
+            else:
+                stack.transport_layer.rto = RTOEstimator(timeout, adaptive=False, trace=trace)
+            if window is not None:
+                stack.transport_layer.congestion = None
+                stack.transport_layer.window_size = window
+            elif stack.transport_layer.congestion:
+                stack.transport_layer.congestion = CongestionControl(trace=trace)
+
     def should_continue(self):
         # We continue so long as the data isn't received
         return self.bob.received != self.alice.original_data
 
     def run(self):
-        # This is the main program loop
+        # Traps 'Ctrl-C' and try to exit nicely.
+        signal(SIGINT, sigint_handler)
+
+        # This is the main program loop. Alice sends while she has data,
+        # and after that we run the events that are due next (delayed
+        # packets and timeouts) until Bob has received everything.
         while self.should_continue():
-            self.alice.tick()
-            # Traps 'Ctrl-C' and try to exit nicely.
-            signal(SIGINT, sigint_handler)
+            if self.alice.has_data:
+                self.alice.tick()
+            elif not self.scheduler.step():
+                raise RuntimeError("Bob is missing data, and nothing is on its way")
+
+    def statistics(self):
+        """
+        Returns:
+            dict: How the run went. The goodput is the data Bob received per second of
+            simulated time, the efficiency is the share of the data packets Alice
+            sent that were not retransmissions, and the duplicates are the packets
+            Bob received again after delivering them, i.e. spurious retransmissions
+            (or ones whose ACK was lost).
+        """
+        transport = self.alice.transport_layer
+        received = len(self.bob.received.bytes)
+        transmissions = transport.packets_sent + transport.retransmissions
+        return {
+            "protocol": self.protocol,
+            "bytes": received,
+            "seconds": self.scheduler.now,
+            "goodput": received / self.scheduler.now if self.scheduler.now else float("inf"),
+            "transmissions": transmissions,
+            "retransmissions": transport.retransmissions,
+            "duplicates": self.bob.transport_layer.duplicates,
+            "efficiency": transport.packets_sent / transmissions if transmissions else 1.0,
+            "timeout": transport.rto.rto,
+            "cwnd": transport.congestion.cwnd if transport.congestion else None,
+        }
+
+    def rto_trace(self):
+        """
+        Returns:
+            list: How Alice's retransmission timeout changed during the run, as
+            (time, rto, srtt, rttvar, reason), if the Sim was made with 'trace'.
+        """
+        return self.alice.transport_layer.rto.trace
+
+    def cwnd_trace(self):
+        """
+        Returns:
+            list: How Alice's congestion window changed during the run, as
+            (time, cwnd, ssthresh, reason), if the Sim was made with 'trace'
+            and congestion control is on.
+        """
+        congestion = self.alice.transport_layer.congestion
+        return congestion.trace if congestion else None
+
+
+def write_trace(path, header, rows):
+    # Write a trace as a CSV file, with a header row
+    with open(path, "w", newline="") as trace_file:
+        writer = csv.writer(trace_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="INF-2300 reliable transport simulation")
+    parser.add_argument("--packets", type=int, default=PACKET_NUM,
+                        help=f"number of packets to send (default: {PACKET_NUM})")
+    parser.add_argument("--protocol", choices=sorted(TRANSPORT_LAYERS), default=PROTOCOL,
+                        help=f"how lost packets are recovered (default: {PROTOCOL})")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED,
+                        help="seed of the random run (default: RANDOM_SEED in config.py)")
+    parser.add_argument("--drop", type=float, help="chance that a packet is dropped (default: config.py)")
+    parser.add_argument("--corrupt", type=float, help="chance that a packet is corrupted (default: config.py)")
+    parser.add_argument("--delay", type=float, help="chance that a packet is delayed (default: config.py)")
+    parser.add_argument("--timeout", type=float,
+                        help="a fixed retransmission timeout in seconds, instead of the adaptive one")
+    parser.add_argument("--window", type=int,
+                        help="a fixed window of packets in flight, instead of congestion control")
+    parser.add_argument("--rto-trace", metavar="FILE",
+                        help="write how the retransmission timeout changed to a CSV file")
+    parser.add_argument("--cwnd-trace", metavar="FILE",
+                        help="write how the congestion window changed to a CSV file")
+    parser.add_argument("--quiet", action="store_true", help="do not log every dropped, corrupted and delayed packet")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_arguments()
+    if args.quiet:
+        disable(LOGGER_WARNING)
     if not RANDOM_RUN:
-        seed(RANDOM_SEED)
-    sim = Sim()
+        seed(args.seed)
+
+    channel = {"drop_chance": args.drop, "corrupt_chance": args.corrupt, "delay_chance": args.delay}
+    trace = args.rto_trace is not None or args.cwnd_trace is not None
+    sim = Sim(args.packets, args.protocol, args.timeout, args.window, trace, **{name: chance for name, chance in channel.items() if chance is not None})
+    started = process_time()
     sim.run()
     print("Finished!")
+    print(f"{args.packets} packets in {sim.scheduler.now:.1f} s of simulated time, "
+          f"{sim.scheduler.events_run} events, {process_time() - started:.2f} s of CPU time")
+    statistics = sim.statistics()
+    print(f"{statistics['protocol']}: goodput {statistics['goodput']:.2f} bytes/s, "
+          f"{statistics['transmissions']} data packets sent, {statistics['retransmissions']} of them again "
+          f"(efficiency {statistics['efficiency']:.1%}), {statistics['duplicates']} duplicates received, "
+          f"final timeout {statistics['timeout']:.2f} s")
+    if args.rto_trace:
+        write_trace(args.rto_trace, ("time", "rto", "srtt", "rttvar", "reason"), sim.rto_trace())
+    if args.cwnd_trace:
+        write_trace(args.cwnd_trace, ("time", "cwnd", "ssthresh", "reason"), sim.cwnd_trace() or [])
@@ -7,7 +7,9 @@ class IterableBytes:
     Represents each OSI stacks growing and shrinking amount of data."""
 
     def __init__(self, packet_num, packet_size):
-        self.bytes = generate_random_letters(packet_num * packet_size)
+        # A bytearray, so put_chunk() appends in place instead of
+        # copying all the bytes received so far
+        self.bytes = bytearray(generate_random_letters(packet_num * packet_size))
         self.chunk_size = packet_size
         self.pos = 0
 
@@ -19,7 +21,7 @@ class IterableBytes:
         # Return the next chunk of bytes from the pool of byte
         if self.pos >= len(self.bytes):
             return None
-        chunk = self.bytes[self.pos : self.pos + self.chunk_size]
+        chunk = bytes(self.bytes[self.pos : self.pos + self.chunk_size])
         self.pos += self.chunk_size
         return chunk
 
@@ -31,7 +33,7 @@ class IterableBytes:
         return self.bytes == other.bytes
 
     def __str__(self):
-        return f"{self.bytes}"
+        return f"{bytes(self.bytes)}"
 
     def __bool__(self):
         return len(self.bytes) - self.pos > 0
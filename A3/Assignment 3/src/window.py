@@ -0,0 +1,104 @@
+class SendWindow:
+    """
+    The packets a sender has sent and not had ACKed yet, in a ring buffer.
+
+    The packets are kept by their sequence number, counted from 0 without wrapping
+    around (only the numbers on the wire wrap, see packet.py), in slot
+    'seqnr % capacity'. The window runs from 'base', the oldest packet, up to 'end',
+    the next packet to be sent. Appending, removing the oldest packet and looking a
+    packet up by its sequence number take the same time however many packets are in
+    flight. The ring doubles its capacity when it is full.
+    """
+
+    def __init__(self, capacity=64):
+        """
+        Args:
+            capacity (int): The packets the ring has room for at first. Rounded up to a power of two.
+        """
+        size = 1
+        while size < capacity:
+            size *= 2
+        self.slots = [None] * size
+        self.mask = size - 1        # seqnr & mask == seqnr % capacity
+        self.base = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.base
+
+    def __bool__(self):
+        return self.end != self.base
+
+    def __iter__(self):
+        # The packets from the oldest to the newest
+        slots, mask = self.slots, self.mask
+        for seqnr in range(self.base, self.end):
+            yield slots[seqnr & mask]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, packet):
+        """
+        Add the packet with sequence number 'end' to the window.
+
+        Args:
+            packet (Packet): The packet that is sent.
+        """
+        if self.end - self.base > self.mask:
+            self.grow()
+        self.slots[self.end & self.mask] = packet
+        self.end += 1
+
+    def get(self, seqnr):
+        """
+        Returns:
+            Packet: The packet with the sequence number, or None if it is not in the window.
+        """
+        if self.base <= seqnr < self.end:
+            return self.slots[seqnr & self.mask]
+        return None
+
+    def first(self):
+        """
+        Returns:
+            Packet: The oldest packet in the window, which must not be empty.
+        """
+        return self.slots[self.base & self.mask]
+
+    def popleft(self):
+        """
+        Remove the oldest packet from the window, which must not be empty.
+
+        Returns:
+            Packet: The packet.
+        """
+        index = self.base & self.mask
+        packet = self.slots[index]
+        self.slots[index] = None
+        self.base += 1
+        return packet
+
+    def slide_to(self, seqnr):
+        """
+        Remove every packet before 'seqnr' from the window.
+
+        Returns:
+            int: The number of packets that were removed.
+        """
+        end = min(seqnr, self.end)
+        removed = max(0, end - self.base)
+        slots, mask = self.slots, self.mask
+        for seqnr in range(self.base, end):
+            slots[seqnr & mask] = None
+        self.base += removed
+        return removed
+
+    def grow(self):
+        """Double the capacity of the ring, keeping every packet in it."""
+        slots = [None] * (len(self.slots) * 2)
+        mask = len(slots) - 1
+        for seqnr in range(self.base, self.end):
+            slots[seqnr & mask] = self.slots[seqnr & self.mask]
+        self.slots = slots
+        self.mask = mask